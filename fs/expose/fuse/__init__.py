@@ -2,37 +2,41 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import ctypes
-import fuse
-
 from .operations import PyfilesystemFuseOperations
-# from .mounter import PyfilesystemFuseMounter
+from .mounter import PyfilesystemFuseMounter
 
-__all__ = ["mount", "PyfilesystemFuseOperations"]
+__all__ = ["mount", "PyfilesystemFuseMounter", "PyfilesystemFuseOperations"]
 __version__ = "0.1.0"
 __author__ = "althonos"
 __home_page__ = "https://github.com/althonos/fs.expose"
 
 
-# def mount(filesystem, mountpoint, debug=False, foreground=False, threads=True):
-#
-#         args = ["", mountpoint]
-#         if debug: args.append('-d')
-#         if foreground: args.append('-f')
-#         if not threads: args.append('-s')
-#
-#         args = [arg.encode('utf-8') for arg in args]
-#
-#         argv = ()
-#
-#
-#
-#
-#         operations = PyfilesystemFuseOperations(filesystem)
-#
-#
-#
-#
-#
-#
-#         return fuse.FUSE(operations, mountpoint, debug=debug, foreground=foreground)
+def mount(filesystem, mountpoint, foreground=False, **options):
+    """Mount a filesystem on a directory using FUSE.
+
+    Arguments:
+        filesystem (~fs.base.FS or str): the filesystem to mount, or
+            an FS URL to open.
+        mountpoint (str): the directory to mount the filesystem on.
+        foreground (bool): set to `True` to serve the mount in the
+            current process, blocking until it is unmounted.
+
+    Other keyword arguments are passed to `PyfilesystemFuseMounter`.
+
+    Returns:
+        PyfilesystemFuseMounter: the mount, which can be unmounted
+        with its `~PyfilesystemFuseMounter.unmount` method, or used
+        as a context manager.
+
+    Example:
+        >>> with mount('mem://', '/mnt/mem', kernel_cache=True):
+        ...     os.listdir('/mnt/mem')
+        []
+
+    """
+    mounter = PyfilesystemFuseMounter(filesystem, mountpoint, **options)
+    if foreground:
+        mounter.run()
+    else:
+        mounter.start()
+    return mounter
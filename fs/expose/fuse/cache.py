@@ -0,0 +1,340 @@
+# coding: utf-8
+"""Caches used to reduce the number of round trips to the exposed filesystem.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import collections
+import threading
+
+from ...path import isbase, recursepath
+
+from .utils import monotonic
+
+
+class TTLCache(object):
+    """A bounded, thread-safe LRU mapping whose entries expire after a TTL.
+
+    Arguments:
+        ttl (float): the number of seconds an entry stays valid. A
+            non-positive value disables the cache entirely.
+        maxsize (int): the maximum number of entries to keep before
+            evicting the least recently used ones.
+
+    """
+
+    def __init__(self, ttl=1.0, maxsize=4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _count=False) is not None
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, key, default=None, _count=True):
+        """Get the value cached for ``key``, or ``default`` on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                deadline, value = entry
+                if deadline > monotonic():
+                    # move the entry to the most recently used end
+                    del self._entries[key]
+                    self._entries[key] = entry
+                    if _count:
+                        self.hits += 1
+                    return value
+                del self._entries[key]
+            if _count:
+                self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Cache ``value`` for ``key`` for the next ``ttl`` seconds.
+
+        Arguments:
+            key (object): the key to cache the value for.
+            value (object): the value to cache.
+            ttl (float): the number of seconds the entry stays valid,
+                or `None` to use the `ttl` of the cache.
+
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, *keys):
+        """Remove the entries of the given keys, if any.
+        """
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def discard_tree(self, path):
+        """Remove the entry of ``path`` and of every path below it.
+        """
+        with self._lock:
+            for key in [k for k in self._entries if isbase(path, k)]:
+                del self._entries[key]
+
+    def purge(self):
+        """Remove the expired entries.
+
+        Returns:
+            int: the number of entries left.
+
+        """
+        with self._lock:
+            now = monotonic()
+            for key in [k for k, (deadline, _) in self._entries.items() if deadline <= now]:
+                del self._entries[key]
+            return len(self._entries)
+
+    def clear(self):
+        """Remove all entries and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+
+class BlockCache(object):
+    """A bounded, thread-safe LRU cache of fixed-size blocks of files.
+
+    Blocks are keyed by the path of the file they belong to, a version
+    of that file (such as its modification time and size), and their
+    index, so that a file modified behind the mount is never served
+    from stale blocks.
+
+    Arguments:
+        block_size (int): the size of a block, in bytes.
+        maxbytes (int): the maximum number of bytes to keep cached
+            before evicting the least recently used blocks. A
+            non-positive value disables the cache entirely.
+
+    """
+
+    def __init__(self, block_size=65536, maxbytes=32*1024*1024):
+        self.block_size = block_size
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._blocks = collections.OrderedDict()
+        self._paths = collections.defaultdict(set)
+        self._size = 0
+
+    def __len__(self):
+        return len(self._blocks)
+
+    @property
+    def enabled(self):
+        return self.block_size > 0 and self.maxbytes >= self.block_size
+
+    @property
+    def size(self):
+        """int: the number of bytes currently cached.
+        """
+        return self._size
+
+    def _get(self, key, _count=True):
+        with self._lock:
+            block = self._blocks.pop(key, None)
+            if block is not None:
+                self._blocks[key] = block
+            if _count:
+                if block is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return block
+
+    def _set(self, key, block):
+        with self._lock:
+            if key in self._blocks:
+                self._size -= len(self._blocks.pop(key))
+            self._blocks[key] = block
+            self._paths[key[0]].add(key)
+            self._size += len(block)
+            while self._size > self.maxbytes:
+                old_key, old_block = self._blocks.popitem(last=False)
+                self._forget(old_key, old_block)
+
+    def _forget(self, key, block):
+        self._size -= len(block)
+        keys = self._paths[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._paths[key[0]]
+
+    def read(self, path, version, size, offset, load, _count=True):
+        """Read up to ``size`` bytes at ``offset`` of a file, block by block.
+
+        Arguments:
+            path (str): the normalized path of the file.
+            version (object): a hashable version of the file content.
+            size (int): the number of bytes to read.
+            offset (int): the offset to read from.
+            load (callable): a function called as ``load(size, offset)``
+                to read a missing block from the file.
+
+        Returns:
+            bytes: the data read, shorter than ``size`` at end of file.
+
+        """
+        if size <= 0:
+            return b''
+        bs = self.block_size
+        first, last = offset // bs, (offset + size - 1) // bs
+        chunks = []
+        for index in range(first, last + 1):
+            key = (path, version, index)
+            block = self._get(key, _count)
+            if block is None:
+                block = load(bs, index * bs)
+                if block:
+                    self._set(key, block)
+            chunks.append(block)
+            if len(block) < bs:
+                break
+        start = offset - first * bs
+        return b''.join(chunks)[start:start + size]
+
+    def discard(self, path):
+        """Remove every cached block of the file at ``path``.
+        """
+        with self._lock:
+            for key in self._paths.pop(path, ()):
+                self._size -= len(self._blocks.pop(key))
+
+    def discard_tree(self, path):
+        """Remove the blocks of ``path`` and of every file below it.
+        """
+        with self._lock:
+            for p in [p for p in self._paths if isbase(path, p)]:
+                for key in self._paths.pop(p):
+                    self._size -= len(self._blocks.pop(key))
+
+    def clear(self):
+        """Remove all blocks and reset the counters.
+        """
+        with self._lock:
+            self._blocks.clear()
+            self._paths.clear()
+            self._size = 0
+            self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+
+class GenerationTable(object):
+    """A bounded, thread-safe table of the local modifications of paths.
+
+    Every modification gets a generation greater than all the previous
+    ones, and the generation of a path is the greatest generation of the
+    path and of its ancestors, so that modifying a whole tree is a single
+    update. Readers `pin` the last generation when they start, so that
+    they can tell whether a path was modified since.
+
+    Entries only matter to the readers started before them, so they are
+    purged once every such reader is unpinned. When the table is still
+    full, the oldest entries are evicted, and the greatest evicted
+    generation applies to every path from then on, so that readers may
+    only see modifications that did not happen, never miss one.
+
+    Arguments:
+        maxsize (int): the maximum number of paths to keep.
+
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.last = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._pins = collections.Counter()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path):
+        """Get the generation of the last modification of ``path``.
+        """
+        with self._lock:
+            generation = self._floor
+            for p in recursepath(path):
+                generation = max(generation, self._entries.get(p, 0))
+            return generation
+
+    def bump(self, path):
+        """Record a modification of ``path`` and of every path below it.
+
+        Returns:
+            int: the new generation of ``path``.
+
+        """
+        with self._lock:
+            self.last += 1
+            self._entries.pop(path, None)
+            self._entries[path] = self.last
+            if len(self._entries) > self.maxsize:
+                self._purge()
+            return self.last
+
+    def _purge(self):
+        # entries are ordered by generation, since updated ones move last
+        # and only the ones newer than the oldest pin are still needed
+        oldest = min(self._pins) if self._pins else self.last
+        while self._entries:
+            path, generation = next(iter(self._entries.items()))
+            needed = generation > oldest
+            if needed and len(self._entries) <= self.maxsize // 2:
+                break
+            del self._entries[path]
+            if needed:
+                self._floor = generation
+
+    def pin(self):
+        """Start a reader, and get the last generation to compare with.
+        """
+        with self._lock:
+            self._pins[self.last] += 1
+            return self.last
+
+    def unpin(self, generation):
+        """Stop a reader started with `pin`.
+        """
+        with self._lock:
+            self._pins[generation] -= 1
+            if self._pins[generation] <= 0:
+                del self._pins[generation]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pins.clear()
+            self._floor = 0
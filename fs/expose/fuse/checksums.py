@@ -0,0 +1,101 @@
+# coding: utf-8
+"""Persistent cache of the content digests of the files of a mount.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import hashlib
+import sqlite3
+import threading
+
+from ...path import isbase
+
+
+class ChecksumCache(object):
+    """A thread-safe cache of file digests, stored in an SQLite database.
+
+    Digests are keyed by the path, size and modification time of the
+    file they were computed from, so that a digest is never returned
+    for a file modified since, even behind the mount.
+
+    Arguments:
+        filename (str): the path to the database, to keep digests
+            across mounts, or `None` to keep them in memory.
+
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename or ':memory:', check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS digests ('
+            ' path TEXT, algorithm TEXT, size INTEGER, mtime REAL, digest TEXT,'
+            ' PRIMARY KEY (path, algorithm))'
+        )
+        self._db.commit()
+        # keep the paths in memory so that discarding the digests of a
+        # file without any, like on every write, does not hit the database
+        self._paths = {row[0] for row in self._db.execute('SELECT path FROM digests')}
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+
+    def get(self, path, size, mtime, algorithm):
+        """Get the digest of a file, or `None` if it is not cached.
+        """
+        if path not in self._paths:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest FROM digests WHERE path = ? AND algorithm = ?'
+                ' AND size = ? AND mtime = ?', (path, algorithm, size, mtime)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def update(self, path, size, mtime, digests):
+        """Cache the ``{algorithm: digest}`` mapping of a file.
+        """
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?)',
+                [(path, algo, size, mtime, digest) for algo, digest in digests.items()]
+            )
+            self._db.commit()
+            self._paths.add(path)
+
+    def discard(self, path):
+        """Remove the digests of the file at ``path``, if any.
+        """
+        if path in self._paths:
+            with self._lock:
+                self._db.execute('DELETE FROM digests WHERE path = ?', (path,))
+                self._db.commit()
+                self._paths.discard(path)
+
+    def discard_tree(self, path):
+        """Remove the digests of ``path`` and of every file below it.
+        """
+        with self._lock:
+            paths = [p for p in self._paths if isbase(path, p)]
+        for p in paths:
+            self.discard(p)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def compute(file, algorithms, chunk_size=1024*1024):
+        """Compute several digests of a file in a single streaming pass.
+
+        Returns:
+            dict: a mapping of each algorithm to the hex digest.
+
+        """
+        hashes = {algo: hashlib.new(algo) for algo in algorithms}
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            for h in hashes.values():
+                h.update(chunk)
+        return {algo: h.hexdigest() for algo, h in hashes.items()}
@@ -0,0 +1,150 @@
+# coding: utf-8
+"""Background warm-up of the metadata caches of a fresh mount.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import fnmatch
+import stat
+import threading
+
+from six.moves import queue
+
+from ...path import combine
+
+from .utils import monotonic
+
+
+class WarmupCrawler(object):
+    """Walk a filesystem breadth-first to fill the caches of a mount.
+
+    Directories are listed on a bounded pool of daemon threads, with
+    the same scan as `~PyfilesystemFuseOperations.readdir`, so that the
+    attributes of every entry are cached ahead of demand. Entries of
+    paths modified while their directory was listed are dropped, and
+    the crawl stops as soon as the attribute cache is full of valid
+    entries, so that it never evicts entries used by foreground
+    operations.
+
+    Arguments:
+        operations (PyfilesystemFuseOperations): the operations whose
+            caches to fill.
+        workers (int): the number of threads listing directories.
+        max_depth (int): the maximum depth of the crawl, where ``1``
+            only lists the root directory, or `None` for no limit.
+        exclude_dirs (list): wildcard patterns of names of directories
+            not to crawl, like the ``exclude_dirs`` of `~fs.walk.Walker`.
+        max_rate (float): the maximum number of directories listed per
+            second, or `None` for no limit.
+        ttl (float): the number of seconds the attributes cached by the
+            crawl stay valid, or `None` to use the attribute timeout.
+            With the default attribute timeout, most entries expire
+            before they are used, but a longer ``ttl`` also serves
+            changes made behind the mount late for that long.
+
+    """
+
+    def __init__(self,
+                 operations,
+                 workers=2,
+                 max_depth=None,
+                 exclude_dirs=None,
+                 max_rate=None,
+                 ttl=None):
+        self.operations = operations
+        self.workers = workers
+        self.max_depth = max_depth
+        self.exclude_dirs = list(exclude_dirs or ())
+        self.max_rate = max_rate
+        self.ttl = ttl
+        self.directories = 0
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._next = 0
+
+    def start(self, path='/'):
+        """Start crawling the directory at ``path`` in the background.
+        """
+        self._stopped.clear()
+        self._jobs.put((path, 0))
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        """Wait for the crawl to be done.
+        """
+        self._jobs.join()
+
+    def stop(self):
+        """Abandon the crawl, and stop the worker threads.
+        """
+        self._stopped.set()
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            self._jobs.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _excluded(self, name):
+        return any(fnmatch.fnmatchcase(name, pattern) for pattern in self.exclude_dirs)
+
+    def _throttle(self):
+        if not self.max_rate:
+            return
+        with self._lock:
+            now = monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + 1.0 / self.max_rate
+        if delay > 0:
+            self._stopped.wait(delay)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                if not self._stopped.is_set():
+                    self._throttle()
+                    self._crawl(*job)
+            except Exception:
+                # the directory may have been removed since it was listed
+                pass
+            finally:
+                self._jobs.task_done()
+
+    def _full(self):
+        # expired entries count in the size of the cache until purged
+        cache = self.operations.attr_cache
+        return len(cache) >= cache.maxsize and cache.purge() >= cache.maxsize
+
+    def _crawl(self, path, depth):
+        ops = self.operations
+        if self._full():
+            return
+        deeper = self.max_depth is None or depth + 1 < self.max_depth
+        since = ops.generations.pin()
+        try:
+            names = []
+            for name, result in ops._stat_entries(path, ops._scan(path), self.ttl):
+                names.append(name)
+                if self._stopped.is_set() or self._full():
+                    break
+                if deeper and stat.S_ISDIR(result.get('st_mode', 0)) and not self._excluded(name):
+                    self._jobs.put((combine(path, name), depth + 1))
+            # the paths modified since the scan started were invalidated
+            # before or after their entry was cached, so check them after
+            key = ops._key(path)
+            for name in names:
+                child = combine(key, name)
+                if ops.generations.get(child) > since:
+                    ops.attr_cache.discard(child)
+        finally:
+            ops.generations.unpin(since)
+        with self._lock:
+            self.directories += 1
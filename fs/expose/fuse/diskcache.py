@@ -0,0 +1,255 @@
+# coding: utf-8
+"""Persistent cache of the content of the files of a mount, on local disk.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from ...path import isbase
+
+
+class DiskCache(object):
+    """A bounded cache of file blocks, kept in a local directory.
+
+    Blocks are stored in one file each, keyed by the path, modification
+    time and size of the file they belong to, and by their offset and
+    size, so that they outlive the mount while never being served for a
+    file modified since, nor for a mount with another block size. Their
+    metadata is kept in an SQLite database, only updated once a block
+    file is completely written and committed in batches, and blocks are
+    checked against their recorded length and CRC32 when read back, so
+    that a crash never causes corrupted data to be served.
+
+    Arguments:
+        directory (str): the directory to store blocks in, created if
+            needed.
+        maxbytes (int): the maximum number of bytes of blocks to keep
+            before evicting the least recently used ones.
+
+    """
+
+    # the number of blocks stored between two commits of the database
+    _commit_interval = 64
+
+    def __init__(self, directory, maxbytes=1024*1024*1024):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS blocks ('
+            ' name TEXT PRIMARY KEY, path TEXT, length INTEGER,'
+            ' crc INTEGER, atime REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS blocks_atime ON blocks (atime)')
+        self._db.commit()
+        # access times are only written to the database before evicting
+        # blocks, so that cache hits do not need to write anything
+        self._touched = {}
+        self._uncommitted = 0
+        self._recover()
+
+    def _recover(self):
+        """Drop the blocks missing from disk, and the files not indexed.
+        """
+        rows = self._db.execute('SELECT name, path, length FROM blocks').fetchall()
+        names = set()
+        self._paths = {}
+        self.size = 0
+        missing = []
+        for name, path, length in rows:
+            if os.path.isfile(self._filename(name)):
+                names.add(name)
+                self._paths[path] = self._paths.get(path, 0) + 1
+                self.size += length
+            else:
+                missing.append((name,))
+        self._db.executemany('DELETE FROM blocks WHERE name = ?', missing)
+        self._db.commit()
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.block') and filename[:-6] not in names:
+                os.remove(os.path.join(self.directory, filename))
+            elif filename.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, filename))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM blocks').fetchone()[0]
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _filename(self, name):
+        return os.path.join(self.directory, name + '.block')
+
+    @staticmethod
+    def _name(path, version, offset, size):
+        key = '{}\0{!r}\0{}\0{}'.format(path, version, offset, size).encode('utf-8')
+        return hashlib.sha1(key).hexdigest()
+
+    def _commit(self):
+        self._db.commit()
+        self._uncommitted = 0
+
+    def get(self, path, version, offset, size):
+        """Get the block of ``size`` bytes at ``offset`` in a file.
+
+        Returns:
+            bytes: the block, which is shorter than ``size`` at the end
+            of the file, or `None` if it is not cached.
+
+        """
+        name = self._name(path, version, offset, size)
+        with self._lock:
+            row = None
+            if path in self._paths:
+                row = self._db.execute(
+                    'SELECT length, crc FROM blocks WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+        try:
+            with io.open(self._filename(name), 'rb') as f:
+                block = f.read()
+        except (IOError, OSError):
+            block = None
+        if block is None or len(block) != row[0] or zlib.crc32(block) & 0xffffffff != row[1]:
+            self._remove(name, path)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._touched[name] = time.time()
+        return block
+
+    def set(self, path, version, offset, size, block):
+        """Store the block of ``size`` bytes at ``offset`` in a file.
+
+        Old blocks are evicted if needed.
+
+        """
+        name = self._name(path, version, offset, size)
+        filename = self._filename(name)
+        tmp = '{}.{}.tmp'.format(filename, threading.current_thread().ident)
+        with io.open(tmp, 'wb') as f:
+            f.write(block)
+        os.rename(tmp, filename)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT length FROM blocks WHERE name = ?', (name,)).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?)',
+                (name, path, len(block), zlib.crc32(block) & 0xffffffff, time.time()))
+            self._uncommitted += 1
+            if self._uncommitted >= self._commit_interval:
+                self._commit()
+            if row is None:
+                self._paths[path] = self._paths.get(path, 0) + 1
+                self.size += len(block)
+            else:
+                self.size += len(block) - row[0]
+            if self.size > self.maxbytes:
+                self._evict()
+
+    def _evict(self):
+        self._db.executemany(
+            'UPDATE blocks SET atime = ? WHERE name = ?',
+            [(atime, name) for name, atime in self._touched.items()])
+        self._touched.clear()
+        rows = self._db.execute('SELECT name, path, length FROM blocks ORDER BY atime')
+        evicted = []
+        for name, path, length in rows:
+            if self.size <= self.maxbytes:
+                break
+            evicted.append((name, path))
+            self.size -= length
+        for name, path in evicted:
+            self._forget(name, path)
+        self._commit()
+
+    def _forget(self, name, path):
+        self._db.execute('DELETE FROM blocks WHERE name = ?', (name,))
+        self._touched.pop(name, None)
+        count = self._paths.get(path, 1) - 1
+        if count > 0:
+            self._paths[path] = count
+        else:
+            self._paths.pop(path, None)
+        try:
+            os.remove(self._filename(name))
+        except OSError:
+            pass
+
+    def _remove(self, name, path):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT length FROM blocks WHERE name = ?', (name,)).fetchone()
+            if row is not None:
+                self.size -= row[0]
+                self._forget(name, path)
+                self._commit()
+
+    def discard(self, path):
+        """Remove every cached block of the file at ``path``.
+        """
+        if path in self._paths:
+            self.discard_tree(path, tree=False)
+
+    def discard_tree(self, path, tree=True):
+        """Remove the blocks of ``path`` and of every file below it.
+        """
+        with self._lock:
+            for p in [p for p in self._paths if p == path or tree and isbase(path, p)]:
+                rows = self._db.execute(
+                    'SELECT name, length FROM blocks WHERE path = ?', (p,)).fetchall()
+                for name, length in rows:
+                    self.size -= length
+                    self._forget(name, p)
+            self._commit()
+
+    def loader(self, path, version, load):
+        """Wrap a block loader to read blocks from the cache first.
+
+        Arguments:
+            path (str): the normalized path of the file.
+            version (object): the version of the file content.
+            load (callable): a function called as ``load(size, offset)``
+                to read a block missing from the cache.
+
+        Returns:
+            callable: a function with the same signature as ``load``.
+
+        """
+        def cached_load(size, offset):
+            block = self.get(path, version, offset, size)
+            if block is None:
+                block = load(size, offset)
+                if block:
+                    self.set(path, version, offset, size, block)
+            return block
+        return cached_load
+
+    def close(self):
+        with self._lock:
+            self._db.executemany(
+                'UPDATE blocks SET atime = ? WHERE name = ?',
+                [(atime, name) for name, atime in self._touched.items()])
+            self._touched.clear()
+            self._commit()
+            self._db.close()
@@ -0,0 +1,386 @@
+# coding: utf-8
+"""Thread-safe bookkeeping of the files opened through a FUSE mount.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import contextlib
+import errno
+import os
+import stat
+import threading
+
+from ...enums import Seek
+from ...path import isbase
+
+from .writeback import Spool
+
+
+class RawFile(object):
+    """A file opened with `os.open`, and accessed with positional I/O.
+
+    Arguments:
+        path (str): the system path to the file.
+        mode (str): the mode to open the file with, among ``r``,
+            ``r+``, ``w``, ``w+``, ``a`` and ``x+``.
+
+    """
+
+    _flags = {
+        'r': os.O_RDONLY,
+        'r+': os.O_RDWR,
+        'w': os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+        'w+': os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+        'a': os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+        'x+': os.O_RDWR | os.O_CREAT | os.O_EXCL,
+    }
+
+    def __init__(self, path, mode):
+        self.mode = mode
+        self.closed = False
+        self.fd = os.open(path, self._flags[mode] | getattr(os, 'O_BINARY', 0), 0o666)
+        if stat.S_ISDIR(os.fstat(self.fd).st_mode):
+            os.close(self.fd)
+            raise OSError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+
+    def readable(self):
+        return 'r' in self.mode or '+' in self.mode
+
+    def writable(self):
+        return self.mode != 'r'
+
+    def pread(self, size, offset):
+        return os.pread(self.fd, size, offset)
+
+    def pwrite(self, data, offset):
+        if self.mode == 'a':
+            return os.write(self.fd, data)
+        return os.pwrite(self.fd, data, offset)
+
+    def seek(self, offset, whence=Seek.set):
+        return os.lseek(self.fd, offset, whence)
+
+    def read(self, size=-1):
+        if size < 0:
+            size = max(os.fstat(self.fd).st_size - self.seek(0, Seek.current), 0)
+        return os.read(self.fd, size)
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def truncate(self, size=None):
+        os.ftruncate(self.fd, self.seek(0, Seek.current) if size is None else size)
+
+    def flush(self):
+        pass
+
+    def fsync(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            os.close(self.fd)
+
+
+class SharedFile(object):
+    """A read-only backend file shared by several descriptors.
+
+    The backend file is opened by the first descriptor acquiring it from
+    a `SharedFileTable`, or by the first read if it was acquired lazily,
+    read with positional reads serialized by a single lock, and closed
+    when the last descriptor is closed.
+
+    """
+
+    def __init__(self, table, key, version):
+        self.table = table
+        self.key = key
+        self.version = version
+        self.file = None
+        self.opener = None
+        self.refs = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.opening = threading.Lock()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def open(self):
+        # concurrent opens of the same file wait for a single backend open
+        with self.opening:
+            if self.closed:
+                # a late prefetch must not reopen a released file
+                raise ValueError('I/O operation on closed file')
+            if self.file is None:
+                self.file = self.opener()
+
+    def pread(self, size, offset):
+        if self.file is None:
+            self.open()
+        with self.lock:
+            self.file.seek(offset, Seek.set)
+            return self.file.read(size)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Release a reference to the file, closing it after the last one.
+        """
+        if self.table.release(self):
+            with self.opening:
+                self.closed = True
+            if self.file is not None:
+                self.file.close()
+
+
+class SharedFileTable(object):
+    """A table of the read-only backend files shared between descriptors.
+
+    Files are shared for as long as they keep the same version, so that
+    a descriptor opened after the file changed gets a fresh handle,
+    while the previous one stays open for the descriptors still using it.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def __len__(self):
+        return len(self._files)
+
+    def acquire(self, key, version, opener, lazy=False):
+        """Get a shared handle to a file, opening it if needed.
+
+        Arguments:
+            key (str): the path to the file.
+            version (object): the version of the file content.
+            opener (callable): a function called without arguments to
+                open the backend file, only called once per version.
+            lazy (bool): set to `True` to only open the backend file
+                when it is first read.
+
+        Returns:
+            SharedFile: the shared handle, to `~SharedFile.close` once
+            it is not used anymore.
+
+        """
+        with self._lock:
+            shared = self._files.get(key)
+            if shared is None or shared.version != version:
+                shared = self._files[key] = SharedFile(self, key, version)
+            shared.refs += 1
+            if shared.opener is None:
+                shared.opener = opener
+        if not lazy:
+            try:
+                shared.open()
+            except Exception:
+                self.release(shared)
+                raise
+        return shared
+
+    def release(self, shared):
+        """Drop a reference to a shared file.
+
+        Returns:
+            bool: `True` if it was the last reference to the file.
+
+        """
+        with self._lock:
+            shared.refs -= 1
+            if shared.refs > 0:
+                return False
+            if self._files.get(shared.key) is shared:
+                del self._files[shared.key]
+            return True
+
+    def discard(self, key):
+        """Stop sharing the file at ``key`` with new descriptors.
+
+        The descriptors already using the file keep it open.
+
+        """
+        with self._lock:
+            self._files.pop(key, None)
+
+    def discard_tree(self, key):
+        """Stop sharing the file at ``key`` and every file below it.
+        """
+        with self._lock:
+            for k in [k for k in self._files if isbase(key, k)]:
+                del self._files[k]
+
+    def clear(self):
+        with self._lock:
+            self._files.clear()
+
+
+class _Handle(object):
+
+    __slots__ = ('file', 'lock', 'version', 'window', 'since', 'raw')
+
+    def __init__(self, file, version=None, window=None, since=None):
+        self.file = file
+        self.lock = threading.Lock()
+        self.version = version
+        self.window = window
+        self.since = since
+        self.raw = isinstance(file, (RawFile, SharedFile, Spool))
+
+    def pread(self, size, offset):
+        # positional reads of raw, shared and spooled files handle their
+        # own locking
+        if self.raw:
+            return self.file.pread(size, offset)
+        with self.lock:
+            self.file.seek(offset, Seek.set)
+            return self.file.read(size)
+
+    def pwrite(self, data, offset):
+        if self.raw:
+            return self.file.pwrite(data, offset)
+        with self.lock:
+            self.file.seek(offset, Seek.set)
+            return self.file.write(data)
+
+
+class HandleTable(object):
+    """A table of open file handles indexed by file descriptors.
+
+    Descriptors are allocated in constant time from a free-list of
+    released descriptors. Every handle has its own lock, so that
+    positional reads and writes on a handle shared by several FUSE
+    worker threads never interleave their ``seek`` calls, while
+    operations on different handles run in parallel.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._free = []
+        self._next = 0
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, fd):
+        return fd in self._handles
+
+    def __getitem__(self, fd):
+        return self._handles[fd].file
+
+    def values(self):
+        return [handle.file for handle in list(self._handles.values())]
+
+    def version(self, fd):
+        """Get the version of the file content a descriptor was opened on.
+
+        Raises:
+            KeyError: when ``fd`` is not a known descriptor.
+
+        """
+        return self._handles[fd].version
+
+    def window(self, fd):
+        """Get the read-ahead window of a descriptor, if any.
+
+        Raises:
+            KeyError: when ``fd`` is not a known descriptor.
+
+        """
+        return self._handles[fd].window
+
+    def since(self, fd):
+        """Get the generation pinned when a descriptor was opened, if any.
+
+        Raises:
+            KeyError: when ``fd`` is not a known descriptor.
+
+        """
+        return self._handles[fd].since
+
+    def add(self, file, version=None, window=None, since=None):
+        """Register an open file and return its new descriptor.
+
+        Arguments:
+            file (io.IOBase): the open file.
+            version (object): a hashable version of the file content,
+                if it is known not to change while the file is open.
+            window (ReadaheadWindow): the read-ahead state of the file,
+                if reads should be prefetched.
+            since (int): the generation pinned when the file was opened,
+                to tell whether it was modified since.
+
+        """
+        with self._lock:
+            if self._free:
+                fd = self._free.pop()
+            else:
+                fd, self._next = self._next, self._next + 1
+            self._handles[fd] = _Handle(file, version, window, since)
+        return fd
+
+    def pop(self, fd):
+        """Unregister a descriptor and return its file.
+
+        The descriptor is only made available again once pending
+        positional operations on the handle are finished.
+
+        Raises:
+            KeyError: when ``fd`` is not a known descriptor.
+
+        """
+        with self._lock:
+            handle = self._handles.pop(fd)
+        with handle.lock:
+            with self._lock:
+                self._free.append(fd)
+            return handle.file
+
+    def clear(self):
+        with self._lock:
+            self._handles.clear()
+            del self._free[:]
+            self._next = 0
+
+    @contextlib.contextmanager
+    def locked(self, fd):
+        """Get exclusive access to the file of a descriptor.
+
+        Raises:
+            KeyError: when ``fd`` is not a known descriptor.
+
+        """
+        handle = self._handles[fd]
+        with handle.lock:
+            yield handle.file
+
+    def reader(self, fd):
+        """Get a `pread`-like function bound to the file of a descriptor.
+
+        The function is called as ``read(size, offset)``, and keeps
+        reading the same file even if ``fd`` is released and reused.
+
+        Raises:
+            KeyError: when ``fd`` is not a known descriptor.
+
+        """
+        return self._handles[fd].pread
+
+    def pread(self, fd, size, offset):
+        """Read up to ``size`` bytes at ``offset``, atomically.
+        """
+        return self._handles[fd].pread(size, offset)
+
+    def pwrite(self, fd, data, offset):
+        """Write ``data`` at ``offset``, atomically.
+        """
+        return self._handles[fd].pwrite(data, offset)
@@ -0,0 +1,138 @@
+# coding: utf-8
+"""In-memory metadata index of filesystems that never change.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import stat
+import threading
+
+from six.moves import queue
+
+from ... import errors
+from ...path import combine, dirname
+
+from .records import StatRecord
+
+
+class MetadataIndex(object):
+    """A compact index of the stat records of an immutable filesystem.
+
+    Stat records are stored as `StatRecord`, sharing a single tuple of
+    keys with every record that has the same fields, which takes a
+    fraction of the memory of a dictionary per resource.
+
+    Arguments:
+        scan (callable): a function called as ``scan(path)`` to get the
+            ``(name, stat)`` pairs of the entries of a directory.
+        root (dict): the stat record of the root directory.
+        workers (int): the number of threads walking the filesystem.
+        lazy (bool): set to `True` to scan each directory the first
+            time it is accessed, instead of walking the whole filesystem
+            when the index is created.
+
+    """
+
+    def __init__(self, scan, root, workers=4, lazy=False):
+        self._scan = scan
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._stats = {}
+        self._children = {}
+        self._stats['/'] = self._pack(root)
+        if not lazy:
+            self._walk(max(workers, 1))
+
+    def __len__(self):
+        return len(self._stats)
+
+    def _pack(self, result):
+        if isinstance(result, StatRecord):
+            return result
+        keys = tuple(sorted(result))
+        keys = self._keys.setdefault(keys, keys)
+        return StatRecord(keys, tuple(result[key] for key in keys))
+
+    def _scandir(self, path):
+        """Index the entries of a directory, and return its subdirectories.
+        """
+        entries = list(self._scan(path))
+        subdirs = []
+        with self._lock:
+            for name, result in entries:
+                child = combine(path, name)
+                self._stats[child] = self._pack(result)
+                if stat.S_ISDIR(result.get('st_mode', 0)):
+                    subdirs.append(child)
+            self._children[path] = tuple(name for name, _ in entries)
+        return subdirs
+
+    def _walk(self, workers):
+        jobs, failures = queue.Queue(), []
+
+        def work():
+            while True:
+                path = jobs.get()
+                try:
+                    if path is None:
+                        return
+                    if not failures:
+                        for subdir in self._scandir(path):
+                            jobs.put(subdir)
+                except Exception as err:
+                    failures.append(err)
+                finally:
+                    jobs.task_done()
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        jobs.put('/')
+        jobs.join()
+        for _ in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise failures[0]
+
+    def _ensure(self, path):
+        """Make sure the directory at ``path`` is indexed, if it exists.
+
+        Returns:
+            bool: `True` if ``path`` is an indexed directory.
+
+        """
+        if path in self._children:
+            return True
+        result = self.stat(path)
+        if result is None or not stat.S_ISDIR(result.get('st_mode', 0)):
+            return False
+        self._scandir(path)
+        return True
+
+    def stat(self, path):
+        """Get the stat record of the resource at ``path``, or `None`.
+        """
+        result = self._stats.get(path)
+        if result is None:
+            parent = dirname(path)
+            if path == '/' or parent in self._children or not self._ensure(parent):
+                return None
+            result = self._stats.get(path)
+        return result
+
+    def listdir(self, path):
+        """Get the ``(name, stat)`` pairs of the entries of a directory.
+
+        Raises:
+            fs.errors.ResourceNotFound: when ``path`` does not exist.
+            fs.errors.DirectoryExpected: when ``path`` is not a directory.
+
+        """
+        if not self._ensure(path):
+            if self.stat(path) is None:
+                raise errors.ResourceNotFound(path)
+            raise errors.DirectoryExpected(path)
+        return [(name, self.stat(combine(path, name))) for name in self._children[path]]
@@ -0,0 +1,129 @@
+# coding: utf-8
+"""Per-path reader/writer locking of the operations of a mount.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import threading
+
+from .utils import monotonic
+
+
+class RWLock(object):
+    """A reader/writer lock, preferring writers.
+
+    Any number of readers may hold the lock at once, but a writer holds
+    it alone. Readers arriving while a writer waits are queued behind
+    it, so that a stream of readers never starves writers.
+
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire(self, write=False):
+        """Acquire the lock, for writing if ``write`` is `True`.
+
+        Returns:
+            float: the number of seconds spent waiting for the lock.
+
+        """
+        with self._cond:
+            if write:
+                if not (self._writer or self._readers):
+                    self._writer = True
+                    return 0.0
+                start = monotonic()
+                self._waiting_writers += 1
+                while self._writer or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = True
+            else:
+                if not (self._writer or self._waiting_writers):
+                    self._readers += 1
+                    return 0.0
+                start = monotonic()
+                while self._writer or self._waiting_writers:
+                    self._cond.wait()
+                self._readers += 1
+            return monotonic() - start
+
+    def release(self, write=False):
+        with self._cond:
+            if write:
+                self._writer = False
+            else:
+                self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+
+class PathLockManager(object):
+    """A striped table of reader/writer locks, indexed by path.
+
+    Each path maps to one of a fixed number of `RWLock`, so that
+    operations on unrelated paths rarely contend, while memory stays
+    constant however many paths are accessed. Operations on several
+    paths acquire their stripes in a fixed order, so that they never
+    deadlock each other.
+
+    Arguments:
+        stripes (int): the number of locks to spread paths over.
+
+    """
+
+    def __init__(self, stripes=64):
+        self.stripes = [RWLock() for _ in range(stripes)]
+        self._lock = threading.Lock()
+        self._waits = collections.defaultdict(lambda: [0, 0.0])
+
+    @contextlib.contextmanager
+    def locked(self, op, paths, write=False, exclusive=()):
+        """Hold the locks of ``paths`` while serving ``op``.
+
+        Arguments:
+            op (str): the name of the operation, to report waits for.
+            paths (iterable): the normalized paths to lock.
+            write (bool): set to `True` to lock ``paths`` exclusively.
+            exclusive (iterable): normalized paths to always lock
+                exclusively. A stripe shared by paths locked in both
+                modes is locked exclusively.
+
+        """
+        count = len(self.stripes)
+        modes = {hash(path) % count: write for path in paths}
+        modes.update((hash(path) % count, True) for path in exclusive)
+        indices = sorted(modes)
+        waited = 0.0
+        for index in indices:
+            waited += self.stripes[index].acquire(modes[index])
+        if waited:
+            with self._lock:
+                waits = self._waits[op]
+                waits[0] += 1
+                waits[1] += waited
+        try:
+            yield
+        finally:
+            for index in reversed(indices):
+                self.stripes[index].release(modes[index])
+
+    def snapshot(self):
+        """Get the lock waits of every operation that had to wait.
+
+        Returns:
+            dict: a mapping of operation names to the number of calls
+            that waited for a lock, and the total seconds they waited.
+
+        """
+        with self._lock:
+            return {
+                op: {'waits': count, 'seconds': seconds}
+                for op, (count, seconds) in self._waits.items()
+            }
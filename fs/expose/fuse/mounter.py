@@ -0,0 +1,184 @@
+# coding: utf-8
+"""Mounting of Pyfilesystem2 filesystems in a background process.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import multiprocessing
+import os
+import subprocess
+import time
+
+import fuse
+import six
+
+from .operations import PyfilesystemFuseOperations
+
+
+class _FUSE(fuse.FUSE):
+    """A `fuse.FUSE` that passes the offset of `readdir` to the operations.
+
+    fusepy drops it, so a streaming listing could not tell a rewind of
+    the directory from the continuation of the previous call.
+    """
+
+    def readdir(self, path, buf, filler, offset, fip):
+        for item in self.operations(
+                'readdir', self._decode_optional_path(path),
+                fip.contents.fh, offset):
+            if isinstance(item, six.string_types):
+                name, st, offset = item, None, 0
+            else:
+                name, attrs, offset = item
+                if attrs:
+                    st = fuse.c_stat()
+                    fuse.set_st_attrs(st, attrs, use_ns=self.use_ns)
+                else:
+                    st = None
+            if filler(buf, name.encode(self.encoding), st, offset) != 0:
+                break
+        return 0
+
+
+class PyfilesystemFuseMounter(object):
+    """A FUSE mount of a filesystem, served by a child process.
+
+    Arguments:
+        filesystem (~fs.base.FS or str): the filesystem to mount, or
+            an FS URL to open.
+        mountpoint (str): the directory to mount the filesystem on.
+        threads (bool): set to `False` to serve operations from a
+            single thread.
+        debug (bool): set to `True` to log FUSE operations.
+        kernel_cache (bool): set to `True` to keep the kernel page cache
+            of a file when it is opened again. Only use it when the
+            filesystem is never modified behind the mount.
+        auto_cache (bool): set to `True` to keep the kernel page cache
+            of a file when it is opened again, unless its modification
+            time or size changed.
+        attr_timeout (float): the number of seconds the kernel, and the
+            attribute cache of the operations, keep file attributes.
+        entry_timeout (float): the number of seconds the kernel keeps
+            the result of a name lookup.
+        negative_timeout (float): the number of seconds the kernel, and
+            the negative cache of the operations, keep failed lookups.
+        max_read (int): the maximum size of a read request, in bytes.
+        max_write (int): the maximum size of a write request, in bytes.
+        big_writes (bool): set to `True` to allow write requests larger
+            than a page.
+        max_readahead (int): the maximum number of bytes the kernel
+            reads ahead of sequential reads.
+
+    Any other keyword argument is passed to `PyfilesystemFuseOperations`,
+    which is created with ``raw_fi=True`` unless specified otherwise, so
+    that unchanged files keep their kernel page cache across opens.
+
+    Note:
+        Operations are served by several threads by default. Conflicting
+        operations, such as the rename of a directory and the creation
+        of a file inside it, are serialized by the path locks of the
+        operations, unless they are created with ``lock_stripes=0``.
+
+    """
+
+    def __init__(self,
+                 filesystem,
+                 mountpoint,
+                 threads=True,
+                 debug=False,
+                 kernel_cache=False,
+                 auto_cache=False,
+                 attr_timeout=1.0,
+                 entry_timeout=1.0,
+                 negative_timeout=1.0,
+                 max_read=None,
+                 max_write=None,
+                 big_writes=False,
+                 max_readahead=None,
+                 **options):
+        self.filesystem = filesystem
+        self.mountpoint = os.path.abspath(mountpoint)
+        self.threads = threads
+        self.debug = debug
+        options.setdefault('raw_fi', True)
+        self.operations_options = dict(
+            options, attr_timeout=attr_timeout, negative_timeout=negative_timeout)
+        self.fuse_options = {
+            'kernel_cache': kernel_cache,
+            'auto_cache': auto_cache,
+            'attr_timeout': attr_timeout,
+            'entry_timeout': entry_timeout,
+            'negative_timeout': negative_timeout,
+            'max_read': max_read,
+            'max_write': max_write,
+            'big_writes': big_writes,
+            'max_readahead': max_readahead,
+        }
+        # fusepy passes `True` options as flags, and others as `key=value`
+        for key, value in list(self.fuse_options.items()):
+            if value is None or value is False:
+                del self.fuse_options[key]
+        self.process = None
+
+    def __enter__(self):
+        if self.process is None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unmount()
+
+    @property
+    def mounted(self):
+        return os.path.ismount(self.mountpoint)
+
+    def run(self):
+        """Serve the mount in the current process, until it is unmounted.
+        """
+        operations = PyfilesystemFuseOperations(
+            self.filesystem, **self.operations_options)
+        _FUSE(
+            operations,
+            self.mountpoint,
+            raw_fi=operations.raw_fi,
+            foreground=True,
+            nothreads=not self.threads,
+            debug=self.debug,
+            **self.fuse_options
+        )
+
+    def start(self, timeout=5.0):
+        """Serve the mount in a child process, and wait for it to be ready.
+
+        Raises:
+            OSError: when the filesystem is not mounted after ``timeout``
+                seconds.
+
+        """
+        self.process = multiprocessing.Process(target=self.run)
+        self.process.daemon = True
+        self.process.start()
+        deadline = time.time() + timeout
+        while not self.mounted:
+            if not self.process.is_alive() or time.time() > deadline:
+                self.unmount()
+                raise OSError('could not mount {!r} on {}'.format(
+                    self.filesystem, self.mountpoint))
+            time.sleep(0.01)
+
+    def unmount(self, timeout=5.0):
+        """Unmount the filesystem, and stop the child process.
+        """
+        if self.mounted:
+            for command in (['fusermount', '-u'], ['umount']):
+                try:
+                    if not subprocess.call(command + [self.mountpoint]):
+                        break
+                except OSError:
+                    continue
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+            self.process = None
@@ -4,126 +4,610 @@ from __future__ import unicode_literals
 
 import os
 import errno
+import fnmatch
+import functools
+import io
 import operator
 import posix
 import stat
 import time
 import weakref
 import itertools
+import collections
 
 import six
 import fuse
 
 from ... import errors
-from ...enums import ResourceType, Seek
 from ...opener import open_fs
-from ...path import basename, isparent, recursepath
+from ...osfs import OSFS
+from ...subfs import SubFS
+from ...path import abspath, basename, combine, dirname, isbase, isparent, normpath, recursepath
 from ...permissions import Permissions
 
-from .utils import convert_fs_errors, timestamp
+from .cache import BlockCache, GenerationTable, TTLCache
+from .checksums import ChecksumCache
+from .crawler import WarmupCrawler
+from .diskcache import DiskCache
+from .handles import HandleTable, RawFile, SharedFileTable
+from .index import MetadataIndex
+from .locks import PathLockManager
+from .profiler import SamplingProfiler
+from .readahead import PrefetchPool, ReadaheadWindow
+from .records import StatConverter
+from .stats import StatsRecorder
+from .trace import TraceRecorder
+from .writeback import Spool, UploadPool
+from .usage import UsageCounter
+from .utils import available_memory, convert_fs_errors, monotonic
 
 
-class PyfilesystemFuseOperations(fuse.Operations):
+# `ENOATTR` is only defined on BSD systems, Linux uses `ENODATA` instead
+ENOATTR = getattr(errno, 'ENOATTR', errno.ENODATA)
 
-    @staticmethod
-    def _stat_from_info(info):
 
-        if info.has_namespace('stat'):
-            return info.raw['stat']
-
-        result = {}
-        umask = os.umask(0)
-        os.umask(umask)
-
-        if info.has_namespace('details'):
-            if info.accessed is not None:
-                result['st_atime'] = int(timestamp(info.accessed))
-            if info.modified is not None:
-                result['st_mtime'] = int(timestamp(info.modified))
-            if (info.created or info.metadata_changed) is not None:
-                result['st_ctime'] = int(timestamp(info.created or info.metadata_changed))
-            if info.size is not None:
-                result['st_size'] = info.size
-            # TODO: support links ?
-            # if info.is_link:
-            #     result['st_mode'] = stat.S_IFLNK
-            if info.type is ResourceType.directory:
-                result['st_mode'] = stat.S_IFDIR
-            else:
-                result['st_mode'] = stat.S_IFREG
+# the operations fusepy may call, dispatched through a table built once
+_OPERATIONS = frozenset(name for name in dir(fuse.Operations) if not name.startswith('_'))
 
 
-        mode = result.get('st_mode', 0)
+class _VirtualFile(io.BytesIO):
+    """A read-only in-memory file, such as the statistics file.
+    """
 
-        if info.has_namespace('access'):
-            if info.uid is not None:
-                result['st_uid'] = info.uid
-            if info.gid is not None:
-                result['st_gid'] = info.gid
-            if info.permissions is not None:
-                result['st_mode'] = mode | info.permissions.mode
-            elif info.has_namespace('details'):
-                if info.type is ResourceType.directory:
-                    result['st_mode'] = mode | 0o777 & ~umask
-                else:
-                    result['st_mode'] = mode | 0o666 & ~umask
+    def writable(self):
+        return False
 
-        if info.name is not None and info.name in '/':
-            result['st_nlink'] = 2
 
-        return result
+class _DirectoryCursor(object):
+    """The state of a streaming `readdir` over an open directory.
+    """
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries
+        self.position = 0
+        self.page = collections.deque([('.', None), ('..', None)])
+
+    def close(self):
+        if hasattr(self.entries, 'close'):
+            self.entries.close()
 
-    def __init__(self, filesystem):
-        self.descriptors = {}
+
+class PyfilesystemFuseOperations(fuse.Operations):
+
+    _scandir_namespaces = ['basic', 'access', 'details', 'link', 'stat']
+    _statfs_block_size = 4096
+    _statvfs_fields = [
+        'f_bsize', 'f_frsize', 'f_blocks', 'f_bfree', 'f_bavail',
+        'f_files', 'f_ffree', 'f_favail',
+    ]
+
+    @staticmethod
+    def _stat_from_info(info):
+        return StatConverter().from_info(info).to_dict()
+
+    def __init__(self,
+                 filesystem,
+                 attr_timeout=1.0,
+                 attr_cache_size=4096,
+                 negative_timeout=1.0,
+                 negative_cache_size=4096,
+                 readdir_page_size=None,
+                 block_size=65536,
+                 block_cache_size=32*1024*1024,
+                 readahead_size=1024*1024,
+                 readahead_workers=4,
+                 writeback=False,
+                 writeback_workers=4,
+                 writeback_max_dirty=64*1024*1024,
+                 raw_fi=False,
+                 direct_io=None,
+                 statfs_timeout=5.0,
+                 checksum_cache=None,
+                 xattr_digests=('md5', 'sha1', 'sha256'),
+                 list_xattr_digests=False,
+                 passthrough=True,
+                 read_only=False,
+                 index_workers=4,
+                 lazy_index=False,
+                 warmup=False,
+                 warmup_workers=2,
+                 warmup_max_depth=None,
+                 warmup_exclude_dirs=None,
+                 warmup_rate=None,
+                 warmup_timeout=None,
+                 stats=True,
+                 stats_path=None,
+                 profile_interval=None,
+                 trace=None,
+                 share_handles=True,
+                 disk_cache=None,
+                 disk_cache_size=1024*1024*1024,
+                 lock_stripes=64):
+        self.descriptors = HandleTable()
+        self.directories = {}
+        self.readdir_page_size = readdir_page_size
+        self._dirhandles = itertools.count(1)
         self.fs = open_fs(filesystem)
+        self._converter = StatConverter()
+        self.attr_cache = TTLCache(attr_timeout, attr_cache_size)
+        self.open_versions = TTLCache(float('inf'), attr_cache_size)
+        self.negative_cache = TTLCache(negative_timeout, negative_cache_size)
+        self.block_cache = BlockCache(block_size, block_cache_size)
+        self.disk_cache = DiskCache(disk_cache, disk_cache_size) if disk_cache else None
+        self.readahead_size = readahead_size
+        self.prefetcher = PrefetchPool(readahead_workers)
+        self.writeback = writeback
+        self.uploader = UploadPool(
+            writeback_workers, writeback_max_dirty, self._uploaded)
+        self._spools = weakref.WeakValueDictionary()
+        self._writers = {}
+        self.generations = GenerationTable(attr_cache_size)
+        self.shared_files = SharedFileTable() if share_handles else None
+        self.raw_fi = raw_fi
+        self.statfs_cache = TTLCache(statfs_timeout, 1)
+        self.checksums = ChecksumCache(checksum_cache)
+        self.xattr_digests = list(xattr_digests)
+        self.list_xattr_digests = list_xattr_digests
+        self.passthrough = passthrough
+        self.read_only = read_only
+        self.profiler = SamplingProfiler(profile_interval) if profile_interval else None
+        self.locks = PathLockManager(lock_stripes) if lock_stripes else None
+        self.stats = StatsRecorder(self.profiler, self.locks) if stats else None
+        self.tracer = TraceRecorder(trace) if trace is not None else None
+        self.stats_path = self._key(stats_path) if stats and stats_path else None
+        self._stats_dir = dirname(self.stats_path) if self.stats_path else None
+        self._stats_snapshot = None
+        self.index = None
+        if read_only:
+            # the filesystem never changes, so metadata is indexed once
+            root = self.getattr('/')
+            self.index = MetadataIndex(self._scan, root, index_workers, lazy_index)
+        self.crawler = None
+        if warmup and self.index is None and self.attr_cache.enabled:
+            self.crawler = WarmupCrawler(
+                self, warmup_workers, warmup_max_depth, warmup_exclude_dirs, warmup_rate,
+                warmup_timeout)
+        self.usage = None
+        self.direct_io = list(direct_io or ())
+        self._operations = {name: getattr(self, name) for name in _OPERATIONS}
 
     def __call__(self, op, *args):
-        op_method = getattr(self, op, None)
+        if self.stats is None and self.profiler is None and self.tracer is None:
+            return self._dispatch(op, args)
+        ident = self.profiler.enter(op) if self.profiler is not None else None
+        start = monotonic()
+        result, error = None, errno.EIO   # unless the call succeeds or sets errno
+        try:
+            result = self._dispatch(op, args)
+            error = None
+            return result
+        except OSError as err:
+            error = err.errno
+            raise
+        finally:
+            elapsed = monotonic() - start
+            if ident is not None:
+                self.profiler.exit(ident)
+            if self.stats is not None:
+                self.stats.record(op, elapsed, error, self._transferred(op, result))
+            if self.tracer is not None:
+                self.tracer.record(op, args, start, elapsed, result, error)
+
+    @staticmethod
+    def _transferred(op, result):
+        if op == 'read':
+            return len(result) if result else 0
+        if op == 'write':
+            return result or 0
+        return 0
+
+    def _dispatch(self, op, args):
+        op_method = self._operations.get(op)
         if op_method is None:
             raise fuse.FuseOSError(errno.ENOSYS)
+        if self.read_only and self._mutates(op, args):
+            raise fuse.FuseOSError(errno.EROFS)
+        if self.locks is not None and op not in self._unlocked_operations:
+            shared, exclusive = self._lock_paths(op, args)
+            with self.locks.locked(op, shared, exclusive=exclusive):
+                return self._call(op, op_method, args)
+        return self._call(op, op_method, args)
+
+    def _lock_paths(self, op, args):
+        """Get the paths an operation locks shared and exclusively.
+
+        Calls on the same paths are serialized if one of them modifies
+        them, and run in parallel otherwise. Operations adding or
+        removing an entry also lock its parent exclusively, so that the
+        rename or removal of a directory waits for the entries being
+        created or removed in it, and the other way around. Ancestors
+        are not locked, so that a change at the root never waits for
+        every operation in flight on the mount.
+
+        """
+        paths = args[:2] if op in self._two_path_operations else args[:1]
+        write = op in self._flushing_operations or self._mutates(op, args)
+        namespace = op in self._namespace_operations
+        shared, exclusive = set(), set()
+        for path in paths:
+            if not isinstance(path, six.string_types):
+                continue
+            key = self._key(path)
+            if namespace and key != '/':
+                exclusive.add(dirname(key))
+            (exclusive if write else shared).add(key)
+        return shared, exclusive
+
+    def _call(self, op, op_method, args):
+        if self.raw_fi:
+            return self._call_raw(op, op_method, args)
         return op_method(*args)
 
-    def _getfd(self):
-        return next(x for x in itertools.count() if x not in self.descriptors)
+    _unlocked_operations = frozenset(['destroy', 'init', 'statfs'])
+    _two_path_operations = frozenset(['link', 'rename', 'symlink'])
+    _flushing_operations = frozenset(['flush', 'fsync'])
+    _namespace_operations = frozenset([
+        'create', 'link', 'mkdir', 'rename', 'rmdir', 'symlink', 'unlink',
+    ])
+
+    _mutating_operations = frozenset([
+        'chmod', 'chown', 'create', 'link', 'mkdir', 'removexattr', 'rename',
+        'rmdir', 'setxattr', 'symlink', 'truncate', 'unlink', 'utimens', 'write',
+    ])
+
+    def _mutates(self, op, args):
+        if op == 'open':
+            # `args[-1]` are the flags, or a `fuse_file_info` with `raw_fi`
+            flags = getattr(args[-1], 'flags', args[-1])
+            return bool((flags & posix.O_ACCMODE) != posix.O_RDONLY or flags & posix.O_TRUNC)
+        return op in self._mutating_operations
+
+    def _call_raw(self, op, op_method, args):
+        # with `raw_fi`, fusepy passes the `fuse_file_info` structures
+        # instead of file descriptors, so that `open` can set the kernel
+        # caching flags of the file
+        if op in ('open', 'create'):
+            path, fi = args[0], args[-1]
+            if op == 'open':
+                fi.fh = op_method(path, fi.flags)
+            else:
+                fi.fh = op_method(path, args[1], fi)
+            self._set_cache_flags(path, fi)
+            return 0
+        args = [a.fh if isinstance(a, fuse.fuse_file_info) else a for a in args]
+        return op_method(*args)
+
+    @convert_fs_errors
+    def _set_cache_flags(self, path, fi):
+        """Set the ``direct_io`` and ``keep_cache`` flags of an open file.
+
+        Files matching one of the `direct_io` patterns bypass the kernel
+        page cache. Other files keep their cached pages when their
+        modification time and size did not change since the last time
+        they were opened.
+
+        """
+        key = self._key(path)
+        if key == self.stats_path:
+            fi.direct_io = 1
+            return
+        for pattern in self.direct_io:
+            if fnmatch.fnmatchcase(key if '/' in pattern else basename(key), pattern):
+                fi.direct_io = 1
+                return
+        version = self._version(path)
+        fi.keep_cache = int(self.open_versions.get(key) == version)
+        self.open_versions.set(key, version)
+
+    def _syspath(self, path):
+        """Get the system path of a resource, if I/O can bypass the backend.
+
+        Only `~fs.osfs.OSFS` and its subdirectories qualify: wrappers with
+        a system path, such as `~fs.wrap.WrapReadOnly`, may forbid what
+        the OS would allow.
+
+        """
+        if not self.passthrough or not hasattr(os, 'pread'):
+            return None
+        return self._native_path(path)
+
+    def _native_path(self, path):
+        """Get the system path of a resource of a local `~fs.osfs.OSFS`.
+
+        Returns `None` for any other filesystem, including the wrappers
+        of an `~fs.osfs.OSFS`, which forward its system paths.
+
+        """
+        _fs = self.fs.delegate_fs() if isinstance(self.fs, SubFS) else self.fs
+        if not isinstance(_fs, OSFS):
+            return None
+        return self.fs.getsyspath(path)
+
+    def _scandir(self, path):
+        """Iterate over the ``(name, stat)`` pairs of a directory.
+        """
+        if self.index is not None:
+            return iter(self.index.listdir(self._key(path)))
+        return self._scan(path)
+
+    def _scan(self, path):
+        syspath = self._syspath(path)
+        if syspath is not None and hasattr(os, 'scandir'):
+            it = os.scandir(syspath)
+            try:
+                for entry in it:
+                    yield entry.name, self._converter.from_os(entry.stat())
+            finally:
+                if hasattr(it, 'close'):
+                    it.close()
+        else:
+            infos = self.fs.scandir(path, self._scandir_namespaces)
+            for entry in self._converter.from_infos(infos):
+                yield entry
+
+    @staticmethod
+    def _key(path):
+        return abspath(normpath(path))
+
+    def _version(self, path):
+        """Get the version of the content of a file.
+
+        The modification time and size of a file only have the
+        resolution of the backend, so the generation of the last
+        modification made through the mount is part of the version
+        as well, and read before them so that it is never newer.
+
+        """
+        generation = self.generations.get(self._key(path))
+        result = self.getattr(path)
+        return result.get('st_mtime'), result.get('st_size'), generation
+
+    def _invalidate(self, path, parent=False, tree=False):
+        """Drop the cached attributes of a resource after it was modified.
+
+        Arguments:
+            path (str): the path to the modified resource.
+            parent (bool): set to `True` if the resource was created or
+                removed, to also invalidate its parent directory.
+            tree (bool): set to `True` to also invalidate every cached
+                resource below ``path``.
+
+        Cached lookup failures, blocks, open versions and digests of the
+        same resources are dropped as well, since the resource may have
+        been created or its content changed, and their generation is
+        increased, so that descriptors opened before never share backend
+        files or blocks with the ones opened after.
+
+        """
+        key = self._key(path)
+        # the generation of a path applies to every path below it
+        self.generations.bump(key)
+        if tree:
+            if self.shared_files is not None:
+                self.shared_files.discard_tree(key)
+            self.attr_cache.discard_tree(key)
+            self.negative_cache.discard_tree(key)
+            self.block_cache.discard_tree(key)
+            if self.disk_cache is not None:
+                self.disk_cache.discard_tree(key)
+            self.open_versions.discard_tree(key)
+            self.checksums.discard_tree(key)
+            # handles opened before a rename must not be reused by path
+            for writer in [k for k in self._writers if isbase(key, k)]:
+                self._writers.pop(writer, None)
+        else:
+            if self.shared_files is not None:
+                self.shared_files.discard(key)
+            self.attr_cache.discard(key)
+            self.negative_cache.discard(key)
+            self.block_cache.discard(key)
+            if self.disk_cache is not None:
+                self.disk_cache.discard(key)
+            self.open_versions.discard(key)
+            self.checksums.discard(key)
+        if parent:
+            self.attr_cache.discard(dirname(key))
+
+    def _resized(self, path, size=None):
+        """Record the new size of a resource in the usage counter, if any.
+
+        Arguments:
+            path (str): the path to the created or modified resource.
+            size (int): the new size of the resource, or `None` to keep
+                the size it already had.
+
+        """
+        usage = self.usage
+        if usage is not None:
+            key = self._key(path)
+            usage.set(key, usage.get(key) if size is None else size)
+
+    def _uploaded(self, spool):
+        self._invalidate(spool.path)
 
     @convert_fs_errors
     def chmod(self, path, mode):
         self.fs.setinfo(path, {'access': {'permissions': Permissions(mode=mode)}})
+        self._invalidate(path)
 
     @convert_fs_errors
     def chown(self, path, uid, gid):
         self.fs.setinfo(path, {'access': {'uid': uid, 'gid': gid}})
+        self._invalidate(path)
 
     @convert_fs_errors
     def create(self, path, mode, fi=None):
-        exclusive = (posix.O_EXCL & mode)
-        if not self.fs.create(path) and exclusive:
-            raise errors.FileExists(path)
-        return self.open(path, mode)
+        # the open flags are only known with `raw_fi`
+        flags = fi.flags if fi is not None else mode
+        exclusive = (posix.O_EXCL & flags)
+        # create and open the file in a single call, and only fall back
+        # to opening the existing file when it was created concurrently
+        try:
+            return self._open(path, 'x+')
+        except errors.FileExists:
+            if exclusive:
+                raise
+        return self._open(path, 'w+' if flags & posix.O_TRUNC else 'r+')
+
+    def init(self, path):
+        if self.profiler is not None:
+            self.profiler.start()
+        if self.crawler is not None:
+            self.crawler.start()
 
     @convert_fs_errors
     def destroy(self, path):
+        if self.crawler is not None:
+            self.crawler.stop()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.tracer is not None:
+            self.tracer.close()
+        self.prefetcher.shutdown()
         for handle in self.descriptors.values():
-            handle.close()
+            if isinstance(handle, Spool):
+                self.uploader.submit(handle, close=True)
+            else:
+                handle.close()
+        self.uploader.shutdown()
         self.descriptors.clear()
+        self.directories.clear()
+        self.attr_cache.clear()
+        self.negative_cache.clear()
+        self.block_cache.clear()
+        if self.shared_files is not None:
+            self.shared_files.clear()
+        self.open_versions.clear()
+        self.generations.clear()
+        self.statfs_cache.clear()
+        self.checksums.close()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
         self.fs.close()
 
     @convert_fs_errors
     def flush(self, path, fd):
-        self.descriptors[fd].flush()
+        fh = self.descriptors[fd]
+        if isinstance(fh, Spool):
+            # report the failure of a previous background upload, since
+            # `flush` is what `close` returns the result of
+            self.uploader.check(fh)
+            self.uploader.submit(fh)
+        else:
+            with self.descriptors.locked(fd) as fh:
+                fh.flush()
+
+    @convert_fs_errors
+    def fsync(self, path, datasync, fd):
+        fh = self.descriptors[fd]
+        if isinstance(fh, Spool):
+            self.uploader.submit(fh)
+            self.uploader.wait(fh)
+        else:
+            with self.descriptors.locked(fd) as fh:
+                fh.flush()
+                if isinstance(fh, RawFile):
+                    fh.fsync()
 
     @convert_fs_errors
     def getattr(self, path, fh=None):
-        info = self.fs.getinfo(path, ['details', 'access', 'stat', 'link'])
-        return self._stat_from_info(info)
+        key = self._key(path)
+        if key == self.stats_path or key == self._stats_dir:
+            return self._virtual_stat(key)
+        if self.index is not None:
+            result = self.index.stat(key)
+            if result is None:
+                raise fuse.FuseOSError(errno.ENOENT)
+            return result
+        result = self.attr_cache.get(key)
+        if result is None:
+            if self.negative_cache.get(key):
+                raise fuse.FuseOSError(errno.ENOENT)
+            syspath = self._syspath(path)
+            try:
+                if syspath is not None:
+                    result = self._converter.from_os(os.stat(syspath))
+                else:
+                    info = self.fs.getinfo(path, ['details', 'access', 'stat', 'link'])
+                    result = self._converter.from_info(info)
+            except errors.ResourceNotFound:
+                self.negative_cache.set(key, True)
+                raise
+            except OSError as err:
+                if err.errno == errno.ENOENT:
+                    self.negative_cache.set(key, True)
+                raise
+            self.attr_cache.set(key, result)
+        # the backend does not know the size of a file being spooled
+        spool = self._spools.get(key)
+        if spool is not None and not spool.closed:
+            result = dict(result, st_size=spool.size)
+        return result
+
+    def _virtual_stat(self, key):
+        """Get the stat of the hidden statistics file or its directory.
+        """
+        now = time.time()
+        result = {'st_atime': now, 'st_mtime': now, 'st_ctime': now}
+        if key == self._stats_dir:
+            result.update(st_mode=stat.S_IFDIR | 0o555, st_nlink=2)
+        else:
+            self._stats_snapshot = self.stats.to_json()
+            result.update(
+                st_mode=stat.S_IFREG | 0o444, st_nlink=1,
+                st_size=len(self._stats_snapshot))
+        return result
 
     @convert_fs_errors
     def getxattr(self, path, name, position=0):
-        raise fuse.FuseOSError(errno.ENOTSUP)
+        result = self.getattr(path)
+        algorithm = name[5:] if name.startswith('user.') else None
+        if stat.S_ISDIR(result.get('st_mode', 0)) or algorithm not in self.xattr_digests:
+            raise fuse.FuseOSError(ENOATTR)
+        key = self._key(path)
+        if key == self.stats_path:
+            raise fuse.FuseOSError(ENOATTR)
+        size, mtime = result.get('st_size'), self._modified(path)
+        digest = self.checksums.get(key, size, mtime, algorithm)
+        if digest is None:
+            # compute every digest in the same pass, since reading
+            # the file is what is expensive
+            with self.fs.openbin(path) as handle:
+                digests = self.checksums.compute(handle, self.xattr_digests)
+            self.checksums.update(key, size, mtime, digests)
+            digest = digests[algorithm]
+        return digest.encode('ascii')
+
+    def _modified(self, path):
+        """Get the modification time of a file, with its full precision.
+
+        Stat records only keep the whole seconds of the modification
+        times of most backends, which cannot tell apart two versions of
+        a file of the same size written within the same second.
+        """
+        syspath = self._syspath(path)
+        if syspath is not None:
+            return os.stat(syspath).st_mtime
+        details = self.fs.getinfo(path, ['details']).raw.get('details') or {}
+        return details.get('modified')
+
+    @convert_fs_errors
+    def listxattr(self, path):
+        # tools copying extended attributes, such as `cp -a`, would read
+        # every file a second time to copy digests listed by default
+        result = self.getattr(path)
+        if not self.list_xattr_digests or self._key(path) == self.stats_path:
+            return []
+        if stat.S_ISDIR(result.get('st_mode', 0)):
+            return []
+        return ['user.{}'.format(algorithm) for algorithm in self.xattr_digests]
 
     @convert_fs_errors
     def mkdir(self, path, mode):
         self.fs.makedir(path)
+        self._invalidate(path, parent=True, tree=True)
+        self._resized(path, 0)
 
     def link(self, target, source):
         raise fuse.FuseOSError(errno.EPERM)
@@ -139,30 +623,233 @@ class PyfilesystemFuseOperations(fuse.Operations):
         # if read-only -> check if actually writing (stat flags or truncating)
         elif (flags & posix.O_ACCMODE) == posix.O_RDONLY:
             mode = 'r+' if (flags & (posix.ST_WRITE | posix.O_TRUNC)) else 'r'
-        fd = self._getfd()
-        self.descriptors[fd] = self.fs.openbin(path, mode)
+        return self._open(path, mode)
+
+    def _open(self, path, mode):
+        """Open a file with a Python file mode, and return its descriptor.
+        """
+        if self.stats_path is not None and self._key(path) == self.stats_path:
+            if mode != 'r':
+                raise fuse.FuseOSError(errno.EACCES)
+            # serve the snapshot whose size was reported by `getattr`
+            data = self._stats_snapshot or self.stats.to_json()
+            return self.descriptors.add(_VirtualFile(data))
+        spool = self._spools.get(self._key(path)) if self.writeback else None
+        if spool is not None:
+            # the uploads scheduled by previous descriptors of the file
+            # must be done before the backend file is read or copied
+            self.uploader.wait(spool, check=False)
+            if spool.closed:
+                # nobody else can report that the data of a closed spool
+                # was lost, so its failed upload fails the next open
+                self.uploader.check(spool)
+        syspath = self._syspath(path)
+        if syspath is not None and not self.writeback:
+            # the kernel and the OS already cache and read ahead the file
+            try:
+                fd = self.descriptors.add(RawFile(syspath, mode))
+            except OSError as err:
+                if err.errno == errno.EEXIST:
+                    raise errors.FileExists(path)
+                raise
+        elif mode != 'r' and self.writeback:
+            spool = self._spools[self._key(path)] = Spool(self.fs, path, mode)
+            fd = self.descriptors.add(spool)
+        elif mode != 'r':
+            fd = self.descriptors.add(self.fs.openbin(path, mode))
+        elif self.block_cache.enabled:
+            # blocks are only shared between read-only handles, and only
+            # for as long as the file keeps the same version: writable
+            # handles invalidate them instead
+            since = self.generations.pin()
+            try:
+                version = self._version(path)
+                window = None
+                if self.readahead_size > 0 and self.prefetcher.workers > 0:
+                    window = ReadaheadWindow(self.block_cache.block_size, self.readahead_size)
+                # with a disk cache, the backend file is only opened on a miss
+                shared = self._open_shared(path, version, lazy=self.disk_cache is not None)
+            except Exception:
+                self.generations.unpin(since)
+                raise
+            fd = self.descriptors.add(shared, version, window, since)
+        else:
+            fd = self.descriptors.add(self._open_shared(path))
+        if mode != 'r':
+            # remember the handle, so that `truncate` can reuse it
+            self._writers[self._key(path)] = fd
+            self._invalidate(path, parent=True)
+            self._resized(path, 0 if mode[0] in 'wx' else None)
         return fd
 
+    def _open_shared(self, path, version=None, lazy=False):
+        """Open a file for reading, sharing the backend file if possible.
+
+        Backend files are shared between the descriptors opened on the
+        same version of a file, so that concurrent opens of a file only
+        open it once on the backend.
+
+        """
+        if self.shared_files is None:
+            return self.fs.openbin(path, 'r')
+        if version is None:
+            version = self._version(path)
+        opener = functools.partial(self.fs.openbin, path, 'r')
+        return self.shared_files.acquire(self._key(path), version, opener, lazy)
+
     @convert_fs_errors
     def read(self, path, size, offset, fd):
-        handle = self.descriptors[fd]
-        if not handle.readable():
+        if not self.descriptors[fd].readable():
             raise fuse.FuseOSError(errno.EINVAL)
-        handle.seek(offset, Seek.set)
-        return handle.read(size)
+        version = self.descriptors.version(fd)
+        key = self._key(path)
+        if version is None or self.generations.get(key) > self.descriptors.since(fd):
+            # descriptors opened before a local modification must not
+            # fill the caches with their content under the same path
+            return self.descriptors.pread(fd, size, offset)
+        load = self.descriptors.reader(fd)
+        if self.disk_cache is not None:
+            # blocks are discarded from the disk cache on modifications,
+            # and generations do not outlive the mount
+            load = self.disk_cache.loader(key, version[:2], load)
+        data = self.block_cache.read(key, version, size, offset, load)
+        window = self.descriptors.window(fd)
+        if window is not None:
+            ahead, length = window.advance(offset, size), version[1]
+            if ahead is not None and (length is None or ahead[0] < length):
+                self.prefetcher.submit(
+                    self.block_cache.read, key, version, ahead[1], ahead[0], load, False)
+        return data
 
     @convert_fs_errors
-    def readdir(self, path, fh):
+    def opendir(self, path):
+        if not self.readdir_page_size or self._key(path) == self._stats_dir:
+            return 0
+        if not stat.S_ISDIR(self.getattr(path).get('st_mode', 0)):
+            raise fuse.FuseOSError(errno.ENOTDIR)
+        dh = next(self._dirhandles)
+        entries = self._scandir(path)
+        self.directories[dh] = _DirectoryCursor(path, entries)
+        return dh
+
+    def _stat_entries(self, path, entries, ttl=None):
+        """Prime the attribute cache with ``(name, stat)`` directory entries.
+        """
+        key = self._key(path)
+        for name, result in entries:
+            self.attr_cache.set(combine(key, name), result, ttl)
+            yield name, result
+
+    def _seek_directory(self, fh, offset):
+        """Move the cursor of an open directory to the given offset.
+
+        The kernel asks for the offset following the last entry it kept,
+        or for an earlier one after a `rewinddir` or `seekdir`, in which
+        case the directory is scanned again from its start.
+        """
+        cursor = self.directories[fh]
+        if offset < cursor.position:
+            cursor.close()
+            cursor = _DirectoryCursor(cursor.path, self._scandir(cursor.path))
+            self.directories[fh] = cursor
+        while cursor.position < offset:
+            if not cursor.page:
+                entries = itertools.islice(cursor.entries, offset - cursor.position)
+                cursor.page.extend(entries)
+                if not cursor.page:
+                    break
+            cursor.page.popleft()
+            cursor.position += 1
+        return cursor
+
+    def _stream_directory(self, cursor):
+        # fusepy stops iterating as soon as the kernel buffer is full, so an
+        # entry only counts as listed once the next one is requested: the
+        # rejected entry stays at the head of the page for the next call.
+        with convert_fs_errors:
+            while True:
+                if not cursor.page:
+                    entries = itertools.islice(cursor.entries, self.readdir_page_size)
+                    cursor.page.extend(self._stat_entries(cursor.path, entries))
+                    if not cursor.page:
+                        return
+                name, result = cursor.page[0]
+                yield name, result, cursor.position + 1
+                cursor.page.popleft()
+                cursor.position += 1
+
+    @convert_fs_errors
+    def readdir(self, path, fh, offset=None):
+        if self._stats_dir is not None and self._key(path) == self._stats_dir:
+            name = basename(self.stats_path)
+            return ['.', '..', (name, self._virtual_stat(self.stats_path), 0)]
+        cursor = self.directories.get(fh)
+        if cursor is not None:
+            if offset is not None:
+                cursor = self._seek_directory(fh, offset)
+            return self._stream_directory(cursor)
+        entries = self._scandir(path)
         return ['.', '..'] + [
-            (info.name, self._stat_from_info(info), 0)
-                for info in self.fs.scandir(
-                    path, ['basic', 'access', 'details', 'link', 'stat']
-                )
+            (name, result, 0) for name, result in self._stat_entries(path, entries)
         ]
 
+    @convert_fs_errors
+    def releasedir(self, path, fh):
+        cursor = self.directories.pop(fh, None)
+        if cursor is not None:
+            cursor.close()
+
     @convert_fs_errors
     def release(self, path, fd):
-        self.descriptors.pop(fd).close()
+        since = self.descriptors.since(fd)
+        handle = self.descriptors.pop(fd)
+        if since is not None:
+            self.generations.unpin(since)
+        if handle.writable():
+            key = self._key(path)
+            if self._writers.get(key) == fd:
+                del self._writers[key]
+            self._invalidate(path)
+        if isinstance(handle, Spool):
+            self.uploader.submit(handle, close=True)
+        else:
+            handle.close()
+
+    def _lookup(self, path):
+        """Get the info of a resource, or `None` if it does not exist.
+
+        Raises:
+            fuse.FuseOSError: with ``ENOTDIR`` when a component of the
+                path is not a directory.
+
+        """
+        try:
+            return self.fs.getinfo(path)
+        except errors.ResourceNotFound:
+            # only walk the parents to tell ENOTDIR from ENOENT on failure
+            for component in recursepath(path)[:-1]:
+                if self.fs.exists(component) and not self.fs.isdir(component):
+                    raise fuse.FuseOSError(errno.ENOTDIR)
+            return None
+
+    def _native_rename(self, old, new):
+        """Rename a resource with `os.rename`, if the backend supports it.
+
+        Only local filesystems qualify, since wrappers forwarding the
+        system paths of their delegate, such as `~fs.wrap.WrapReadOnly`,
+        may forbid the rename.
+
+        Returns:
+            bool: `True` if the resource was renamed.
+
+        """
+        if not self.fs.getmeta().get('supports_rename', False):
+            return False
+        sys_old = self._native_path(old)
+        if sys_old is None:
+            return False
+        os.rename(sys_old, self._native_path(new))
+        return True
 
     @convert_fs_errors
     def rename(self, old, new):
@@ -174,20 +861,34 @@ class PyfilesystemFuseOperations(fuse.Operations):
         elif isparent(_old, _new):
             raise fuse.FuseOSError(errno.EINVAL)
 
-        for component in recursepath(_old)[:-1]:
-            if not self.fs.isdir(component):
-                raise fuse.FuseOSError(errno.ENOTDIR)
-
-        if self.fs.gettype(old) is ResourceType.directory:
-            if not self.fs.exists(new):
-                self.fs.makedir(new)
-            if not self.fs.isempty(new):
-                raise fuse.FuseOSError(errno.ENOTEMPTY)
-            self.fs.movedir(old, new)
+        old_info = self._lookup(_old)
+        if old_info is None:
+            raise fuse.FuseOSError(errno.ENOENT)
+        try:
+            new_info = self.fs.getinfo(_new)
+        except errors.ResourceNotFound:
+            new_info = None
+
+        if old_info.is_dir:
+            if new_info is not None:
+                if not new_info.is_dir:
+                    raise fuse.FuseOSError(errno.ENOTDIR)
+                if not self.fs.isempty(_new):
+                    raise fuse.FuseOSError(errno.ENOTEMPTY)
+            if not self._native_rename(_old, _new):
+                if new_info is None:
+                    self.fs.makedir(_new)
+                self.fs.movedir(_old, _new)
         else:
-            if self.fs.isdir(new):
+            if new_info is not None and new_info.is_dir:
                 raise fuse.FuseOSError(errno.EISDIR)
-            self.fs.move(old, new)
+            if not self._native_rename(_old, _new):
+                self.fs.move(_old, _new, overwrite=True)
+
+        self._invalidate(old, parent=True, tree=True)
+        self._invalidate(new, parent=True, tree=True)
+        if self.usage is not None:
+            self.usage.move(self._key(old), self._key(new))
 
     @convert_fs_errors
     def rmdir(self, path):
@@ -195,13 +896,52 @@ class PyfilesystemFuseOperations(fuse.Operations):
             if not self.fs.isdir(component):
                 raise fuse.FuseOSError(errno.ENOTDIR)
         self.fs.removedir(path)
+        self._invalidate(path, parent=True, tree=True)
+        if self.usage is not None:
+            self.usage.discard(self._key(path))
 
     @convert_fs_errors
     def statfs(self, path):
-        statfs, meta = {}, self.fs.getmeta()
+        result = self.statfs_cache.get('/')
+        if result is None:
+            result = self._statfs()
+            self.statfs_cache.set('/', result)
+        return result
+
+    def _statfs(self):
+        """Compute the capacity and usage of the filesystem.
+
+        Filesystems with a system path report the values of `os.statvfs`.
+        Other local filesystems, such as `~fs.memoryfs.MemoryFS`, are
+        walked once to build a `UsageCounter`, which is then kept up to
+        date, and report the available physical memory as free space.
+        Network filesystems only report the maximum name length.
+
+        """
+        result, meta = {}, self.fs.getmeta()
+        try:
+            syspath = self.fs.getsyspath('/')
+        except errors.NoSysPath:
+            syspath = None
+        if syspath is not None:
+            st = os.statvfs(syspath)
+            for name in self._statvfs_fields:
+                result[name] = getattr(st, name)
+            result['f_namelen'] = st.f_namemax
+        elif not meta.get('network', True):
+            if self.usage is None:
+                self.usage = UsageCounter.from_fs(self.fs)
+            bs = self._statfs_block_size
+            used = -(-self.usage.bytes // bs)
+            free = available_memory() // bs
+            result.update(
+                f_bsize=bs, f_frsize=bs,
+                f_blocks=used + free, f_bfree=free, f_bavail=free,
+                f_files=len(self.usage) + free, f_ffree=free, f_favail=free,
+            )
         if 'max_sys_path_length' in meta:
-            return {'f_namelen': meta['max_sys_path_length']}
-        return {}
+            result.setdefault('f_namelen', meta['max_sys_path_length'])
+        return result
 
     def symlink(self, target, source):
         # TODO?: support symlink
@@ -209,16 +949,29 @@ class PyfilesystemFuseOperations(fuse.Operations):
 
     @convert_fs_errors
     def truncate(self, path, length, fd=None):
-        _fd = fd or self.open(path, posix.O_RDWR)
-        fh = self.descriptors[_fd]
-        try:
-            if not fh.writable():
-                raise fuse.FuseOSError(errno.EINVAL)
-            fh.seek(0)
-            fh.truncate(length)
-        finally:
-            if fd is None:
-                self.release(path, _fd)
+        if fd is None:
+            fd = self._writers.get(self._key(path))
+        if fd is not None:
+            with self.descriptors.locked(fd) as fh:
+                if not fh.writable():
+                    raise fuse.FuseOSError(errno.EINVAL)
+                fh.truncate(length)
+        else:
+            self._truncate_path(path, length)
+        self._invalidate(path)
+        self._resized(path, length)
+
+    def _truncate_path(self, path, length):
+        """Truncate a file without any open handle, in as few calls as possible.
+        """
+        syspath = self._syspath(path)
+        if syspath is not None:
+            os.truncate(syspath, length)
+        elif length == 0 and stat.S_ISREG(self.getattr(path).get('st_mode', 0)):
+            self.fs.create(path, wipe=True)
+        else:
+            with self.fs.openbin(path, 'r+') as fh:
+                fh.truncate(length)
 
     @convert_fs_errors
     def unlink(self, path):
@@ -226,6 +979,12 @@ class PyfilesystemFuseOperations(fuse.Operations):
             if not self.fs.isdir(component):
                 raise fuse.FuseOSError(errno.ENOTDIR)
         self.fs.remove(path)
+        # descriptors still open on the removed file must not be
+        # reused by a `truncate` of the same path
+        self._writers.pop(self._key(path), None)
+        self._invalidate(path, parent=True)
+        if self.usage is not None:
+            self.usage.discard(self._key(path))
 
     @convert_fs_errors
     def utimens(self, path, times=None):
@@ -233,12 +992,17 @@ class PyfilesystemFuseOperations(fuse.Operations):
         atime, mtime = (times[0], times[1]) if times else (now, now)
         info = {'details': {"accessed": atime, "modified": mtime}}
         self.fs.setinfo(path, info)
+        self._invalidate(path)
 
     @convert_fs_errors
     def write(self, path, data, offset, fd):
         fh = self.descriptors[fd]
-        fh.seek(offset, Seek.set)
-        if fh.writable():
-            return fh.write(data)
-        else:
+        if not fh.writable():
             raise fuse.FuseOSError(errno.EINVAL)
+        written = self.descriptors.pwrite(fd, data, offset)
+        self._invalidate(path)
+        if self.usage is not None:
+            self._resized(path, max(self.usage.get(self._key(path)), offset + len(data)))
+        if isinstance(fh, Spool):
+            self.uploader.account(fh, len(data))
+        return written
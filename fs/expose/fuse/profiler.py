@@ -0,0 +1,109 @@
+# coding: utf-8
+"""Sampling profiler attributing time to the operations of a FUSE mount.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import collections
+import os
+import sys
+import threading
+
+from six.moves import _thread
+
+
+class SamplingProfiler(object):
+    """A statistical profiler of the FUSE operations being served.
+
+    Threads register the operation they are serving with `enter`, and a
+    daemon thread samples the innermost frame of each of them every
+    ``interval`` seconds, so that the cost of an operation call is two
+    dictionary updates regardless of how much work it does.
+
+    Arguments:
+        interval (float): the number of seconds between two samples.
+        top (int): the number of hottest locations to report for each
+            operation.
+
+    """
+
+    def __init__(self, interval=0.005, top=10):
+        self.interval = interval
+        self.top = top
+        self._active = {}
+        self._samples = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a background thread.
+        """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop sampling, and wait for the background thread to exit.
+        """
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join()
+
+    def enter(self, op):
+        """Mark the current thread as serving ``op``.
+
+        Returns:
+            int: the identifier to pass to `exit`.
+
+        """
+        ident = _thread.get_ident()
+        self._active[ident] = op
+        return ident
+
+    def exit(self, ident):
+        self._active.pop(ident, None)
+
+    def sample(self):
+        """Record the innermost frame of every thread serving an operation.
+        """
+        frames = sys._current_frames()
+        for ident, op in list(self._active.items()):
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            code = frame.f_code
+            location = '{}:{}({})'.format(
+                os.path.basename(code.co_filename), frame.f_lineno, code.co_name)
+            with self._lock:
+                self._samples[op][location] += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def snapshot(self):
+        """Get the samples recorded so far for every operation.
+
+        Returns:
+            dict: a mapping of operation names to their sample count,
+            estimated time in seconds, and hottest locations.
+
+        """
+        with self._lock:
+            samples = {op: collections.Counter(c) for op, c in self._samples.items()}
+        return {
+            op: {
+                'samples': sum(counter.values()),
+                'seconds': sum(counter.values()) * self.interval,
+                'locations': dict(counter.most_common(self.top)),
+            }
+            for op, counter in samples.items()
+        }
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
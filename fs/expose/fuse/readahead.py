@@ -0,0 +1,128 @@
+# coding: utf-8
+"""Sequential access detection and background prefetching of file data.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+
+from six.moves import queue
+
+
+class ReadaheadWindow(object):
+    """The read-ahead state of an open file handle.
+
+    A read continuing the previous one opens the read-ahead window, and
+    the window doubles, up to ``maximum`` bytes, every time the reader
+    consumes half of the data prefetched so far. Any other read closes
+    the window.
+
+    Arguments:
+        initial (int): the size of the window opened by the first
+            sequential read, in bytes.
+        maximum (int): the maximum size of the window, in bytes.
+
+    """
+
+    def __init__(self, initial, maximum):
+        self.initial = min(initial, maximum)
+        self.maximum = maximum
+        self.size = 0
+        self._next = 0
+        self._prefetched = 0
+        self._lock = threading.Lock()
+
+    def advance(self, offset, size):
+        """Record a read, and get the range to prefetch after it.
+
+        Returns:
+            tuple: the ``(offset, size)`` range to prefetch, or `None`
+            if nothing should be prefetched.
+
+        """
+        end = offset + size
+        with self._lock:
+            sequential, self._next = offset == self._next, end
+            if not sequential:
+                self.size = 0
+                self._prefetched = end
+                return None
+            if self._prefetched - end >= self.size // 2 > 0:
+                return None
+            self.size = min(self.size * 2, self.maximum) or self.initial
+            start = max(self._prefetched, end)
+            self._prefetched = end + self.size
+            if self._prefetched <= start:
+                return None
+            return start, self._prefetched - start
+
+
+class PrefetchPool(object):
+    """A bounded pool of daemon threads running prefetch jobs.
+
+    Jobs are best-effort: they are dropped when the queue is full, and
+    the errors they raise are ignored, since a failed prefetch only
+    means the data will be read again on demand.
+
+    Arguments:
+        workers (int): the number of worker threads, started lazily.
+        maxqueue (int): the maximum number of pending jobs.
+
+    """
+
+    def __init__(self, workers=4, maxqueue=64):
+        self.workers = workers
+        self._jobs = queue.Queue(maxqueue)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                func, args = job
+                func(*args)
+            except Exception:
+                pass
+            finally:
+                self._jobs.task_done()
+
+    def submit(self, func, *args):
+        """Schedule ``func(*args)``, unless the queue is full.
+
+        Returns:
+            bool: `True` if the job was scheduled, `False` if dropped.
+
+        """
+        if len(self._threads) < self.workers:
+            self._start()
+        try:
+            self._jobs.put_nowait((func, args))
+        except queue.Full:
+            return False
+        return True
+
+    def join(self):
+        """Wait for all pending jobs to be done.
+        """
+        self._jobs.join()
+
+    def shutdown(self):
+        """Stop the worker threads once pending jobs are done.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._jobs.put(None)
+        for thread in threads:
+            thread.join()
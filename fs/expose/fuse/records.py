@@ -0,0 +1,191 @@
+# coding: utf-8
+"""Compact stat records, and their conversion from resource infos.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import stat
+
+from ...enums import ResourceType
+from ...permissions import Permissions
+
+_DIRECTORY = int(ResourceType.directory)
+
+# the fields of the stat records built from `os.stat` results
+_OS_FIELDS = (
+    'st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_uid', 'st_gid',
+    'st_size', 'st_atime', 'st_mtime', 'st_ctime',
+)
+
+
+class StatRecord(object):
+    """A read-only stat record, with the interface of a dictionary.
+
+    Records store their values in a tuple, and share the tuple of their
+    field names with every record with the same fields, so that caching
+    the stats of a large listing takes a fraction of the memory of a
+    dictionary per entry. fusepy only calls `items` to fill a ``stat``
+    structure, so records are never turned into dictionaries on the way.
+
+    """
+
+    __slots__ = ('_fields', '_values')
+
+    def __init__(self, fields, values):
+        self._fields = fields
+        self._values = values
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._fields.index(key)]
+        except ValueError:
+            raise KeyError(key)
+
+    def __eq__(self, other):
+        if isinstance(other, (StatRecord, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'StatRecord({!r})'.format(self.to_dict())
+
+    def get(self, key, default=None):
+        try:
+            return self._values[self._fields.index(key)]
+        except ValueError:
+            return default
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self._fields, self._values)
+
+    def to_dict(self):
+        return dict(zip(self._fields, self._values))
+
+
+class StatConverter(object):
+    """A converter of resource infos to stat records.
+
+    The umask is read once when the converter is created, the modes of
+    permissions are computed once per distinct set of permissions, and
+    the namespaces of a listing are checked once for the whole listing
+    rather than for each of its entries.
+
+    """
+
+    def __init__(self):
+        umask = os.umask(0)
+        os.umask(umask)
+        self.umask = umask
+        self._fields = {}
+        self._modes = {}
+
+    def pack(self, result):
+        """Get a record with the same fields and values as a mapping.
+        """
+        fields = tuple(result)
+        fields = self._fields.setdefault(fields, fields)
+        return StatRecord(fields, tuple(result[field] for field in fields))
+
+    def from_os(self, st):
+        """Get the record of an `os.stat_result`.
+        """
+        return StatRecord(_OS_FIELDS, tuple(getattr(st, name) for name in _OS_FIELDS))
+
+    def from_info(self, info):
+        """Get the record of a single `~fs.info.Info`.
+        """
+        raw = info.raw
+        return self._convert(raw, 'details' in raw, 'access' in raw)
+
+    def from_infos(self, infos):
+        """Iterate over the ``(name, record)`` pairs of a listing.
+
+        Arguments:
+            infos (iterable): the `~fs.info.Info` of the entries of a
+                directory, all with the same namespaces, such as the
+                ones returned by `~fs.base.FS.scandir`.
+
+        """
+        convert, details, access = self._convert, None, None
+        for info in infos:
+            raw = info.raw
+            if details is None:
+                details, access = 'details' in raw, 'access' in raw
+            yield raw['basic']['name'], convert(raw, details, access)
+
+    def _mode(self, names):
+        key = tuple(names)
+        mode = self._modes.get(key)
+        if mode is None:
+            mode = self._modes[key] = Permissions(names=names).mode
+        return mode
+
+    def _convert(self, raw, details, access):
+        if 'stat' in raw:
+            return self.pack(raw['stat'])
+        fields, values = [], []
+        mode = None
+        directory = False
+
+        if details:
+            d = raw.get('details') or {}
+            for field, key in (('st_atime', 'accessed'), ('st_mtime', 'modified')):
+                if d.get(key) is not None:
+                    fields.append(field)
+                    values.append(int(d[key]))
+            ctime = d.get('created')
+            if ctime is None:
+                ctime = d.get('metadata_changed')
+            if ctime is not None:
+                fields.append('st_ctime')
+                values.append(int(ctime))
+            if d.get('size') is not None:
+                fields.append('st_size')
+                values.append(d['size'])
+            directory = d.get('type') == _DIRECTORY
+            mode = stat.S_IFDIR if directory else stat.S_IFREG
+
+        if access:
+            a = raw.get('access') or {}
+            for field, key in (('st_uid', 'uid'), ('st_gid', 'gid')):
+                if a.get(key) is not None:
+                    fields.append(field)
+                    values.append(a[key])
+            if a.get('permissions') is not None:
+                mode = (mode or 0) | self._mode(a['permissions'])
+            elif details:
+                mode |= (0o777 if directory else 0o666) & ~self.umask
+
+        if mode is not None:
+            fields.append('st_mode')
+            values.append(mode)
+
+        name = raw.get('basic', {}).get('name')
+        if name is not None and name in '/':
+            fields.append('st_nlink')
+            values.append(2)
+
+        fields = tuple(fields)
+        return StatRecord(self._fields.setdefault(fields, fields), tuple(values))
@@ -0,0 +1,150 @@
+# coding: utf-8
+"""Statistics of the operations served by a FUSE mount.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import collections
+import errno
+import json
+import threading
+
+
+class LatencyHistogram(object):
+    """A histogram of latencies with logarithmic buckets.
+
+    Bucket ``i`` counts latencies below ``2**i`` microseconds, so that
+    recording a latency is a single integer conversion and increment,
+    and percentiles are estimated within a factor of two.
+
+    """
+
+    buckets = 32
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.total = 0.0
+        self.count = 0
+
+    def record(self, seconds):
+        index = min(int(seconds * 1e6).bit_length(), self.buckets - 1)
+        self.counts[index] += 1
+        self.total += seconds
+        self.count += 1
+
+    def percentile(self, p):
+        """Estimate the ``p``-th percentile latency, in seconds.
+        """
+        if not self.count:
+            return 0.0
+        rank, seen = p / 100.0 * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        return (2 ** index) / 1e6
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class OperationStats(object):
+    """The statistics of a single FUSE operation.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.bytes = 0
+        self.errors = collections.Counter()
+        self.latency = LatencyHistogram()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'bytes': self.bytes,
+                'errors': {
+                    errno.errorcode.get(code, str(code)): count
+                    for code, count in self.errors.items()
+                },
+                'latency': {
+                    'mean': self.latency.mean,
+                    'p50': self.latency.percentile(50),
+                    'p95': self.latency.percentile(95),
+                    'p99': self.latency.percentile(99),
+                },
+            }
+
+
+class StatsRecorder(object):
+    """A thread-safe recorder of per-operation call statistics.
+
+    Arguments:
+        profiler (SamplingProfiler): a profiler whose samples to report
+            along with the statistics of each operation, if any.
+        locks (PathLockManager): a lock manager whose waits to report
+            along with the statistics of each operation, if any.
+
+    """
+
+    def __init__(self, profiler=None, locks=None):
+        self.profiler = profiler
+        self.locks = locks
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def __getitem__(self, op):
+        return self._operations[op]
+
+    def __contains__(self, op):
+        return op in self._operations
+
+    def record(self, op, seconds, error=None, nbytes=0):
+        """Record a call to ``op`` that lasted ``seconds``.
+
+        Arguments:
+            op (str): the name of the operation.
+            seconds (float): the latency of the call.
+            error (int): the errno of the call, if it failed.
+            nbytes (int): the number of bytes transferred.
+
+        """
+        stats = self._operations.get(op)
+        if stats is None:
+            with self._lock:
+                stats = self._operations.setdefault(op, OperationStats())
+        with stats.lock:
+            stats.calls += 1
+            stats.bytes += nbytes
+            stats.latency.record(seconds)
+            if error is not None:
+                stats.errors[error] += 1
+
+    def snapshot(self):
+        """Get the statistics of every operation called so far.
+
+        Returns:
+            dict: a mapping of operation names to their statistics.
+
+        """
+        with self._lock:
+            operations = list(self._operations.items())
+        snapshot = {op: stats.snapshot() for op, stats in operations}
+        if self.profiler is not None:
+            for op, profile in self.profiler.snapshot().items():
+                if op in snapshot:
+                    snapshot[op]['profile'] = profile
+        if self.locks is not None:
+            for op, waits in self.locks.snapshot().items():
+                if op in snapshot:
+                    snapshot[op]['lock_wait'] = waits
+        return snapshot
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True).encode('utf-8')
+
+    def clear(self):
+        with self._lock:
+            self._operations.clear()
@@ -0,0 +1,174 @@
+# coding: utf-8
+"""Recording and replay of the FUSE operations served by a mount.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import json
+import threading
+import time
+
+import fuse
+import six
+
+from .utils import monotonic
+
+# the position of the file handle in the arguments of each operation
+_HANDLE_ARGS = {
+    'fsync': 2, 'fsyncdir': 2, 'flush': 1, 'getattr': 1, 'lock': 1, 'read': 3,
+    'readdir': 1, 'release': 1, 'releasedir': 1, 'truncate': 2, 'write': 3,
+}
+
+# the operations returning a new file handle
+_HANDLE_RESULTS = frozenset(['create', 'open', 'opendir'])
+
+
+class TraceRecorder(object):
+    """Record the operations of a mount as JSON lines.
+
+    Each line holds the name, arguments, start time, duration and
+    outcome of an operation call, written when the call returns.
+    Arguments are recorded with the signatures used without ``raw_fi``,
+    and buffers are recorded by their size only, so that traces never
+    contain file contents.
+
+    Arguments:
+        file (str or io.IOBase): the path to the trace file, or a text
+            file opened for writing.
+
+    """
+
+    def __init__(self, file):
+        self._owned = isinstance(file, six.string_types)
+        self._file = io.open(file, 'w', encoding='utf-8') if self._owned else file
+        self._lock = threading.Lock()
+        self._origin = monotonic()
+        self.closed = False
+
+    @staticmethod
+    def _encode(op, arg):
+        if isinstance(arg, fuse.fuse_file_info):
+            return arg.flags if op == 'open' else arg.fh
+        if isinstance(arg, bytes):
+            return {'size': len(arg)}
+        if isinstance(arg, (six.text_type, six.integer_types, float, list, tuple)):
+            return arg
+        return None
+
+    def record(self, op, args, start, elapsed, result=None, error=None):
+        """Record a call to ``op``, started at ``start`` by `monotonic`.
+        """
+        if op == 'create' and args and isinstance(args[-1], fuse.fuse_file_info):
+            result, args = args[-1].fh, args[:-1]
+        elif op == 'open' and args and isinstance(args[-1], fuse.fuse_file_info):
+            result = args[-1].fh
+        entry = {
+            't': start - self._origin,
+            'elapsed': elapsed,
+            'op': op,
+            'args': [self._encode(op, arg) for arg in args],
+        }
+        if error is not None:
+            entry['errno'] = error
+        elif op in _HANDLE_RESULTS or op == 'write':
+            entry['result'] = result
+        elif op == 'read':
+            entry['result'] = len(result)
+        line = json.dumps(entry, sort_keys=True)
+        with self._lock:
+            if not self.closed:
+                self._file.write(six.text_type(line) + '\n')
+
+    def close(self):
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                if self._owned:
+                    self._file.close()
+                else:
+                    self._file.flush()
+
+
+class TraceReplayer(object):
+    """Replay a recorded trace against operations, without any mount.
+
+    Calls are replayed from a single thread, in the order of the trace.
+    Calls are recorded once they return, so concurrent calls of a mount
+    served by several threads are replayed in the order they completed,
+    not in the order they started. The file handles of the trace are
+    mapped to the ones returned by the replayed operations.
+
+    Arguments:
+        operations (PyfilesystemFuseOperations): the operations to call,
+            created without ``raw_fi``.
+        speed (float): the speed factor to replay the trace at, where
+            ``1`` keeps the recorded pace, or `None` to replay calls
+            as fast as possible.
+
+    """
+
+    def __init__(self, operations, speed=None):
+        if getattr(operations, 'raw_fi', False):
+            raise ValueError('cannot replay a trace with raw_fi')
+        self.operations = operations
+        self.speed = speed
+
+    @staticmethod
+    def load(file):
+        """Iterate over the entries of a trace file or path.
+        """
+        if isinstance(file, six.string_types):
+            with io.open(file, encoding='utf-8') as f:
+                for entry in TraceReplayer.load(f):
+                    yield entry
+            return
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+    def replay(self, trace):
+        """Replay a trace.
+
+        Arguments:
+            trace (str or io.IOBase or iterable): the path to a trace
+                file, an open trace file, or an iterable of entries.
+
+        Returns:
+            dict: the number of ``calls``, of ``errors``, of calls whose
+            outcome differs from the recorded one (``mismatches``), and
+            the ``elapsed`` number of seconds.
+
+        """
+        if isinstance(trace, six.string_types) or hasattr(trace, 'read'):
+            trace = self.load(trace)
+        handles, origin = {}, None
+        summary = {'calls': 0, 'errors': 0, 'mismatches': 0}
+        start = monotonic()
+        for entry in trace:
+            op, args = entry['op'], list(entry['args'])
+            if origin is None:
+                origin = entry['t']
+            if self.speed:
+                delay = (entry['t'] - origin) / self.speed - (monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            index = _HANDLE_ARGS.get(op)
+            if index is not None and index < len(args) and args[index] is not None:
+                args[index] = handles.get(args[index], args[index])
+            # buffers are recorded by size, so replay them as zeros
+            args = [b'\0' * a['size'] if isinstance(a, dict) else a for a in args]
+            summary['calls'] += 1
+            try:
+                result = self.operations(op, *args)
+            except OSError as err:
+                summary['errors'] += 1
+                summary['mismatches'] += entry.get('errno') != err.errno
+                continue
+            summary['mismatches'] += 'errno' in entry
+            if op in _HANDLE_RESULTS and 'result' in entry:
+                handles[entry['result']] = result
+            elif op in ('release', 'releasedir'):
+                handles.pop(entry['args'][index], None)
+        summary['elapsed'] = monotonic() - start
+        return summary
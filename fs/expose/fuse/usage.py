@@ -0,0 +1,65 @@
+# coding: utf-8
+"""Bookkeeping of the space used by filesystems without a system path.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import threading
+
+from ...path import isbase, relpath, join
+
+
+class UsageCounter(object):
+    """An incrementally maintained count of the resources of a filesystem.
+
+    The counter is built with a single walk of the filesystem, and then
+    kept up to date by the operations modifying it, so that `statfs`
+    does not need to walk the filesystem again.
+
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._sizes = {'/': 0}
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __contains__(self, path):
+        return path in self._sizes
+
+    @classmethod
+    def from_fs(cls, fs):
+        """Count the resources of a filesystem.
+        """
+        counter = cls()
+        for path, info in fs.walk.info(namespaces=['details']):
+            counter.set(path, 0 if info.is_dir else info.size or 0)
+        return counter
+
+    def get(self, path, default=0):
+        return self._sizes.get(path, default)
+
+    def set(self, path, size):
+        """Record the size of the resource at ``path``.
+        """
+        with self._lock:
+            self.bytes += size - self._sizes.get(path, 0)
+            self._sizes[path] = size
+
+    def discard(self, path):
+        """Forget about the resource at ``path``, if any.
+        """
+        with self._lock:
+            self.bytes -= self._sizes.pop(path, 0)
+
+    def move(self, old, new):
+        """Move the resource at ``old``, and every resource below it.
+        """
+        with self._lock:
+            for path in [p for p in self._sizes if isbase(new, p)]:
+                self.bytes -= self._sizes.pop(path)
+            for path in [p for p in self._sizes if isbase(old, p)]:
+                size = self._sizes.pop(path)
+                self._sizes[join(new, relpath(path[len(old):]))] = size
@@ -7,7 +7,9 @@ import errno
 import posix
 import functools
 import operator
+import os
 import sys
+import time
 
 import fuse
 import six
@@ -66,30 +68,52 @@ class _ConvertFSErrors(object):
         # errno.ENAMETOOLONG: errors.PathError,
     }
 
+    def __init__(self):
+        self._errnos = {}
+
+    def errno_of(self, exc_type):
+        """Get the errno of an exception class, or of its closest base.
+
+        The errno is resolved once per class, following the method
+        resolution order so that subclasses of the exceptions listed in
+        `FILE_ERRORS` are translated like their parents.
+
+        """
+        code = self._errnos.get(exc_type)
+        if code is None:
+            code = next(
+                (self.FILE_ERRORS[cls] for cls in exc_type.__mro__ if cls in self.FILE_ERRORS),
+                errno.EIO
+            )
+            self._errnos[exc_type] = code
+        return code
+
     def __call__(self, func):
+        errno_of = self.errno_of
+        # a plain `try` block is cheaper than entering a context manager
+        # on every call of the decorated function
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            with self:
+            try:
                 return func(*args, **kwargs)
+            except (errors.FSError, KeyError) as err:
+                six.reraise(
+                    fuse.FuseOSError,
+                    fuse.FuseOSError(errno_of(type(err))),
+                    sys.exc_info()[2]
+                )
         return wrapper
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        # if exc_type is not None:
-        #     raise exc_value if exc_value else exc_type
-        if exc_type is not None:
-            if isinstance(exc_value, (errors.FSError, KeyError)):
-                six.reraise(
-                    fuse.FuseOSError,
-                    fuse.FuseOSError(self.FILE_ERRORS.get(exc_type)),
-                    traceback
-                )
-            else:
-                six.reraise(
-                    exc_type, exc_value, traceback
-                )
+        if exc_type is not None and issubclass(exc_type, (errors.FSError, KeyError)):
+            six.reraise(
+                fuse.FuseOSError,
+                fuse.FuseOSError(self.errno_of(exc_type)),
+                traceback
+            )
 
 # Stops linter complaining about invalid class name
 convert_fs_errors = _ConvertFSErrors()
@@ -99,3 +123,15 @@ if sys.version_info < (3, 3):
         return (dt - datetime.datetime.fromtimestamp(0, dt.tzinfo)).total_seconds()
 else:
     timestamp = operator.methodcaller('timestamp')
+
+# `time.monotonic` is not available before Python 3.3
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+def available_memory():
+    """Get the number of bytes of physical memory available, or 0.
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 0
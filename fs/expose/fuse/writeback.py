@@ -0,0 +1,277 @@
+# coding: utf-8
+"""Write-back spooling of files open for writing through a FUSE mount.
+"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+import shutil
+import tempfile
+import threading
+
+from six.moves import queue
+
+from ... import errors
+from ...enums import Seek
+
+log = logging.getLogger("fs.expose.fuse.writeback")
+
+
+class Spool(object):
+    """A local temporary copy of a file open for writing.
+
+    Writes only reach the local copy, which is sent back to the
+    filesystem in a single streamed transfer by `upload`.
+
+    Arguments:
+        fs (~fs.base.FS): the filesystem the file belongs to.
+        path (str): the path to the file.
+        mode (str): the mode the file was opened with.
+
+    """
+
+    def __init__(self, fs, path, mode):
+        self.fs = fs
+        self.path = path
+        self.mode = mode
+        self.pending = 0
+        self.error = None
+        self._dirty = 0
+        self._modified = False
+        self._lock = threading.RLock()
+        if 'w' in mode:
+            fs.create(path, wipe=True)
+        elif 'a' in mode:
+            fs.create(path)
+        elif 'x' in mode and not fs.create(path):
+            raise errors.FileExists(path)
+        self._file = tempfile.TemporaryFile()
+        if 'w' not in mode and 'x' not in mode:
+            try:
+                with fs.openbin(path) as src:
+                    shutil.copyfileobj(src, self._file)
+            except Exception:
+                self._file.close()
+                raise
+        self.size = self._file.tell()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    @property
+    def dirty(self):
+        """int: the number of bytes written since the last upload.
+        """
+        return self._dirty
+
+    def readable(self):
+        return 'r' in self.mode or '+' in self.mode
+
+    def writable(self):
+        return True
+
+    def seek(self, offset, whence=Seek.set):
+        with self._lock:
+            return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        with self._lock:
+            return self._file.read(size)
+
+    def write(self, data):
+        with self._lock:
+            return self._write(data)
+
+    def pread(self, size, offset):
+        """Read up to ``size`` bytes at ``offset``, atomically.
+        """
+        with self._lock:
+            self._file.seek(offset, Seek.set)
+            return self._file.read(size)
+
+    def pwrite(self, data, offset):
+        """Write ``data`` at ``offset``, atomically.
+
+        Uploads also move the position of the local copy, so seeking
+        and writing must happen without releasing the lock in between.
+
+        """
+        with self._lock:
+            self._file.seek(offset, Seek.set)
+            return self._write(data)
+
+    def _write(self, data):
+        if 'a' in self.mode:
+            self._file.seek(0, Seek.end)
+        self._file.write(data)
+        self.size = max(self.size, self._file.tell())
+        self._dirty += len(data)
+        self._modified = True
+        return len(data)
+
+    def truncate(self, size=None):
+        with self._lock:
+            self._file.truncate(size)
+            self.size = self._file.tell() if size is None else size
+            self._modified = True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._file.close()
+
+    def upload(self):
+        """Send the local copy to the filesystem, if it was modified.
+
+        Returns:
+            int: the number of dirty bytes that were uploaded.
+
+        """
+        with self._lock:
+            if self._modified:
+                self._file.flush()
+                self._file.seek(0)
+                self.fs.setbinfile(self.path, self._file)
+            dirty, self._dirty, self._modified = self._dirty, 0, False
+            return dirty
+
+
+class UploadPool(object):
+    """A pool of daemon threads uploading spools in the background.
+
+    Arguments:
+        workers (int): the number of worker threads, started lazily.
+            With no workers, spools are uploaded synchronously.
+        max_dirty (int): the number of bytes written to spools but not
+            uploaded yet above which writers are throttled until
+            uploads catch up.
+        callback (callable): a function called with each spool after
+            it was uploaded.
+
+    """
+
+    def __init__(self, workers=4, max_dirty=64*1024*1024, callback=None):
+        self.workers = workers
+        self.max_dirty = max_dirty
+        self.callback = callback
+        self._dirty = 0
+        self._pending = 0
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+
+    @property
+    def dirty(self):
+        """int: the number of bytes written to spools but not uploaded.
+        """
+        return self._dirty
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            self._run(*job)
+
+    def _run(self, spool, close):
+        error = None
+        try:
+            uploaded = spool.upload()
+        except Exception as err:
+            error, uploaded = err, 0
+        if close:
+            if error is not None:
+                # nobody waits on a closed spool, and its bytes are lost
+                log.error("failed to upload %r: %s", spool.path, error)
+                uploaded = spool.dirty
+            spool.close()
+        with self._cond:
+            self._dirty -= uploaded
+            spool.pending -= 1
+            self._pending -= 1
+            if error is not None:
+                spool.error = error
+            self._cond.notify_all()
+        if error is None and self.callback is not None:
+            self.callback(spool)
+
+    def account(self, spool, size):
+        """Record ``size`` bytes written to ``spool``, throttling if needed.
+        """
+        with self._cond:
+            self._dirty += size
+            over = self._dirty > self.max_dirty
+        if over:
+            if not spool.pending:
+                self.submit(spool)
+            with self._cond:
+                while self._dirty > self.max_dirty and self._pending:
+                    self._cond.wait()
+
+    def submit(self, spool, close=False):
+        """Schedule the upload of ``spool``, and close it if ``close``.
+        """
+        with self._cond:
+            spool.pending += 1
+            self._pending += 1
+        if self.workers <= 0:
+            self._run(spool, close)
+            return
+        if len(self._threads) < self.workers:
+            self._start()
+        self._jobs.put((spool, close))
+
+    def wait(self, spool, check=True):
+        """Wait for the scheduled uploads of ``spool`` to be done.
+
+        Arguments:
+            spool (Spool): the spool to wait for.
+            check (bool): set to `False` to leave the error of a failed
+                upload to be reported by a later call to `check`.
+
+        Raises:
+            Exception: the error raised by a failed upload, if any.
+
+        """
+        with self._cond:
+            while spool.pending:
+                self._cond.wait()
+        if check:
+            self.check(spool)
+
+    def check(self, spool):
+        """Raise the error of a failed background upload of ``spool``.
+
+        Raises:
+            Exception: the error raised by the last failed upload, if
+                it was not reported yet.
+
+        """
+        with self._cond:
+            error, spool.error = spool.error, None
+        if error is not None:
+            raise error
+
+    def shutdown(self):
+        """Stop the worker threads once scheduled uploads are done.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._jobs.put(None)
+        for thread in threads:
+            thread.join()
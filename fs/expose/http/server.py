@@ -19,6 +19,7 @@ import mimetypes
 import os
 import re
 import shutil
+import uuid
 
 import six
 
@@ -32,6 +33,58 @@ from ...opener import open_fs
 
 from .__meta__ import *
 
+
+class _RangeReader(object):
+    """A file-like object reading only some byte ranges of a file.
+
+    Each range is preceded by an optional header, and followed by an
+    optional trailer, so that both single ranges and ``multipart/byteranges``
+    bodies can be streamed without reading the rest of the file.
+
+    Arguments:
+        source (io.IOBase): a seekable file object open for reading.
+        parts (list): a list of ``(header, start, end)`` tuples, where
+            ``start`` and ``end`` are inclusive offsets in ``source``.
+        trailer (bytes): the bytes to send after the last range.
+
+    """
+
+    def __init__(self, source, parts, trailer=b'', chunk_size=64*1024):
+        self._source = source
+        self._chunks = self._read_parts(parts, trailer, chunk_size)
+        self._buffer = b''
+
+    def _read_parts(self, parts, trailer, chunk_size):
+        for header, start, end in parts:
+            if header:
+                yield header
+            self._source.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = self._source.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        if trailer:
+            yield trailer
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self._source.close()
+
+
 class PyfilesystemServerHandler(BaseHTTPRequestHandler, object):
     """Simple HTTP request handler with GET/HEAD/POST commands.
 
@@ -47,6 +100,10 @@ class PyfilesystemServerHandler(BaseHTTPRequestHandler, object):
 
     server_version = "PyfilesystemServerHandler/{}".format(__version__)
     _regex_filename = re.compile(r'Content-Disposition.*name="file"; filename="(.*)"')
+    # only ASCII digits are valid, unlike the ones of `str.isdigit`
+    _regex_range = re.compile(r'^\s*([0-9]*)\s*-\s*([0-9]*)\s*$')
+    # the maximum number of ranges of a request not to ignore its header
+    _max_ranges = 64
 
     def __init__(self, filesystem):
         self.fs = open_fs(filesystem)
@@ -179,17 +236,116 @@ class PyfilesystemServerHandler(BaseHTTPRequestHandler, object):
             # newline translations, making the actual size of the content
             # transmitted *less* than the content-length!
             f = self.fs.open(path, 'rb')
+            info = self.fs.getinfo(path, ['details'])
         except errors.ResourceNotFound:
+            if f is not None:
+                f.close()
             self.send_error(404, "File not found")
             return None
-        self.send_response(200)
-        self.send_header("Content-type", ctype)
-        self.send_header("Content-Length", self.fs.getsize(path))
-        #todof
-        # ~ self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+
+        size = info.size
+        modified = info.get('details', 'modified')
+        validators = {}
+        if modified is not None:
+            validators["Last-Modified"] = self.date_time_string(modified)
+            validators["ETag"] = '"{:x}-{:x}"'.format(int(modified * 1e6), size)
+
+        ranges = None
+        if 'Range' in self.headers:
+            if_range = self.headers.get('If-Range')
+            # only send part of the file if it did not change since the
+            # client got the rest of it
+            if if_range is None or if_range in validators.values():
+                ranges = self.parse_ranges(self.headers['Range'], size)
+
+        if ranges == []:
+            f.close()
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */{}".format(size))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        if not ranges:
+            self.send_response(200)
+            self.send_header("Content-type", ctype)
+            self.send_header("Content-Length", size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.send_response(206)
+            self.send_header("Content-type", ctype)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+            self.send_header("Content-Length", end - start + 1)
+            f = _RangeReader(f, [(b'', start, end)])
+        else:
+            boundary = uuid.uuid4().hex
+            parts = [(
+                "\r\n--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n".format(
+                    boundary, ctype, start, end, size).encode('utf-8'),
+                start, end,
+            ) for start, end in ranges]
+            trailer = "\r\n--{}--\r\n".format(boundary).encode('utf-8')
+            length = sum(len(header) + end - start + 1 for header, start, end in parts)
+            self.send_response(206)
+            self.send_header(
+                "Content-type", "multipart/byteranges; boundary={}".format(boundary))
+            self.send_header("Content-Length", length + len(trailer))
+            f = _RangeReader(f, parts, trailer)
+        self.send_header("Accept-Ranges", "bytes")
+        for header, value in sorted(validators.items()):
+            self.send_header(header, value)
         self.end_headers()
         return f
 
+    @classmethod
+    def parse_ranges(cls, header, size):
+        """Parse the value of a ``Range`` header.
+
+        Arguments:
+            header (str): the value of the header, such as
+                ``bytes=0-499,-500``.
+            size (int): the size of the requested file.
+
+        Returns:
+            list: the sorted ``(start, end)`` inclusive offsets of the
+            satisfiable ranges, where overlapping and adjacent ranges
+            are merged, which is empty if none is satisfiable.
+            None: when the header is invalid, or asks for more ranges
+            than `_max_ranges`, and must be ignored.
+
+        """
+        unit, _, specs = header.partition('=')
+        if unit.strip().lower() != 'bytes' or not specs.strip():
+            return None
+        specs = specs.split(',')
+        if len(specs) > cls._max_ranges:
+            return None
+        ranges = []
+        for spec in specs:
+            match = cls._regex_range.match(spec)
+            if match is None or not any(match.groups()):
+                return None
+            first, last = match.groups()
+            if not first:
+                # a suffix range, giving the length of the end of the file
+                if int(last) == 0:
+                    continue
+                start, end = max(size - int(last), 0), size - 1
+            else:
+                start = int(first)
+                if last and int(last) < start:
+                    return None
+                end = min(int(last), size - 1) if last else size - 1
+            if start < size:
+                ranges.append((start, end))
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
     def list_directory(self, path):
         """Produce a directory listing.
 
@@ -0,0 +1,304 @@
+# coding: utf-8
+"""Throughput and metadata benchmarks of filesystems mounted with FUSE.
+
+Each backend is mounted in a subprocess, like in `tests.test_fuse`, and
+exercised through the mountpoint with plain system calls, so that the
+numbers include the whole kernel round-trip. Run with::
+
+    $ python -m tests.benchmark_fuse --output results.json
+    $ python -m tests.benchmark_fuse --baseline results.json
+
+Every result is a rate, where higher is better, so that comparing
+against a baseline only needs a single tolerance.
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import fs
+import fuse
+
+from fs.expose.fuse.operations import PyfilesystemFuseOperations
+
+BACKENDS = ('mem://', 'temp://', 'osfs')
+BLOCK_SIZES = (4096, 65536, 1024*1024)
+READDIR_SIZES = (10**3, 10**4, 10**5, 10**6)
+THREADS = (1, 2, 4, 8)
+
+MiB = 1024 * 1024
+
+
+def _is_mounted(mountpoint):
+    with open('/etc/mtab') as f:
+        return any(mountpoint == line.split(' ')[1] for line in f)
+
+
+@contextlib.contextmanager
+def mounted(url, populate=None, timeout=5.0):
+    """Mount a fresh filesystem in a subprocess, and yield the mountpoint.
+
+    Arguments:
+        url (str): the FS URL of the backend, or ``'osfs'`` for an
+            `~fs.osfs.OSFS` in a temporary directory.
+        populate (callable): a function called with the backend before
+            it is mounted, to create resources without going through
+            the mount.
+        timeout (float): the number of seconds to wait for the mount.
+
+    """
+    tmpdir = tempfile.mkdtemp() if url == 'osfs' else None
+    source = fs.open_fs(tmpdir or url)
+    if populate is not None:
+        populate(source)
+    mountpoint = tempfile.mkdtemp()
+    process = multiprocessing.Process(
+        target=fuse.FUSE,
+        args=(PyfilesystemFuseOperations(source), mountpoint),
+        kwargs={'foreground': True, 'debug': False},
+    )
+    process.start()
+    try:
+        deadline = time.time() + timeout
+        while not _is_mounted(mountpoint):
+            if time.time() > deadline:
+                raise RuntimeError('could not mount {} to {}'.format(url, mountpoint))
+            time.sleep(0.001)
+        yield mountpoint
+    finally:
+        process.terminate()
+        process.join()
+        source.close()
+        os.rmdir(mountpoint)
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+
+def _timed(func, *args):
+    start = time.time()
+    func(*args)
+    return max(time.time() - start, 1e-9)
+
+
+def sequential_write(mountpoint, block_size, size):
+    block = os.urandom(block_size)
+    path = os.path.join(mountpoint, 'sequential.bin')
+
+    def run():
+        with io.open(path, 'wb', buffering=0) as f:
+            for _ in range(size // block_size):
+                f.write(block)
+    return size / MiB / _timed(run)
+
+
+def sequential_read(mountpoint, block_size, size):
+    path = os.path.join(mountpoint, 'sequential.bin')
+
+    def run():
+        with io.open(path, 'rb', buffering=0) as f:
+            while f.read(block_size):
+                pass
+    return size / MiB / _timed(run)
+
+
+def random_read(mountpoint, block_size, size):
+    path = os.path.join(mountpoint, 'sequential.bin')
+    offsets = [random.randrange(0, size - block_size + 1) for _ in range(size // block_size)]
+
+    def run():
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            for offset in offsets:
+                os.lseek(fd, offset, os.SEEK_SET)
+                os.read(fd, block_size)
+        finally:
+            os.close(fd)
+    return size / MiB / _timed(run)
+
+
+def random_write(mountpoint, block_size, size):
+    path = os.path.join(mountpoint, 'sequential.bin')
+    block = os.urandom(block_size)
+    offsets = [random.randrange(0, size - block_size + 1) for _ in range(size // block_size)]
+
+    def run():
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            for offset in offsets:
+                os.lseek(fd, offset, os.SEEK_SET)
+                os.write(fd, block)
+        finally:
+            os.close(fd)
+    return size / MiB / _timed(run)
+
+
+def stat_storm(mountpoint, paths, count, threads=1):
+    per_thread = count // threads
+
+    def work():
+        for i in range(per_thread):
+            os.stat(os.path.join(mountpoint, paths[i % len(paths)]))
+
+    def run():
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    return per_thread * threads / _timed(run)
+
+
+def create_unlink(mountpoint, count):
+    directory = os.path.join(mountpoint, 'churn')
+    os.mkdir(directory)
+    paths = [os.path.join(directory, 'file{}'.format(i)) for i in range(count)]
+
+    def run():
+        for path in paths:
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o644))
+        for path in paths:
+            os.unlink(path)
+    rate = 2 * count / _timed(run)
+    os.rmdir(directory)
+    return rate
+
+
+def readdir(mountpoint):
+    return 1 / _timed(lambda: sum(1 for _ in os.listdir(os.path.join(mountpoint, 'dir'))))
+
+
+def run_backend(url, args):
+    """Run every benchmark against one backend.
+
+    Returns:
+        dict: a mapping of benchmark names to their ``[value, unit]``.
+
+    """
+    results = {}
+    size = args.file_size * MiB
+    with mounted(url) as mountpoint:
+        for block_size in BLOCK_SIZES:
+            results['seq_write/{}'.format(block_size)] = [
+                sequential_write(mountpoint, block_size, size), 'MB/s']
+            results['seq_read/{}'.format(block_size)] = [
+                sequential_read(mountpoint, block_size, size), 'MB/s']
+            results['random_read/{}'.format(block_size)] = [
+                random_read(mountpoint, block_size, size), 'MB/s']
+            results['random_write/{}'.format(block_size)] = [
+                random_write(mountpoint, block_size, size), 'MB/s']
+        results['create_unlink'] = [create_unlink(mountpoint, args.files), 'ops/s']
+
+    paths = ['file{}'.format(i) for i in range(args.files)]
+
+    def populate_files(source):
+        for path in paths:
+            source.create(path)
+
+    with mounted(url, populate_files) as mountpoint:
+        for threads in THREADS:
+            results['stat/{}threads'.format(threads)] = [
+                stat_storm(mountpoint, paths, args.stats, threads), 'ops/s']
+
+    for entries in READDIR_SIZES:
+        if entries > args.max_entries:
+            break
+
+        def populate_dir(source, entries=entries):
+            source.makedir('dir')
+            for i in range(entries):
+                source.create('dir/entry{}'.format(i))
+        with mounted(url, populate_dir) as mountpoint:
+            results['readdir/{}'.format(entries)] = [readdir(mountpoint), 'listings/s']
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare results against a baseline.
+
+    Arguments:
+        results (dict): the results of the current run.
+        baseline (dict): the results of a previous run.
+        tolerance (float): the fraction a rate may drop by before it
+            is considered a regression.
+
+    Returns:
+        list: the ``(backend, name, ratio)`` of every regression, where
+        ``ratio`` is the current rate divided by the baseline rate.
+
+    """
+    regressions = []
+    for backend, benchmarks in sorted(results['results'].items()):
+        reference = baseline.get('results', {}).get(backend, {})
+        for name, (value, _unit) in sorted(benchmarks.items()):
+            if name not in reference or not reference[name][0]:
+                continue
+            ratio = value / reference[name][0]
+            if ratio < 1 - tolerance:
+                regressions.append((backend, name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', action='append', choices=BACKENDS,
+                        help='the backends to benchmark (default: all)')
+    parser.add_argument('--file-size', type=int, default=64,
+                        help='the size of the file used for throughput, in MiB')
+    parser.add_argument('--files', type=int, default=1000,
+                        help='the number of files created for metadata benchmarks')
+    parser.add_argument('--stats', type=int, default=10000,
+                        help='the number of stat calls of the stat storms')
+    parser.add_argument('--max-entries', type=int, default=10**4,
+                        help='the size of the largest directory listed')
+    parser.add_argument('--output', help='the file to write the JSON results to')
+    parser.add_argument('--baseline', help='a JSON results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='the relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = {
+        'meta': {
+            'date': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'fs': fs.__version__,
+        },
+        'results': {},
+    }
+    for url in args.backend or BACKENDS:
+        results['results'][url] = run_backend(url, args)
+        for name, (value, unit) in sorted(results['results'][url].items()):
+            print('{:<10} {:<24} {:>12.1f} {}'.format(url, name, value, unit))
+
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.baseline:
+        with io.open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for backend, name, ratio in regressions:
+            print('REGRESSION {:<10} {:<24} {:.0%} of baseline'.format(backend, name, ratio))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
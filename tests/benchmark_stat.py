@@ -0,0 +1,113 @@
+# coding: utf-8
+"""Micro-benchmark of the conversion of directory listings to stat records.
+
+Compares the per-entry conversion used before `StatConverter`, which
+read the umask and built a dictionary for every entry, with the batched
+conversion to `StatRecord` used by ``readdir``. Run with::
+
+    $ python -m tests.benchmark_stat --entries 100000
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import os
+import stat
+import sys
+import time
+
+from fs.enums import ResourceType
+from fs.info import Info
+from fs.expose.fuse.records import StatConverter
+from fs.expose.fuse.utils import timestamp
+
+
+def legacy_stat_from_info(info):
+    """The conversion of a single info, as done before `StatConverter`.
+    """
+    result = {}
+    umask = os.umask(0)
+    os.umask(umask)
+    if info.has_namespace('details'):
+        if info.accessed is not None:
+            result['st_atime'] = int(timestamp(info.accessed))
+        if info.modified is not None:
+            result['st_mtime'] = int(timestamp(info.modified))
+        if (info.created or info.metadata_changed) is not None:
+            result['st_ctime'] = int(timestamp(info.created or info.metadata_changed))
+        if info.size is not None:
+            result['st_size'] = info.size
+        if info.type is ResourceType.directory:
+            result['st_mode'] = stat.S_IFDIR
+        else:
+            result['st_mode'] = stat.S_IFREG
+    mode = result.get('st_mode', 0)
+    if info.has_namespace('access'):
+        if info.uid is not None:
+            result['st_uid'] = info.uid
+        if info.gid is not None:
+            result['st_gid'] = info.gid
+        if info.permissions is not None:
+            result['st_mode'] = mode | info.permissions.mode
+        elif info.has_namespace('details'):
+            if info.type is ResourceType.directory:
+                result['st_mode'] = mode | 0o777 & ~umask
+            else:
+                result['st_mode'] = mode | 0o666 & ~umask
+    if info.name is not None and info.name in '/':
+        result['st_nlink'] = 2
+    return result
+
+
+def make_infos(count):
+    now = time.time()
+    return [
+        Info({
+            'basic': {'name': 'file{}'.format(i), 'is_dir': False},
+            'details': {
+                'accessed': now, 'modified': now, 'created': now,
+                'size': i, 'type': int(ResourceType.file),
+            },
+            'access': {'uid': 1000, 'gid': 1000, 'permissions': ['u_r', 'u_w', 'g_r', 'o_r']},
+        })
+        for i in range(count)
+    ]
+
+
+def bench(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        best = min(best, time.time() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    infos = make_infos(args.entries)
+    legacy, dicts = bench(
+        lambda: [(info.name, legacy_stat_from_info(info)) for info in infos], args.repeat)
+    batched, records = bench(
+        lambda: list(StatConverter().from_infos(infos)), args.repeat)
+    assert all(d == r for (_, d), (_, r) in zip(dicts, records))
+
+    size = lambda obj: sys.getsizeof(obj) + (
+        sys.getsizeof(obj.values()) if not isinstance(obj, dict) else 0)
+    print('entries          {:>10}'.format(args.entries))
+    print('legacy           {:>10.3f} s'.format(legacy))
+    print('batched records  {:>10.3f} s ({:.1f}x)'.format(batched, legacy / batched))
+    print('dict size        {:>10} B/entry'.format(size(dicts[0][1])))
+    print('record size      {:>10} B/entry'.format(size(records[0][1])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
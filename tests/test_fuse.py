@@ -5,12 +5,16 @@ from __future__ import unicode_literals
 import datetime
 import errno
 import functools
+import hashlib
+import json
 import os
 import posix
+import shutil
 import textwrap
 import tempfile
 import multiprocessing
 import stat
+import threading
 import time
 import unittest
 
@@ -22,8 +26,20 @@ from fs.info import Info
 from fs.test import FSTestCases
 from fs.wrap import read_only
 from fs.enums import ResourceType
+from fs.expose.fuse import mount, PyfilesystemFuseMounter
+from fs.expose.fuse.cache import GenerationTable
+from fs.expose.fuse.crawler import WarmupCrawler
+from fs.expose.fuse.diskcache import DiskCache
+from fs.expose.fuse.handles import HandleTable, RawFile, SharedFileTable
+from fs.expose.fuse.locks import PathLockManager, RWLock
 from fs.expose.fuse.operations import PyfilesystemFuseOperations
-from fs.expose.fuse.utils import timestamp
+from fs.expose.fuse.readahead import PrefetchPool, ReadaheadWindow
+from fs.expose.fuse.records import StatConverter, StatRecord
+from fs.expose.fuse.stats import LatencyHistogram
+from fs.expose.fuse.trace import TraceRecorder, TraceReplayer
+from fs.expose.fuse.usage import UsageCounter
+from fs.expose.fuse.utils import convert_fs_errors, monotonic, timestamp
+from fs.expose.fuse.writeback import Spool
 
 from .utils import mock
 
@@ -91,8 +107,8 @@ class TestAtomicOperations(unittest.TestCase):
 
     def test_miscellaneous(self):
         with self.assertRaises(OSError) as handler:
-            self.ops.getxattr('/', None)
-        self.assertEqual(handler.exception.errno, errno.ENOTSUP)
+            self.ops.getxattr('/', 'user.md5')
+        self.assertEqual(handler.exception.errno, errno.ENODATA)
         with self.assertRaises(OSError) as handler:
             self.ops.link('a', 'b')
         self.assertEqual(handler.exception.errno, errno.EPERM)
@@ -102,6 +118,9 @@ class TestAtomicOperations(unittest.TestCase):
         with self.assertRaises(OSError) as handler:
             self.ops('unknown')
         self.assertEqual(handler.exception.errno, errno.ENOSYS)
+        with self.assertRaises(OSError) as handler:
+            self.ops('_key', '/')
+        self.assertEqual(handler.exception.errno, errno.ENOSYS)
 
     def test_chmod(self):
         # Normal behaviour
@@ -398,9 +417,10 @@ class TestAtomicOperations(unittest.TestCase):
         self.assertEqual(handler.exception.errno, errno.ENOTDIR)
 
     def test_statfs(self):
-        with mock.patch.dict(self.fs._meta, {}):
+        with mock.patch.dict(self.fs._meta, {'network': True}):
             self.assertEqual(self.ops.statfs('/'), {})
-        with mock.patch.dict(self.fs._meta, {'max_sys_path_length': 1}):
+        self.ops.statfs_cache.clear()
+        with mock.patch.dict(self.fs._meta, {'network': True, 'max_sys_path_length': 1}):
             self.assertEqual(self.ops.statfs('/'), {'f_namelen': 1})
 
     def test_truncate(self):
@@ -488,3 +508,1755 @@ class TestAtomicOperations(unittest.TestCase):
         with self.assertRaises(OSError) as ctx:
             self.ops('write', 'file.txt', b'', 0, fd)
         self.assertEqual(ctx.exception.errno, errno.EINVAL)
+
+
+class TestAttributeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(self.fs, attr_timeout=60)
+
+    def test_getattr_cached(self):
+        self.fs.settext('file.txt', 'Hello')
+        with mock.patch.object(self.fs, 'getinfo', wraps=self.fs.getinfo) as m:
+            first = self.ops('getattr', '/file.txt')
+            second = self.ops('getattr', 'file.txt')
+            self.assertEqual(first, second)
+            self.assertEqual(m.call_count, 1)
+        self.assertEqual(self.ops.attr_cache.hits, 1)
+        self.assertEqual(self.ops.attr_cache.misses, 1)
+
+    def test_ttl(self):
+        self.fs.settext('file.txt', 'Hello')
+        with mock.patch('fs.expose.fuse.cache.monotonic', return_value=0):
+            self.ops('getattr', 'file.txt')
+        with mock.patch('fs.expose.fuse.cache.monotonic', return_value=61):
+            with mock.patch.object(self.fs, 'getinfo', wraps=self.fs.getinfo) as m:
+                self.ops('getattr', 'file.txt')
+                self.assertEqual(m.call_count, 1)
+
+    def test_disabled(self):
+        self.ops = PyfilesystemFuseOperations(self.fs, attr_timeout=0)
+        self.fs.settext('file.txt', 'Hello')
+        self.ops('getattr', 'file.txt')
+        self.assertEqual(len(self.ops.attr_cache), 0)
+
+    def test_lru_eviction(self):
+        self.ops = PyfilesystemFuseOperations(self.fs, attr_cache_size=2)
+        for name in ('a', 'b', 'c'):
+            self.fs.touch(name)
+            self.ops('getattr', name)
+        self.assertNotIn('/a', self.ops.attr_cache)
+        self.assertIn('/b', self.ops.attr_cache)
+        self.assertIn('/c', self.ops.attr_cache)
+
+    def test_invalidate_write(self):
+        fd = self.ops('create', 'file.txt', posix.O_WRONLY)
+        self.assertEqual(self.ops('getattr', 'file.txt')['st_size'], 0)
+        self.ops('write', 'file.txt', b'Hello', 0, fd)
+        self.ops('release', 'file.txt', fd)
+        self.assertEqual(self.ops('getattr', 'file.txt')['st_size'], 5)
+        self.ops('truncate', 'file.txt', 2)
+        self.assertEqual(self.ops('getattr', 'file.txt')['st_size'], 2)
+
+    def test_invalidate_namespace(self):
+        self.fs.makedir('dir')
+        self.fs.touch('dir/file.txt')
+        self.ops('getattr', '/')
+        self.ops('getattr', 'dir')
+        self.ops('getattr', 'dir/file.txt')
+        self.ops('rename', 'dir', 'moved')
+        self.assertNotIn('/', self.ops.attr_cache)
+        self.assertNotIn('/dir', self.ops.attr_cache)
+        self.assertNotIn('/dir/file.txt', self.ops.attr_cache)
+        with self.assertRaises(OSError) as handler:
+            self.ops('getattr', 'dir/file.txt')
+        self.assertEqual(handler.exception.errno, errno.ENOENT)
+        self.ops('getattr', 'moved/file.txt')
+        self.ops('unlink', 'moved/file.txt')
+        with self.assertRaises(OSError) as handler:
+            self.ops('getattr', 'moved/file.txt')
+        self.assertEqual(handler.exception.errno, errno.ENOENT)
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(self.fs, negative_timeout=60)
+
+    def assertNotFound(self, path):
+        with self.assertRaises(OSError) as handler:
+            self.ops('getattr', path)
+        self.assertEqual(handler.exception.errno, errno.ENOENT)
+
+    def test_cached_lookup_failure(self):
+        self.assertNotFound('missing.py')
+        with mock.patch.object(self.fs, 'getinfo', wraps=self.fs.getinfo) as m:
+            self.assertNotFound('/missing.py')
+            self.assertFalse(m.called)
+        self.assertEqual(self.ops.negative_cache.hits, 1)
+
+    def test_disabled(self):
+        self.ops = PyfilesystemFuseOperations(self.fs, negative_timeout=0)
+        self.assertNotFound('missing.py')
+        self.fs.touch('missing.py')
+        self.assertTrue(self.ops('getattr', 'missing.py'))
+
+    def test_invalidate_create(self):
+        self.assertNotFound('file.txt')
+        self.ops('release', 'file.txt', self.ops('create', 'file.txt', 0))
+        self.assertTrue(self.ops('getattr', 'file.txt'))
+
+    def test_invalidate_mkdir(self):
+        self.assertNotFound('dir')
+        self.assertNotFound('dir/file.txt')
+        self.ops('mkdir', 'dir', 0o755)
+        self.assertTrue(self.ops('getattr', 'dir'))
+        self.fs.touch('dir/file.txt')
+        self.assertTrue(self.ops('getattr', 'dir/file.txt'))
+
+    def test_invalidate_rename(self):
+        self.fs.makedir('src')
+        self.fs.touch('src/file.txt')
+        self.assertNotFound('dst')
+        self.assertNotFound('dst/file.txt')
+        self.ops('rename', 'src', 'dst')
+        self.assertTrue(self.ops('getattr', 'dst'))
+        self.assertTrue(self.ops('getattr', 'dst/file.txt'))
+
+
+class TestStreamingReaddir(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(self.fs, readdir_page_size=2)
+        for i in range(5):
+            self.fs.touch('file{}.txt'.format(i))
+
+    def _list(self, fh, capacity):
+        # Emulate fusepy filling a kernel buffer of a limited capacity
+        names = []
+        for name, _, offset in self.ops('readdir', '/', fh):
+            if len(names) == capacity:
+                break
+            names.append(name)
+            self.assertEqual(offset, len(names) + self.offset)
+        self.offset += len(names)
+        return names
+
+    def test_streaming(self):
+        self.offset = 0
+        fh = self.ops('opendir', '/')
+        self.assertIn(fh, self.ops.directories)
+        names = self._list(fh, 3) + self._list(fh, 3) + self._list(fh, 3)
+        self.assertEqual(self._list(fh, 3), [])
+        self.assertEqual(names[:2], ['.', '..'])
+        self.assertEqual(
+            sorted(names[2:]), ['file{}.txt'.format(i) for i in range(5)])
+        self.ops('releasedir', '/', fh)
+        self.assertNotIn(fh, self.ops.directories)
+
+    def test_rewind(self):
+        self.offset = 0
+        fh = self.ops('opendir', '/')
+        names = self._list(fh, 3) + self._list(fh, 3)
+        listing = [name for name, _, _ in self.ops('readdir', '/', fh, 0)]
+        self.assertEqual(listing[:2], ['.', '..'])
+        self.assertEqual(
+            sorted(listing[2:]), ['file{}.txt'.format(i) for i in range(5)])
+        self.assertEqual(listing[:len(names)], names)
+
+    def test_seek(self):
+        fh = self.ops('opendir', '/')
+        listing = [entry[:3:2] for entry in self.ops('readdir', '/', fh, 0)]
+        self.assertEqual(len(listing), 7)
+        for offset in (4, 1, 6, 7):
+            entries = self.ops('readdir', '/', fh, offset)
+            self.assertEqual([e[:3:2] for e in entries], listing[offset:])
+        # continuing from the offset of the last call does not rescan
+        entries = iter(self.ops('readdir', '/', fh, 2))
+        self.assertEqual(next(entries)[2], 3)
+        with mock.patch.object(self.ops, '_scandir') as m:
+            self.assertEqual(
+                [e[:3:2] for e in self.ops('readdir', '/', fh, 2)], listing[2:])
+            self.assertFalse(m.called)
+
+    def test_errors(self):
+        with self.assertRaises(OSError) as handler:
+            self.ops('opendir', 'file0.txt')
+        self.assertEqual(handler.exception.errno, errno.ENOTDIR)
+        with self.assertRaises(OSError) as handler:
+            self.ops('opendir', 'missing')
+        self.assertEqual(handler.exception.errno, errno.ENOENT)
+
+    def test_disabled(self):
+        self.ops = PyfilesystemFuseOperations(self.fs)
+        self.assertEqual(self.ops('opendir', '/'), 0)
+        self.assertIsInstance(self.ops('readdir', '/', 0), list)
+
+    def test_primes_attribute_cache(self):
+        fh = self.ops('opendir', '/')
+        listing = {name: st for name, st, _ in self.ops('readdir', '/', fh)}
+        with mock.patch.object(self.fs, 'getinfo') as m:
+            for i in range(5):
+                name = 'file{}.txt'.format(i)
+                self.assertEqual(self.ops('getattr', '/' + name), listing[name])
+            self.assertFalse(m.called)
+
+
+class TestHandleTable(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.table = HandleTable()
+
+    def test_allocation(self):
+        fds = [self.table.add(mock.Mock()) for _ in range(3)]
+        self.assertEqual(fds, [0, 1, 2])
+        self.table.pop(1)
+        self.assertNotIn(1, self.table)
+        self.assertEqual(self.table.add(mock.Mock()), 1)
+        self.assertEqual(self.table.add(mock.Mock()), 3)
+        self.assertEqual(len(self.table), 4)
+        with self.assertRaises(KeyError):
+            self.table.pop(10)
+        self.table.clear()
+        self.assertEqual(self.table.add(mock.Mock()), 0)
+
+    def test_concurrent_pread(self):
+        data = bytes(bytearray(range(256))) * 64
+        self.fs.setbytes('file.bin', data)
+        fd = self.table.add(self.fs.openbin('file.bin'))
+        errors = []
+
+        def reader(offset):
+            for _ in range(200):
+                if self.table.pread(fd, 16, offset) != data[offset:offset+16]:
+                    errors.append(offset)
+
+        threads = [
+            threading.Thread(target=reader, args=(i * 512,)) for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_pwrite(self):
+        fd = self.table.add(self.fs.openbin('file.bin', 'w'))
+        self.table.pwrite(fd, b'World!', 7)
+        self.table.pwrite(fd, b'Hello, ', 0)
+        self.table.pop(fd).close()
+        self.assertEqual(self.fs.getbytes('file.bin'), b'Hello, World!')
+
+
+class TestBlockCache(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(
+            self.fs, block_size=4, block_cache_size=16, readahead_size=0)
+        self.fs.setbytes('file.bin', b'Hello, World!')
+
+    def test_read(self):
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.assertEqual(self.ops.read('file.bin', 100, 0, fd), b'Hello, World!')
+        self.assertEqual(self.ops.read('file.bin', 6, 3, fd), b'lo, Wo')
+        self.assertEqual(self.ops.read('file.bin', 4, 12, fd), b'!')
+        self.assertEqual(self.ops.read('file.bin', 4, 20, fd), b'')
+        self.assertEqual(self.ops.read('file.bin', 0, 0, fd), b'')
+        self.assertGreater(self.ops.block_cache.hit_rate, 0)
+
+    def test_shared_between_handles(self):
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.ops.read('file.bin', 8, 0, fd)
+        self.ops.release('file.bin', fd)
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        misses = self.ops.block_cache.misses
+        self.assertEqual(self.ops.read('file.bin', 8, 0, fd), b'Hello, W')
+        self.assertEqual(self.ops.block_cache.misses, misses)
+
+    def test_memory_budget(self):
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.ops.read('file.bin', 100, 0, fd)
+        self.assertLessEqual(self.ops.block_cache.size, 16)
+        self.assertEqual(len(self.ops.block_cache), 4)
+
+    def test_invalidate_write(self):
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.ops.read('file.bin', 100, 0, fd)
+        wfd = self.ops.open('file.bin', posix.O_WRONLY | posix.O_APPEND)
+        self.ops.write('file.bin', b'Bye', 0, wfd)
+        self.assertEqual(len(self.ops.block_cache), 0)
+        self.ops.read('file.bin', 4, 0, fd)
+        self.ops.release('file.bin', wfd)
+        self.assertEqual(len(self.ops.block_cache), 0)
+
+    def test_invalidate_truncate(self):
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.ops.read('file.bin', 100, 0, fd)
+        self.ops.truncate('file.bin', 5)
+        self.assertEqual(len(self.ops.block_cache), 0)
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.assertEqual(self.ops.read('file.bin', 100, 0, fd), b'Hello')
+
+    def test_disabled(self):
+        self.ops = PyfilesystemFuseOperations(self.fs, block_cache_size=0)
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.assertEqual(self.ops.read('file.bin', 100, 0, fd), b'Hello, World!')
+        self.assertEqual(len(self.ops.block_cache), 0)
+
+
+class TestReadahead(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(
+            self.fs, block_size=4, readahead_size=32)
+        self.data = bytes(bytearray(range(256)))
+        self.fs.setbytes('file.bin', self.data)
+
+    def tearDown(self):
+        self.ops.prefetcher.shutdown()
+
+    def test_window(self):
+        window = ReadaheadWindow(4, 16)
+        self.assertEqual(window.advance(0, 4), (4, 4))
+        self.assertEqual(window.advance(4, 4), (8, 8))
+        self.assertIsNone(window.advance(8, 4))
+        self.assertEqual(window.advance(12, 4), (16, 16))
+        self.assertIsNone(window.advance(16, 4))
+        self.assertIsNone(window.advance(20, 4))
+        self.assertEqual(window.advance(24, 4), (32, 12))
+        self.assertEqual(window.size, 16)
+        # random access closes the window
+        self.assertIsNone(window.advance(100, 4))
+        self.assertEqual(window.size, 0)
+        self.assertEqual(window.advance(104, 4), (108, 4))
+
+    def test_sequential(self):
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        data = b''
+        for offset in range(0, 64, 4):
+            data += self.ops.read('file.bin', 4, offset, fd)
+            self.ops.prefetcher.join()
+        self.assertEqual(data, self.data[:64])
+        self.assertEqual(self.ops.block_cache.misses, 1)
+        self.assertEqual(self.ops.block_cache.hits, 15)
+
+    def test_random(self):
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        with mock.patch.object(self.ops.prefetcher, 'submit') as m:
+            self.ops.read('file.bin', 4, 100, fd)
+            self.ops.read('file.bin', 4, 40, fd)
+            self.ops.read('file.bin', 4, 12, fd)
+            self.assertFalse(m.called)
+
+    def test_end_of_file(self):
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        with mock.patch.object(self.ops.prefetcher, 'submit') as m:
+            self.ops.read('file.bin', 4, 0, fd)
+            self.assertTrue(m.called)
+            m.reset_mock()
+            self.ops.read('file.bin', 4, 252, fd)
+            self.ops.read('file.bin', 4, 256, fd)
+            self.assertFalse(m.called)
+
+    def test_disabled(self):
+        self.ops = PyfilesystemFuseOperations(self.fs, readahead_size=0)
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.assertIsNone(self.ops.descriptors.window(fd))
+
+    def test_pool(self):
+        pool = PrefetchPool(workers=1, maxqueue=1)
+        event = threading.Event()
+        self.assertTrue(pool.submit(event.wait))
+        while pool._jobs.qsize():
+            time.sleep(0.001)
+        self.assertTrue(pool.submit(mock.Mock(side_effect=ValueError)))
+        self.assertFalse(pool.submit(mock.Mock()))
+        event.set()
+        pool.join()
+        pool.shutdown()
+
+
+class TestWriteback(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(
+            self.fs, writeback=True, writeback_workers=0)
+
+    def tearDown(self):
+        self.ops.uploader.shutdown()
+
+    def test_spooled_writes(self):
+        fd = self.ops.create('file.txt', posix.O_WRONLY)
+        self.assertIsInstance(self.ops.descriptors[fd], Spool)
+        with mock.patch.object(self.fs, 'openbin') as m:
+            self.ops.write('file.txt', b'Hello, ', 0, fd)
+            self.ops.write('file.txt', b'World!', 7, fd)
+            self.assertFalse(m.called)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'')
+        self.assertEqual(self.ops.getattr('file.txt')['st_size'], 13)
+        self.ops.release('file.txt', fd)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Hello, World!')
+        self.assertEqual(self.ops.getattr('file.txt')['st_size'], 13)
+
+    def test_flush(self):
+        self.fs.setbytes('file.txt', b'Hello, World!')
+        fd = self.ops.open('file.txt', posix.O_RDWR)
+        self.ops.write('file.txt', b'J', 0, fd)
+        self.assertEqual(self.ops.read('file.txt', 5, 0, fd), b'Jello')
+        self.ops.flush('file.txt', fd)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Jello, World!')
+        with mock.patch.object(self.fs, 'setbinfile') as m:
+            self.ops.flush('file.txt', fd)
+            self.assertFalse(m.called)
+        self.ops.release('file.txt', fd)
+
+    def test_append_and_truncate(self):
+        self.fs.setbytes('file.txt', b'Hello')
+        fd = self.ops.open('file.txt', posix.O_WRONLY | posix.O_APPEND)
+        self.ops.write('file.txt', b', World!', 0, fd)
+        self.ops.truncate('file.txt', 7, fd)
+        self.ops.release('file.txt', fd)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Hello, ')
+        self.ops.truncate('file.txt', 2)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'He')
+
+    def test_fsync_error(self):
+        fd = self.ops.create('file.txt', posix.O_WRONLY)
+        self.ops.write('file.txt', b'Hello', 0, fd)
+        with mock.patch.object(self.fs, 'setbinfile', side_effect=fs.errors.InsufficientStorage):
+            with self.assertRaises(OSError) as ctx:
+                self.ops.fsync('file.txt', 0, fd)
+            self.assertEqual(ctx.exception.errno, errno.ENOSPC)
+        self.ops.fsync('file.txt', 0, fd)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Hello')
+
+    def test_background_upload(self):
+        self.ops = PyfilesystemFuseOperations(
+            self.fs, writeback=True, writeback_max_dirty=4)
+        fd = self.ops.create('file.txt', posix.O_WRONLY)
+        for offset in range(0, 64, 8):
+            self.ops.write('file.txt', b'ABCDEFGH', offset, fd)
+            self.assertLessEqual(self.ops.uploader.dirty, 8)
+        self.ops.fsync('file.txt', 0, fd)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'ABCDEFGH' * 8)
+        self.ops.write('file.txt', b'!', 64, fd)
+        self.ops.destroy('/')
+        self.assertEqual(self.ops.uploader.dirty, 0)
+
+    def test_concurrent_flush(self):
+        self.ops = PyfilesystemFuseOperations(
+            self.fs, writeback=True, writeback_workers=2, lock_stripes=0)
+        fd = self.ops.create('file.bin', posix.O_WRONLY)
+        done = threading.Event()
+
+        def flush():
+            while not done.is_set():
+                self.ops.flush('file.bin', fd)
+
+        thread = threading.Thread(target=flush)
+        thread.start()
+        try:
+            for i in reversed(range(2000)):
+                self.ops.write('file.bin', ('%05d' % i).encode('ascii'), i * 5, fd)
+        finally:
+            done.set()
+            thread.join()
+        self.ops.fsync('file.bin', 0, fd)
+        expected = b''.join(('%05d' % i).encode('ascii') for i in range(2000))
+        self.assertEqual(self.fs.getbytes('file.bin'), expected)
+        self.ops.release('file.bin', fd)
+
+    def test_release_error(self):
+        fd = self.ops.create('file.txt', posix.O_WRONLY)
+        self.ops.write('file.txt', b'Hello', 0, fd)
+        with mock.patch.object(self.fs, 'setbinfile', side_effect=fs.errors.InsufficientStorage):
+            with mock.patch('fs.expose.fuse.writeback.log') as log:
+                self.ops.release('file.txt', fd)
+            self.assertTrue(log.error.called)
+        self.assertEqual(self.ops.uploader.dirty, 0)
+        with self.assertRaises(OSError) as ctx:
+            self.ops.open('file.txt', posix.O_RDONLY)
+        self.assertEqual(ctx.exception.errno, errno.ENOSPC)
+        self.ops.release('file.txt', self.ops.open('file.txt', posix.O_RDONLY))
+
+    def _slow_uploads(self):
+        setbinfile = self.fs.setbinfile
+        def slow_setbinfile(*args, **kwargs):
+            time.sleep(0.2)
+            return setbinfile(*args, **kwargs)
+        self.ops = PyfilesystemFuseOperations(
+            self.fs, writeback=True, writeback_workers=1)
+        return mock.patch.object(self.fs, 'setbinfile', side_effect=slow_setbinfile)
+
+    def test_read_after_close(self):
+        with self._slow_uploads():
+            fd = self.ops.create('file.txt', posix.O_WRONLY)
+            self.ops.write('file.txt', b'hello', 0, fd)
+            self.ops.release('file.txt', fd)
+            fd = self.ops.open('file.txt', posix.O_RDONLY)
+            self.assertEqual(self.ops.read('file.txt', 5, 0, fd), b'hello')
+            self.ops.release('file.txt', fd)
+        self.ops.uploader.shutdown()
+
+    def test_append_after_close(self):
+        with self._slow_uploads():
+            fd = self.ops.create('file.txt', posix.O_WRONLY)
+            self.ops.write('file.txt', b'hello', 0, fd)
+            self.ops.release('file.txt', fd)
+            fd = self.ops.open('file.txt', posix.O_WRONLY | posix.O_APPEND)
+            self.ops.write('file.txt', b' world', 0, fd)
+            self.ops.release('file.txt', fd)
+            self.ops.uploader.shutdown()
+        self.assertEqual(self.fs.getbytes('file.txt'), b'hello world')
+
+    def test_flush_error(self):
+        fd = self.ops.create('file.txt', posix.O_WRONLY)
+        self.ops.write('file.txt', b'Hello', 0, fd)
+        with mock.patch.object(self.fs, 'setbinfile', side_effect=fs.errors.InsufficientStorage):
+            self.ops.flush('file.txt', fd)
+        with self.assertRaises(OSError) as ctx:
+            self.ops.flush('file.txt', fd)
+        self.assertEqual(ctx.exception.errno, errno.ENOSPC)
+        self.ops.flush('file.txt', fd)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Hello')
+        self.ops.release('file.txt', fd)
+
+    def test_errors(self):
+        self.fs.makedir('dir')
+        with self.assertRaises(OSError) as ctx:
+            self.ops.open('dir', posix.O_WRONLY)
+        self.assertEqual(ctx.exception.errno, errno.EISDIR)
+        with self.assertRaises(OSError) as ctx:
+            self.ops.open('missing.txt', posix.O_RDWR)
+        self.assertEqual(ctx.exception.errno, errno.ENOENT)
+
+
+class TestMounter(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.mountpoint = tempfile.mkdtemp()
+
+    def tearDown(self):
+        os.rmdir(self.mountpoint)
+
+    def test_options(self):
+        mounter = PyfilesystemFuseMounter(
+            self.fs, self.mountpoint, kernel_cache=True, attr_timeout=30,
+            max_read=131072, big_writes=True, readdir_page_size=128)
+        self.assertEqual(mounter.fuse_options, {
+            'kernel_cache': True,
+            'attr_timeout': 30,
+            'entry_timeout': 1.0,
+            'negative_timeout': 1.0,
+            'max_read': 131072,
+            'big_writes': True,
+        })
+        self.assertEqual(mounter.operations_options, {
+            'attr_timeout': 30,
+            'negative_timeout': 1.0,
+            'readdir_page_size': 128,
+            'raw_fi': True,
+        })
+
+    def test_run(self):
+        mounter = PyfilesystemFuseMounter(
+            self.fs, self.mountpoint, threads=False, auto_cache=True,
+            max_readahead=65536)
+        with mock.patch('fs.expose.fuse.mounter._FUSE') as m:
+            mounter.run()
+        args, kwargs = m.call_args
+        self.assertIsInstance(args[0], PyfilesystemFuseOperations)
+        self.assertIs(args[0].fs, self.fs)
+        self.assertEqual(args[1], self.mountpoint)
+        self.assertTrue(kwargs['raw_fi'])
+        self.assertTrue(kwargs['foreground'])
+        self.assertTrue(kwargs['nothreads'])
+        self.assertTrue(kwargs['auto_cache'])
+        self.assertEqual(kwargs['max_readahead'], 65536)
+        self.assertNotIn('kernel_cache', kwargs)
+
+    def test_readdir_offset(self):
+        from fs.expose.fuse.mounter import _FUSE
+        fuse_ = _FUSE.__new__(_FUSE)
+        fuse_.encoding, fuse_.use_ns = 'utf-8', False
+        fuse_.operations = mock.Mock(return_value=['.', ('file.txt', None, 3)])
+        filler = mock.Mock(return_value=0)
+        fip = mock.Mock()
+        fip.contents.fh = 7
+        self.assertEqual(fuse_.readdir(b'/dir', 'buf', filler, 2, fip), 0)
+        fuse_.operations.assert_called_once_with('readdir', '/dir', 7, 2)
+        filler.assert_has_calls([
+            mock.call('buf', b'.', None, 0), mock.call('buf', b'file.txt', None, 3)])
+
+    def test_mount_foreground(self):
+        with mock.patch.object(PyfilesystemFuseMounter, 'run') as m:
+            mounter = mount(self.fs, self.mountpoint, foreground=True)
+        self.assertTrue(m.called)
+        self.assertIsNone(mounter.process)
+
+    def test_mount_failure(self):
+        with mock.patch.object(PyfilesystemFuseMounter, 'run'):
+            with self.assertRaises(OSError):
+                mount(self.fs, self.mountpoint)
+
+
+class TestKeepCache(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(
+            self.fs, raw_fi=True, direct_io=['*.log', '/live/*'])
+        self.fs.setbytes('file.bin', b'Hello, World!')
+
+    def _open(self, path, flags=posix.O_RDONLY):
+        fi = fuse.fuse_file_info(flags=flags)
+        self.assertEqual(self.ops('open', path, fi), 0)
+        self.assertIn(fi.fh, self.ops.descriptors)
+        return fi
+
+    def test_keep_cache(self):
+        fi = self._open('file.bin')
+        self.assertFalse(fi.keep_cache)
+        self.assertEqual(self.ops('read', 'file.bin', 5, 0, fi), b'Hello')
+        self.ops('release', 'file.bin', fi)
+        self.assertNotIn(fi.fh, self.ops.descriptors)
+        self.assertTrue(self._open('file.bin').keep_cache)
+
+    def test_changed(self):
+        self._open('file.bin')
+        self.fs.setbytes('file.bin', b'Hello!')
+        self.ops.attr_cache.clear()
+        self.assertFalse(self._open('file.bin').keep_cache)
+        fi = self._open('file.bin', posix.O_WRONLY)
+        self.ops('write', 'file.bin', b'J', 0, fi)
+        self.assertFalse(self._open('file.bin').keep_cache)
+
+    def test_create(self):
+        fi = fuse.fuse_file_info()
+        self.assertEqual(self.ops('create', 'new.txt', 0, fi), 0)
+        self.assertTrue(self.fs.exists('new.txt'))
+        self.assertIn(fi.fh, self.ops.descriptors)
+        self.assertEqual(self.ops('getattr', 'new.txt', fi)['st_size'], 0)
+
+    def test_direct_io(self):
+        self.fs.makedir('live')
+        for path in ('server.log', 'live/data.bin'):
+            self.fs.touch(path)
+            self._open(path)
+            fi = self._open(path)
+            self.assertTrue(fi.direct_io)
+            self.assertFalse(fi.keep_cache)
+        self.assertFalse(self._open('file.bin').direct_io)
+
+
+class TestNativeRename(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('temp://')
+        self.ops = PyfilesystemFuseOperations(self.fs)
+
+    def tearDown(self):
+        self.fs.close()
+
+    def test_rename_directory(self):
+        self.fs.makedirs('a/b')
+        self.fs.settext('a/b/file.txt', 'Hello')
+        self.fs.makedir('empty')
+        with mock.patch.object(self.fs, 'movedir') as m:
+            self.ops('rename', 'a', 'c')
+            self.ops('rename', 'c', 'empty')
+            self.assertFalse(m.called)
+        self.assertEqual(self.fs.gettext('empty/b/file.txt'), 'Hello')
+        self.assertFalse(self.fs.exists('a'))
+        self.assertFalse(self.fs.exists('c'))
+
+    def test_rename_file(self):
+        self.fs.settext('a.txt', 'A')
+        self.fs.settext('b.txt', 'B')
+        with mock.patch('os.rename', wraps=os.rename) as m:
+            self.ops('rename', 'a.txt', 'b.txt')
+            self.assertEqual(m.call_count, 1)
+        self.assertEqual(self.fs.gettext('b.txt'), 'A')
+
+    def test_errors(self):
+        self.fs.makedirs('a/b')
+        self.fs.touch('file.txt')
+        for old, new, error in [
+            ('a', 'file.txt', errno.ENOTDIR),
+            ('file.txt', 'a', errno.EISDIR),
+            ('a', 'a/b', errno.EINVAL),
+            ('file.txt/x', 'x', errno.ENOTDIR),
+            ('missing', 'x', errno.ENOENT),
+        ]:
+            with self.assertRaises(OSError) as ctx:
+                self.ops('rename', old, new)
+            self.assertEqual(ctx.exception.errno, error)
+        self.fs.touch('a/b/file.txt')
+        self.fs.makedir('c')
+        with self.assertRaises(OSError) as ctx:
+            self.ops('rename', 'c', 'a')
+        self.assertEqual(ctx.exception.errno, errno.ENOTEMPTY)
+
+    def test_wrapped(self):
+        self.fs.touch('a.txt')
+        self.fs.touch('b.txt')
+        self.fs.makedir('d')
+        self.fs.makedir('e')
+        self.ops.fs = read_only(self.fs)
+        with mock.patch('os.rename') as m:
+            for old, new in [('a.txt', 'b.txt'), ('d', 'e')]:
+                with self.assertRaises(OSError) as ctx:
+                    self.ops('rename', old, new)
+                self.assertEqual(ctx.exception.errno, errno.EROFS)
+            self.assertFalse(m.called)
+        self.assertTrue(self.fs.exists('a.txt'))
+        self.assertTrue(self.fs.exists('d'))
+
+    def test_single_lookup(self):
+        self.fs.makedirs('x/y/z')
+        with mock.patch.object(self.fs, 'getinfo', wraps=self.fs.getinfo) as m:
+            self.ops('rename', 'x/y/z', 'x/y/w')
+            self.assertEqual(m.call_count, 2)
+
+
+class TestStatfs(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(self.fs, statfs_timeout=0)
+
+    def _used(self):
+        result = self.ops.statfs('/')
+        return result['f_blocks'] - result['f_bfree'], result['f_files'] - result['f_ffree']
+
+    def test_syspath(self):
+        with fs.open_fs('temp://') as temp_fs:
+            ops = PyfilesystemFuseOperations(temp_fs)
+            st = os.statvfs(temp_fs.getsyspath('/'))
+            result = ops.statfs('/')
+            self.assertEqual(result['f_bsize'], st.f_bsize)
+            self.assertEqual(result['f_blocks'], st.f_blocks)
+            self.assertEqual(result['f_namelen'], st.f_namemax)
+            self.assertIsNone(ops.usage)
+
+    def test_usage_counter(self):
+        self.fs.makedir('dir')
+        self.fs.setbytes('dir/file.bin', b'x' * 5000)
+        with mock.patch('fs.expose.fuse.operations.available_memory', return_value=4096 * 10):
+            result = self.ops.statfs('/')
+            self.assertEqual(result['f_bsize'], 4096)
+            self.assertEqual(result['f_bfree'], 10)
+            self.assertEqual(self._used(), (2, 3))
+            fd = self.ops.create('new.bin', posix.O_WRONLY)
+            self.ops.write('new.bin', b'x' * 10000, 0, fd)
+            self.ops.release('new.bin', fd)
+            self.assertEqual(self._used(), (4, 4))
+            self.ops.truncate('dir/file.bin', 0)
+            self.assertEqual(self._used(), (3, 4))
+            self.ops.rename('new.bin', 'dir/moved.bin')
+            self.ops.mkdir('empty', 0)
+            self.assertEqual(self._used(), (3, 5))
+            self.ops.unlink('dir/moved.bin')
+            self.ops.rmdir('empty')
+            self.assertEqual(self._used(), (0, 3))
+        with mock.patch.object(UsageCounter, 'from_fs') as m:
+            self.ops.statfs('/')
+            self.assertFalse(m.called)
+
+    def test_cached(self):
+        self.ops = PyfilesystemFuseOperations(self.fs, statfs_timeout=60)
+        with mock.patch.object(UsageCounter, 'from_fs', wraps=UsageCounter.from_fs) as m:
+            self.assertEqual(self.ops.statfs('/'), self.ops.statfs('/'))
+            self.assertEqual(m.call_count, 1)
+        with mock.patch.object(self.ops, '_statfs') as m:
+            self.ops.statfs('/')
+            self.assertFalse(m.called)
+
+
+class TestDigestXattrs(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(self.fs)
+        self.fs.setbytes('file.bin', b'Hello, World!')
+
+    def test_getxattr(self):
+        self.assertEqual(
+            self.ops('getxattr', 'file.bin', 'user.md5'),
+            hashlib.md5(b'Hello, World!').hexdigest().encode('ascii'))
+        with mock.patch.object(self.fs, 'openbin') as m:
+            self.assertEqual(
+                self.ops('getxattr', 'file.bin', 'user.sha256'),
+                hashlib.sha256(b'Hello, World!').hexdigest().encode('ascii'))
+            self.assertFalse(m.called)
+        for path, name in [('file.bin', 'user.crc'), ('file.bin', 'md5'), ('/', 'user.md5')]:
+            with self.assertRaises(OSError) as ctx:
+                self.ops('getxattr', path, name)
+            self.assertEqual(ctx.exception.errno, errno.ENODATA)
+        with self.assertRaises(OSError) as ctx:
+            self.ops('getxattr', 'missing.bin', 'user.md5')
+        self.assertEqual(ctx.exception.errno, errno.ENOENT)
+
+    def test_subsecond_change(self):
+        self.fs.setinfo('file.bin', {'details': {'modified': 1000.25}})
+        self.ops('getxattr', 'file.bin', 'user.md5')
+        self.fs.setbytes('file.bin', b'Hello, Earth!')
+        self.fs.setinfo('file.bin', {'details': {'modified': 1000.75}})
+        self.assertEqual(
+            self.ops('getxattr', 'file.bin', 'user.md5'),
+            hashlib.md5(b'Hello, Earth!').hexdigest().encode('ascii'))
+
+    def test_listxattr(self):
+        self.assertEqual(self.ops('listxattr', 'file.bin'), [])
+        ops = PyfilesystemFuseOperations(
+            self.fs, list_xattr_digests=True, stats_path='/.fs-expose/stats')
+        self.assertEqual(
+            ops('listxattr', 'file.bin'), ['user.md5', 'user.sha1', 'user.sha256'])
+        self.assertEqual(ops('listxattr', '/'), [])
+        self.assertEqual(ops('listxattr', ops.stats_path), [])
+        with self.assertRaises(OSError) as ctx:
+            ops('listxattr', 'missing.bin')
+        self.assertEqual(ctx.exception.errno, errno.ENOENT)
+
+    def test_stats_file(self):
+        ops = PyfilesystemFuseOperations(self.fs, stats_path='/.fs-expose/stats')
+        with self.assertRaises(OSError) as ctx:
+            ops('getxattr', ops.stats_path, 'user.md5')
+        self.assertEqual(ctx.exception.errno, errno.ENODATA)
+
+    def test_invalidate(self):
+        self.ops('getxattr', 'file.bin', 'user.md5')
+        fd = self.ops.open('file.bin', posix.O_WRONLY)
+        self.ops.write('file.bin', b'Bye', 0, fd)
+        self.ops.release('file.bin', fd)
+        self.assertEqual(len(self.ops.checksums), 0)
+        self.assertEqual(
+            self.ops('getxattr', 'file.bin', 'user.md5'),
+            hashlib.md5(b'Bye').hexdigest().encode('ascii'))
+        self.ops('rename', 'file.bin', 'moved.bin')
+        self.assertEqual(len(self.ops.checksums), 0)
+
+    def test_persistent(self):
+        tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(tmpdir, 'checksums.db')
+        try:
+            ops = PyfilesystemFuseOperations(self.fs, checksum_cache=filename)
+            ops('getxattr', 'file.bin', 'user.md5')
+            ops.checksums.close()
+            ops = PyfilesystemFuseOperations(self.fs, checksum_cache=filename)
+            with mock.patch.object(self.fs, 'openbin') as m:
+                ops('getxattr', 'file.bin', 'user.sha1')
+                self.assertFalse(m.called)
+            # a file changed behind the mount is hashed again
+            self.fs.setbytes('file.bin', b'Hello!')
+            ops.attr_cache.clear()
+            self.assertEqual(
+                ops('getxattr', 'file.bin', 'user.md5'),
+                hashlib.md5(b'Hello!').hexdigest().encode('ascii'))
+            ops.checksums.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestPassthrough(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('temp://')
+        self.ops = PyfilesystemFuseOperations(self.fs)
+        self.fs.setbytes('file.bin', b'Hello, World!')
+
+    def tearDown(self):
+        self.fs.close()
+
+    def test_io(self):
+        fd = self.ops.open('file.bin', posix.O_RDWR)
+        self.assertIsInstance(self.ops.descriptors[fd], RawFile)
+        with mock.patch.object(self.fs, 'openbin') as m:
+            self.assertEqual(self.ops.read('file.bin', 5, 7, fd), b'World')
+            self.assertEqual(self.ops.write('file.bin', b'J', 0, fd), 1)
+            self.ops.truncate('file.bin', 5, fd)
+            self.ops.fsync('file.bin', 0, fd)
+            self.ops.release('file.bin', fd)
+            self.assertFalse(m.called)
+        self.assertEqual(self.fs.getbytes('file.bin'), b'Jello')
+        fd = self.ops.open('file.bin', posix.O_WRONLY | posix.O_APPEND)
+        self.ops.write('file.bin', b'!', 0, fd)
+        self.ops.release('file.bin', fd)
+        self.assertEqual(self.fs.getbytes('file.bin'), b'Jello!')
+
+    def test_errors(self):
+        self.fs.makedir('dir')
+        for path, flags, error in [
+            ('dir', posix.O_RDONLY, errno.EISDIR),
+            ('missing.bin', posix.O_RDONLY, errno.ENOENT),
+        ]:
+            with self.assertRaises(OSError) as ctx:
+                self.ops('open', path, flags)
+            self.assertEqual(ctx.exception.errno, error)
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        with self.assertRaises(OSError) as ctx:
+            self.ops('write', 'file.bin', b'', 0, fd)
+        self.assertEqual(ctx.exception.errno, errno.EINVAL)
+
+    def test_metadata(self):
+        self.fs.makedir('dir')
+        with mock.patch.object(self.fs, 'getinfo') as m:
+            result = self.ops('getattr', 'file.bin')
+            self.assertEqual(result['st_size'], 13)
+            self.assertTrue(stat.S_ISDIR(self.ops('getattr', 'dir')['st_mode']))
+            listing = self.ops('readdir', '/', None)
+            self.assertFalse(m.called)
+        self.assertEqual(sorted(x[0] for x in listing[2:]), ['dir', 'file.bin'])
+        with self.assertRaises(OSError) as ctx:
+            self.ops('getattr', 'missing.bin')
+        self.assertEqual(ctx.exception.errno, errno.ENOENT)
+        self.assertIn('/missing.bin', self.ops.negative_cache)
+
+    def test_wrapped(self):
+        self.ops.fs = read_only(self.fs)
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.assertNotIsInstance(self.ops.descriptors[fd], RawFile)
+        with self.assertRaises(OSError) as ctx:
+            self.ops('open', 'file.bin', posix.O_RDWR)
+        self.assertEqual(ctx.exception.errno, errno.EROFS)
+
+    def test_disabled(self):
+        self.ops = PyfilesystemFuseOperations(self.fs, passthrough=False)
+        fd = self.ops.open('file.bin', posix.O_RDONLY)
+        self.assertNotIsInstance(self.ops.descriptors[fd], RawFile)
+
+
+class TestReadOnlyIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.fs.makedirs('a/b')
+        self.fs.settext('a/file.txt', 'Hello')
+        self.fs.settext('a/b/other.txt', 'World!')
+        self.fs.touch('root.txt')
+
+    def _listdir(self, ops, path):
+        return sorted(x[0] for x in ops('readdir', path, None)[2:])
+
+    def _check(self, ops):
+        self.assertEqual(ops('getattr', 'a/file.txt')['st_size'], 5)
+        self.assertEqual(ops('getattr', '/a/b/other.txt')['st_size'], 6)
+        self.assertTrue(stat.S_ISDIR(ops('getattr', 'a/b')['st_mode']))
+        self.assertEqual(self._listdir(ops, '/'), ['a', 'root.txt'])
+        self.assertEqual(self._listdir(ops, 'a'), ['b', 'file.txt'])
+        for path, error in [('missing', errno.ENOENT), ('a/missing/x', errno.ENOENT),
+                            ('root.txt/x', errno.ENOENT)]:
+            with self.assertRaises(OSError) as ctx:
+                ops('getattr', path)
+            self.assertEqual(ctx.exception.errno, error)
+        with self.assertRaises(OSError) as ctx:
+            ops('readdir', 'root.txt', None)
+        self.assertEqual(ctx.exception.errno, errno.ENOTDIR)
+
+    def test_eager(self):
+        ops = PyfilesystemFuseOperations(self.fs, read_only=True, index_workers=2)
+        self.assertEqual(len(ops.index), 6)
+        with mock.patch.object(self.fs, 'getinfo') as getinfo:
+            with mock.patch.object(self.fs, 'scandir') as scandir:
+                self._check(ops)
+                self.assertFalse(getinfo.called)
+                self.assertFalse(scandir.called)
+        fd = ops('open', 'a/file.txt', posix.O_RDONLY)
+        self.assertEqual(ops('read', 'a/file.txt', 10, 0, fd), b'Hello')
+
+    def test_lazy(self):
+        ops = PyfilesystemFuseOperations(self.fs, read_only=True, lazy_index=True)
+        self.assertEqual(len(ops.index), 1)
+        with mock.patch.object(self.fs, 'scandir', wraps=self.fs.scandir) as m:
+            self._check(ops)
+            self.assertEqual(m.call_count, 3)
+            self._check(ops)
+            self.assertEqual(m.call_count, 3)
+
+    def test_erofs(self):
+        ops = PyfilesystemFuseOperations(self.fs, read_only=True)
+        for op, args in [
+            ('mkdir', ('new', 0)),
+            ('create', ('new.txt', 0)),
+            ('unlink', ('root.txt',)),
+            ('rename', ('root.txt', 'moved.txt')),
+            ('truncate', ('root.txt', 0)),
+            ('open', ('root.txt', posix.O_RDWR)),
+            ('open', ('root.txt', posix.O_RDONLY | posix.O_TRUNC)),
+        ]:
+            with self.assertRaises(OSError) as ctx:
+                ops(op, *args)
+            self.assertEqual(ctx.exception.errno, errno.EROFS)
+        self.assertEqual(sorted(self.fs.listdir('/')), ['a', 'root.txt'])
+        ops.raw_fi = True
+        with self.assertRaises(OSError) as ctx:
+            ops('open', 'root.txt', fuse.fuse_file_info(flags=posix.O_WRONLY))
+        self.assertEqual(ctx.exception.errno, errno.EROFS)
+
+    def test_paged_readdir(self):
+        ops = PyfilesystemFuseOperations(self.fs, read_only=True, readdir_page_size=1)
+        dh = ops('opendir', 'a')
+        self.assertEqual(sorted(x[0] for x in ops('readdir', 'a', dh))[2:], ['b', 'file.txt'])
+        ops('releasedir', 'a', dh)
+
+
+class TestWarmupCrawler(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        for path in ('a/b/c', 'a/skip/d', 'e'):
+            self.fs.makedirs(path)
+            self.fs.touch(path + '/file.txt')
+
+    def _crawl(self, **options):
+        ops = PyfilesystemFuseOperations(self.fs, attr_timeout=60, warmup=True, **options)
+        ops.init('/')
+        ops.crawler.join()
+        return ops
+
+    def test_crawl(self):
+        ops = self._crawl(warmup_workers=3)
+        self.assertEqual(ops.crawler.directories, 7)
+        with mock.patch.object(self.fs, 'getinfo') as m:
+            ops('getattr', 'a/skip/d/file.txt')
+            ops('getattr', 'e/file.txt')
+            self.assertFalse(m.called)
+        ops.destroy('/')
+
+    def test_limits(self):
+        ops = self._crawl(warmup_max_depth=2, warmup_exclude_dirs=['sk*'])
+        self.assertIn('/a/b', ops.attr_cache)
+        self.assertIn('/a/skip', ops.attr_cache)
+        self.assertNotIn('/a/b/c', ops.attr_cache)
+        self.assertNotIn('/a/skip/d', ops.attr_cache)
+        ops = self._crawl(warmup_exclude_dirs=['sk*'])
+        self.assertIn('/a/b/c/file.txt', ops.attr_cache)
+        self.assertNotIn('/a/skip/d', ops.attr_cache)
+
+    def test_full_cache(self):
+        ops = self._crawl(attr_cache_size=3, warmup_workers=1)
+        self.assertEqual(ops.crawler.directories, 2)
+        self.assertEqual(len(ops.attr_cache), 3)
+
+    def test_timeout(self):
+        ops = PyfilesystemFuseOperations(self.fs, warmup=True)
+        ops.init('/')
+        ops.crawler.join()
+        self.assertEqual(ops.crawler.directories, 7)
+        self.assertIn('/a/skip/d/file.txt', ops.attr_cache)
+        later = monotonic() + 10
+        with mock.patch('fs.expose.fuse.cache.monotonic', return_value=later):
+            self.assertNotIn('/a/skip/d/file.txt', ops.attr_cache)
+        ops.crawler.stop()
+        ops = PyfilesystemFuseOperations(self.fs, warmup=True, warmup_timeout=60)
+        ops.init('/')
+        ops.crawler.join()
+        with mock.patch('fs.expose.fuse.cache.monotonic', return_value=later):
+            self.assertIn('/a/skip/d/file.txt', ops.attr_cache)
+        ops.destroy('/')
+
+    def test_concurrent_unlink(self):
+        ops = PyfilesystemFuseOperations(
+            self.fs, warmup=True, warmup_workers=1, warmup_max_depth=1)
+        scan = ops._scan
+        def racing_scan(path):
+            entries = list(scan(path))
+            ops('unlink', '/e/file.txt')
+            return iter(entries)
+        with mock.patch.object(ops, '_scan', side_effect=racing_scan):
+            ops.crawler.start('/e')
+            ops.crawler.join()
+        self.assertNotIn('/e/file.txt', ops.attr_cache)
+        with self.assertRaises(OSError) as ctx:
+            ops('getattr', '/e/file.txt')
+        self.assertEqual(ctx.exception.errno, errno.ENOENT)
+        ops.destroy('/')
+
+    def test_expired_entries(self):
+        ops = PyfilesystemFuseOperations(
+            self.fs, attr_cache_size=20, warmup=True, warmup_workers=1)
+        for i in range(20):
+            ops.attr_cache.set('/expired{}'.format(i), {}, ttl=-1)
+        ops.init('/')
+        ops.crawler.join()
+        self.assertEqual(ops.crawler.directories, 7)
+        self.assertIn('/a/skip/d/file.txt', ops.attr_cache)
+        ops.destroy('/')
+
+    def test_rate(self):
+        crawler = WarmupCrawler(mock.Mock(), max_rate=10)
+        with mock.patch('fs.expose.fuse.crawler.monotonic', return_value=100):
+            with mock.patch.object(crawler._stopped, 'wait') as m:
+                for _ in range(3):
+                    crawler._throttle()
+        delays = [c[0][0] for c in m.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertAlmostEqual(delays[0], 0.1)
+        self.assertAlmostEqual(delays[1], 0.2)
+
+    def test_disabled(self):
+        self.assertIsNone(PyfilesystemFuseOperations(self.fs).crawler)
+        self.assertIsNone(PyfilesystemFuseOperations(self.fs, warmup=True, attr_timeout=0).crawler)
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.fs.setbytes('file.txt', b'Hello, World!')
+        self.ops = PyfilesystemFuseOperations(self.fs, stats_path='/.fs-expose/stats')
+
+    def _read_stats(self):
+        size = self.ops('getattr', '/.fs-expose/stats')['st_size']
+        fd = self.ops('open', '/.fs-expose/stats', os.O_RDONLY)
+        try:
+            data = self.ops('read', '/.fs-expose/stats', size + 1, 0, fd)
+        finally:
+            self.ops('release', '/.fs-expose/stats', fd)
+        self.assertEqual(len(data), size)
+        return json.loads(data.decode('utf-8'))
+
+    def test_record(self):
+        fd = self.ops('open', '/file.txt', os.O_RDONLY)
+        self.ops('read', '/file.txt', 5, 0, fd)
+        self.ops('release', '/file.txt', fd)
+        with self.assertRaises(fuse.FuseOSError):
+            self.ops('getattr', '/missing')
+        stats = self._read_stats()
+        self.assertEqual(stats['read']['calls'], 1)
+        self.assertEqual(stats['read']['bytes'], 5)
+        self.assertEqual(stats['getattr']['errors'], {'ENOENT': 1})
+        self.assertGreater(stats['open']['latency']['p99'], 0)
+
+    def test_virtual_file(self):
+        self.assertTrue(stat.S_ISDIR(self.ops('getattr', '/.fs-expose')['st_mode']))
+        names = lambda path: [e[0] if isinstance(e, tuple) else e
+                              for e in self.ops('readdir', path, 0)]
+        self.assertEqual(names('/.fs-expose'), ['.', '..', 'stats'])
+        self.assertNotIn('.fs-expose', names('/'))
+        with self.assertRaises(fuse.FuseOSError) as ctx:
+            self.ops('open', '/.fs-expose/stats', os.O_WRONLY)
+        self.assertEqual(ctx.exception.errno, errno.EACCES)
+
+    def test_disabled(self):
+        ops = PyfilesystemFuseOperations(
+            self.fs, stats=False, stats_path='/.fs-expose/stats')
+        self.assertIsNone(ops.stats)
+        with self.assertRaises(fuse.FuseOSError):
+            ops('getattr', '/.fs-expose/stats')
+        ops = PyfilesystemFuseOperations(self.fs)
+        self.assertIsNone(ops.stats_path)
+        ops('getattr', '/file.txt')
+        self.assertIn('getattr', ops.stats)
+        with self.assertRaises(fuse.FuseOSError):
+            ops('getattr', '/.fs-expose/stats')
+
+    def test_not_shadowing(self):
+        self.fs.makedir('.fs-expose')
+        self.fs.setbytes('.fs-expose/stats', b'data')
+        ops = PyfilesystemFuseOperations(self.fs)
+        self.assertEqual(ops('getattr', '/.fs-expose/stats')['st_size'], 4)
+
+    def test_histogram(self):
+        histogram = LatencyHistogram()
+        for _ in range(99):
+            histogram.record(0.000010)
+        histogram.record(0.5)
+        self.assertEqual(histogram.percentile(50), 16e-6)
+        self.assertGreaterEqual(histogram.percentile(100), 0.5)
+        self.assertAlmostEqual(histogram.mean, (99 * 0.00001 + 0.5) / 100)
+
+
+class TestDispatch(unittest.TestCase):
+
+    def test_errno_of_subclass(self):
+        class CustomNotFound(fs.errors.ResourceNotFound):
+            pass
+        self.assertEqual(convert_fs_errors.errno_of(CustomNotFound), errno.ENOENT)
+        self.assertEqual(convert_fs_errors.errno_of(fs.errors.ResourceError), errno.EIO)
+
+        @convert_fs_errors
+        def fail():
+            raise CustomNotFound('/')
+        with self.assertRaises(fuse.FuseOSError) as ctx:
+            fail()
+        self.assertEqual(ctx.exception.errno, errno.ENOENT)
+        with self.assertRaises(ValueError):
+            with convert_fs_errors:
+                raise ValueError()
+
+    def test_profiler(self):
+        # the sampling thread is only started by `init`
+        ops = PyfilesystemFuseOperations(fs.open_fs('mem://'), profile_interval=60)
+        profiler = ops.profiler
+        ready, done = threading.Event(), threading.Event()
+
+        def slow(path, fh=None):
+            ready.set()
+            done.wait()
+            return {}
+        ops._operations['getattr'] = slow
+        thread = threading.Thread(target=ops, args=('getattr', '/'))
+        thread.start()
+        ready.wait()
+        profiler.sample()
+        done.set()
+        thread.join()
+        profile = ops.stats.snapshot()['getattr']['profile']
+        self.assertEqual(profile['samples'], 1)
+        self.assertEqual(profile['seconds'], 60)
+        self.assertFalse(profiler._active)
+
+
+class TestBenchmarkCompare(unittest.TestCase):
+
+    def test_compare(self):
+        from .benchmark_fuse import compare
+        baseline = {'results': {'mem://': {
+            'seq_read/4096': [100.0, 'MB/s'], 'stat/1threads': [1000.0, 'ops/s'],
+        }}}
+        results = {'results': {'mem://': {
+            'seq_read/4096': [95.0, 'MB/s'], 'stat/1threads': [500.0, 'ops/s'],
+            'readdir/1000': [10.0, 'listings/s'],
+        }}}
+        self.assertEqual(compare(results, baseline, 0.1), [('mem://', 'stat/1threads', 0.5)])
+        self.assertEqual(compare(results, baseline, 0.6), [])
+
+
+class TestTrace(unittest.TestCase):
+
+    def _workload(self, ops):
+        ops('mkdir', '/dir', 0o755)
+        fh = ops('create', '/dir/file.txt', 0o644)
+        ops('write', '/dir/file.txt', b'Hello, World!', 0, fh)
+        ops('release', '/dir/file.txt', fh)
+        fh = ops('open', '/dir/file.txt', os.O_RDONLY)
+        ops('read', '/dir/file.txt', 5, 0, fh)
+        ops('release', '/dir/file.txt', fh)
+        dh = ops('opendir', '/dir')
+        ops('readdir', '/dir', dh)
+        ops('releasedir', '/dir', dh)
+        with self.assertRaises(fuse.FuseOSError):
+            ops('getattr', '/missing')
+
+    def test_record_replay(self):
+        trace = six.StringIO()
+        ops = PyfilesystemFuseOperations(fs.open_fs('mem://'), trace=trace)
+        self._workload(ops)
+        ops.destroy('/')
+        entries = list(TraceReplayer.load(six.StringIO(trace.getvalue())))
+        self.assertEqual(len(entries), 11)
+        self.assertEqual(entries[2]['args'], ['/dir/file.txt', {'size': 13}, 0, entries[1]['result']])
+        self.assertEqual(entries[5]['result'], 5)
+        self.assertEqual(entries[-1]['errno'], errno.ENOENT)
+
+        target = fs.open_fs('mem://')
+        # offset the handles of the replayed operations
+        target_ops = PyfilesystemFuseOperations(target)
+        target_ops.descriptors.add(six.BytesIO())
+        summary = TraceReplayer(target_ops).replay(six.StringIO(trace.getvalue()))
+        self.assertEqual(summary['calls'], 11)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['mismatches'], 0)
+        self.assertEqual(target.getbytes('dir/file.txt'), b'\0' * 13)
+
+    def test_raw_fi(self):
+        trace = six.StringIO()
+        recorder = TraceRecorder(trace)
+        fi = fuse.fuse_file_info(flags=os.O_RDONLY, fh=7)
+        recorder.record('open', ('/file.txt', fi), 0, 0, 0)
+        recorder.record('read', ('/file.txt', 4, 0, fi), 0, 0, b'data')
+        recorder.close()
+        recorder.record('release', ('/file.txt', fi), 0, 0)
+        entries = list(TraceReplayer.load(six.StringIO(trace.getvalue())))
+        self.assertEqual(entries[0]['args'], ['/file.txt', os.O_RDONLY])
+        self.assertEqual(entries[0]['result'], 7)
+        self.assertEqual(entries[1]['args'], ['/file.txt', 4, 0, 7])
+        self.assertEqual(len(entries), 2)
+        with self.assertRaises(ValueError):
+            TraceReplayer(PyfilesystemFuseOperations(fs.open_fs('mem://'), raw_fi=True))
+
+
+class TestSharedHandles(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.fs.setbytes('file.txt', b'Hello, World!')
+
+    def test_shared(self):
+        for options in ({}, {'block_cache_size': 0}):
+            ops = PyfilesystemFuseOperations(self.fs, attr_timeout=0, **options)
+            with mock.patch.object(self.fs, 'openbin', wraps=self.fs.openbin) as m:
+                fds = [ops('open', '/file.txt', os.O_RDONLY) for _ in range(3)]
+                self.assertEqual(m.call_count, 1)
+            self.assertEqual(ops('read', '/file.txt', 5, 7, fds[1]), b'World')
+            self.assertEqual(ops('read', '/file.txt', 5, 0, fds[2]), b'Hello')
+            shared = ops.descriptors[fds[0]]
+            for fd in fds[:-1]:
+                ops('release', '/file.txt', fd)
+            self.assertFalse(shared.file.closed)
+            ops('release', '/file.txt', fds[-1])
+            self.assertTrue(shared.file.closed)
+            self.assertEqual(len(ops.shared_files), 0)
+
+    def test_new_version(self):
+        ops = PyfilesystemFuseOperations(self.fs, attr_timeout=0)
+        old = ops('open', '/file.txt', os.O_RDONLY)
+        fh = ops('open', '/file.txt', os.O_WRONLY | os.O_TRUNC)
+        ops('write', '/file.txt', b'Bye', 0, fh)
+        ops('release', '/file.txt', fh)
+        new = ops('open', '/file.txt', os.O_RDONLY)
+        self.assertIsNot(ops.descriptors[old], ops.descriptors[new])
+        self.assertEqual(ops('read', '/file.txt', 13, 0, new), b'Bye')
+        ops('release', '/file.txt', old)
+        self.assertFalse(ops.descriptors[new].closed)
+        self.assertEqual(len(ops.shared_files), 1)
+
+    def test_local_write(self):
+        # backends such as FTP or S3 read from a copy made on open
+        openbin = self.fs.openbin
+        def snapshot(path, mode='r', **options):
+            if mode == 'r':
+                return six.BytesIO(self.fs.getbytes(path))
+            return openbin(path, mode, **options)
+
+        self.fs.setbytes('file.txt', b'AAAA')
+        for options in ({}, {'block_cache_size': 0}):
+            ops = PyfilesystemFuseOperations(self.fs, **options)
+            with mock.patch.object(self.fs, 'openbin', side_effect=snapshot):
+                old = ops('open', '/file.txt', os.O_RDONLY)
+                fh = ops('open', '/file.txt', os.O_RDWR)
+                ops('write', '/file.txt', b'BBBB', 0, fh)
+                ops('release', '/file.txt', fh)
+                self.assertEqual(ops('read', '/file.txt', 4, 0, old), b'AAAA')
+                new = ops('open', '/file.txt', os.O_RDONLY)
+                self.assertEqual(ops('read', '/file.txt', 4, 0, new), b'BBBB')
+                self.assertEqual(ops('read', '/file.txt', 4, 0, old), b'AAAA')
+                self.assertEqual(ops('read', '/file.txt', 4, 0, new), b'BBBB')
+            ops('release', '/file.txt', old)
+            ops('release', '/file.txt', new)
+            self.fs.setbytes('file.txt', b'AAAA')
+
+    def test_read_after_close(self):
+        opener = mock.Mock(side_effect=lambda: self.fs.openbin('file.txt'))
+        shared = SharedFileTable().acquire('/file.txt', None, opener, lazy=True)
+        read = shared.pread
+        shared.close()
+        with self.assertRaises(ValueError):
+            read(5, 0)
+        self.assertFalse(opener.called)
+
+    def test_failed_open(self):
+        ops = PyfilesystemFuseOperations(self.fs)
+        with mock.patch.object(self.fs, 'openbin', side_effect=fs.errors.PermissionDenied('/file.txt')):
+            with self.assertRaises(fuse.FuseOSError):
+                ops('open', '/file.txt', os.O_RDONLY)
+        self.assertEqual(len(ops.shared_files), 0)
+
+    def test_disabled(self):
+        ops = PyfilesystemFuseOperations(self.fs, share_handles=False)
+        fds = [ops('open', '/file.txt', os.O_RDONLY) for _ in range(2)]
+        self.assertIsNot(ops.descriptors[fds[0]], ops.descriptors[fds[1]])
+
+
+class TestGenerationTable(unittest.TestCase):
+
+    def test_tree(self):
+        table = GenerationTable()
+        self.assertEqual(table.get('/a/b'), 0)
+        self.assertEqual(table.bump('/a/b'), 1)
+        self.assertEqual(table.bump('/a'), 2)
+        self.assertEqual(table.get('/a/b/c'), 2)
+        self.assertEqual(table.get('/x'), 0)
+
+    def test_purge(self):
+        table = GenerationTable(maxsize=4)
+        for i in range(100):
+            table.bump('/file{}'.format(i))
+        self.assertLessEqual(len(table), 4)
+        self.assertEqual(table.get('/file0'), 0)
+
+    def test_pinned(self):
+        table = GenerationTable(maxsize=4)
+        since = table.pin()
+        table.bump('/modified')
+        for i in range(3):
+            table.bump('/file{}'.format(i))
+        self.assertGreater(table.get('/modified'), since)
+        # entries needed by a pinned reader are only evicted when full
+        for i in range(100):
+            table.bump('/file{}'.format(i))
+        self.assertLessEqual(len(table), 4)
+        self.assertGreater(table.get('/modified'), since)
+        table.unpin(since)
+        self.assertEqual(len(table._pins), 0)
+
+    def test_operations(self):
+        memfs = fs.open_fs('mem://')
+        ops = PyfilesystemFuseOperations(memfs, attr_cache_size=8)
+        for i in range(100):
+            ops('mkdir', '/dir{}'.format(i), 0o755)
+            fd = ops('create', '/dir{}/file'.format(i), 0o644)
+            ops('write', '/dir{}/file'.format(i), b'data', 0, fd)
+            ops('release', '/dir{}/file'.format(i), fd)
+        self.assertLessEqual(len(ops.generations), 8)
+        fd = ops('open', '/dir0/file', os.O_RDONLY)
+        self.assertEqual(ops('read', '/dir0/file', 4, 0, fd), b'data')
+        self.assertEqual(len(ops.generations._pins), 1)
+        ops('release', '/dir0/file', fd)
+        self.assertEqual(len(ops.generations._pins), 0)
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.fs = fs.open_fs('mem://')
+        self.data = os.urandom(10000)
+        self.fs.setbytes('file.bin', self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _ops(self, **options):
+        options.setdefault('block_size', 4096)
+        return PyfilesystemFuseOperations(
+            self.fs, disk_cache=self.directory, readahead_size=0, **options)
+
+    def _read(self, ops, size=10000, offset=0):
+        fd = ops('open', '/file.bin', os.O_RDONLY)
+        try:
+            return ops('read', '/file.bin', size, offset, fd)
+        finally:
+            ops('release', '/file.bin', fd)
+
+    def test_persistent(self):
+        ops = self._ops()
+        self.assertEqual(self._read(ops), self.data)
+        # keep the same backend, so that the file keeps its mtime
+        ops.disk_cache.close()
+        ops = self._ops()
+        with mock.patch.object(self.fs, 'openbin') as m:
+            self.assertEqual(self._read(ops, 100, 5000), self.data[5000:5100])
+            self.assertFalse(m.called)
+        self.assertEqual(ops.disk_cache.hits, 1)
+
+    def test_block_size(self):
+        ops = self._ops()
+        self._read(ops)
+        ops.disk_cache.close()
+        ops = self._ops(block_size=8192)
+        self.assertEqual(self._read(ops), self.data)
+        self.assertEqual(ops.disk_cache.hits, 0)
+        ops.disk_cache.close()
+
+    def test_batched_commits(self):
+        cache = DiskCache(self.directory)
+        with mock.patch.object(cache, '_db', wraps=cache._db) as db:
+            for offset in range(0, 40, 4):
+                cache.set('/file.bin', (1, 2), offset, 4, b'data')
+            self.assertFalse(db.commit.called)
+            self.assertEqual(cache.get('/file.bin', (1, 2), 36, 4), b'data')
+            cache.close()
+            self.assertEqual(db.commit.call_count, 1)
+        self.assertEqual(len(DiskCache(self.directory)), 10)
+        self.assertEqual(cache.hit_rate, 1.0)
+
+    def test_version(self):
+        ops = self._ops(attr_timeout=0)
+        self._read(ops)
+        self.fs.setbytes('file.bin', b'changed')
+        self.assertEqual(self._read(ops), b'changed')
+
+    def test_eviction(self):
+        ops = self._ops(disk_cache_size=8192)
+        self._read(ops)
+        self.assertLessEqual(ops.disk_cache.size, 8192)
+        self.assertEqual(len(ops.disk_cache), 2)
+        blocks = [f for f in os.listdir(self.directory) if f.endswith('.block')]
+        self.assertEqual(len(blocks), 2)
+
+    def test_corrupted(self):
+        ops = self._ops()
+        self._read(ops)
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.block'):
+                with open(os.path.join(self.directory, filename), 'r+b') as f:
+                    f.write(b'garbage')
+        ops.block_cache.clear()
+        self.assertEqual(self._read(ops), self.data)
+        self.assertEqual(ops.disk_cache.hits, 0)
+
+    def test_recover(self):
+        cache = DiskCache(self.directory)
+        cache.set('/file.bin', (1, 2), 0, 4, b'data')
+        cache.set('/file.bin', (1, 2), 4, 4, b'more')
+        cache.close()
+        open(os.path.join(self.directory, 'orphan.block'), 'w').close()
+        open(os.path.join(self.directory, 'partial.tmp'), 'w').close()
+        os.remove(cache._filename(cache._name('/file.bin', (1, 2), 4, 4)))
+        cache = DiskCache(self.directory)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 4)
+        self.assertEqual(cache.get('/file.bin', (1, 2), 0, 4), b'data')
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            sorted(['index.sqlite', cache._name('/file.bin', (1, 2), 0, 4) + '.block']))
+        cache.discard('/file.bin')
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+
+class TestStatRecords(unittest.TestCase):
+
+    def test_record(self):
+        record = StatRecord(('st_mode', 'st_size'), (stat.S_IFREG, 5))
+        self.assertEqual(record['st_size'], 5)
+        self.assertEqual(record.get('st_nlink', 1), 1)
+        self.assertNotIn('st_nlink', record)
+        with self.assertRaises(KeyError):
+            record['st_nlink']
+        self.assertEqual(record, {'st_mode': stat.S_IFREG, 'st_size': 5})
+        self.assertNotEqual(record, {'st_mode': stat.S_IFREG})
+        self.assertEqual(dict(record, st_size=6)['st_size'], 6)
+        self.assertEqual(sorted(record.items()), [('st_mode', stat.S_IFREG), ('st_size', 5)])
+
+    def test_from_infos(self):
+        memfs = fs.open_fs('mem://')
+        for i in range(3):
+            memfs.setbytes('file{}.txt'.format(i), b'x' * i)
+        memfs.makedir('dir')
+        converter = StatConverter()
+        with mock.patch('os.umask') as umask:
+            entries = dict(converter.from_infos(memfs.scandir('/', ['details', 'access'])))
+            self.assertFalse(umask.called)
+        self.assertEqual(entries['file2.txt']['st_size'], 2)
+        self.assertTrue(stat.S_ISDIR(entries['dir']['st_mode']))
+        # records with the same fields share the same tuple of fields
+        self.assertIs(entries['file0.txt'].keys(), entries['file1.txt'].keys())
+        for name, record in entries.items():
+            info = memfs.getinfo(name, ['details', 'access'])
+            self.assertEqual(record, PyfilesystemFuseOperations._stat_from_info(info))
+
+
+class TestCreateTruncate(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = fs.open_fs('mem://')
+        self.ops = PyfilesystemFuseOperations(self.fs)
+
+    def test_create(self):
+        with mock.patch.object(self.fs, 'openbin', wraps=self.fs.openbin) as m:
+            fh = self.ops('create', '/file.txt', 0o644)
+            self.assertEqual(m.call_count, 1)
+        self.ops('write', '/file.txt', b'Hello', 0, fh)
+        self.ops('release', '/file.txt', fh)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Hello')
+        # `O_EXCL` shares its bit with the owner write permission
+        with self.assertRaises(fuse.FuseOSError) as ctx:
+            self.ops('create', '/file.txt', 0o644)
+        self.assertEqual(ctx.exception.errno, errno.EEXIST)
+        fh = self.ops('create', '/file.txt', 0o444)
+        self.ops('release', '/file.txt', fh)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Hello')
+
+    def test_create_writeback(self):
+        ops = PyfilesystemFuseOperations(self.fs, writeback=True)
+        fh = ops('create', '/file.txt', 0o644)
+        self.assertTrue(self.fs.exists('file.txt'))
+        ops('write', '/file.txt', b'Hello', 0, fh)
+        ops('release', '/file.txt', fh)
+        ops.uploader.shutdown()
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Hello')
+
+    def test_truncate_open_handle(self):
+        fh = self.ops('create', '/file.txt', 0o644)
+        self.ops('write', '/file.txt', b'Hello, World!', 0, fh)
+        with mock.patch.object(self.fs, 'openbin') as m:
+            self.ops('truncate', '/file.txt', 5)
+            self.assertFalse(m.called)
+        self.assertEqual(self.ops('getattr', '/file.txt')['st_size'], 5)
+        self.ops('release', '/file.txt', fh)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Hello')
+        self.assertFalse(self.ops._writers)
+
+    def test_truncate_path(self):
+        self.fs.setbytes('file.txt', b'Hello, World!')
+        with mock.patch.object(self.fs, 'create', wraps=self.fs.create) as m:
+            self.ops('truncate', '/file.txt', 0)
+            m.assert_called_once_with('/file.txt', wipe=True)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'')
+        self.fs.setbytes('file.txt', b'Hello, World!')
+        self.ops('truncate', '/file.txt', 5)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'Hello')
+
+    def test_truncate_passthrough(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            osfs = fs.open_fs(tmpdir)
+            osfs.setbytes('file.txt', b'Hello, World!')
+            ops = PyfilesystemFuseOperations(osfs)
+            with mock.patch.object(osfs, 'openbin') as m:
+                ops('truncate', '/file.txt', 5)
+                self.assertFalse(m.called)
+            self.assertEqual(osfs.getbytes('file.txt'), b'Hello')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_create_truncate(self):
+        self.fs.setbytes('file.txt', b'Hello')
+        ops = PyfilesystemFuseOperations(self.fs, raw_fi=True)
+        fi = fuse.fuse_file_info(flags=os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        ops('create', '/file.txt', 0o644, fi)
+        ops('release', '/file.txt', fi)
+        self.assertEqual(self.fs.getbytes('file.txt'), b'')
+        fi = fuse.fuse_file_info(flags=os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        with self.assertRaises(fuse.FuseOSError) as ctx:
+            ops('create', '/file.txt', 0o644, fi)
+        self.assertEqual(ctx.exception.errno, errno.EEXIST)
+
+    def test_unlink_forgets_handle(self):
+        fh = self.ops('create', '/file.txt', 0o644)
+        self.ops('write', '/file.txt', b'Hello', 0, fh)
+        self.ops('unlink', '/file.txt')
+        with self.assertRaises(fuse.FuseOSError) as ctx:
+            self.ops('truncate', '/file.txt', 0)
+        self.assertEqual(ctx.exception.errno, errno.ENOENT)
+        self.ops('release', '/file.txt', fh)
+
+    def test_rename_forgets_handle(self):
+        fh = self.ops('create', '/file.txt', 0o644)
+        self.ops('rename', '/file.txt', '/other.txt')
+        self.assertFalse(self.ops._writers)
+        self.ops('release', '/other.txt', fh)
+
+
+class TestPathLocks(unittest.TestCase):
+
+    def _blocked(self, func, *args):
+        """Check whether ``func`` blocks, and let it finish afterwards.
+        """
+        done = threading.Event()
+        def target():
+            func(*args)
+            done.set()
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        blocked = not done.wait(0.1)
+        return blocked, done, thread
+
+    def test_rwlock(self):
+        lock = RWLock()
+        self.assertEqual(lock.acquire(), 0.0)
+        blocked, _, _ = self._blocked(lock.acquire)
+        self.assertFalse(blocked)
+        blocked, done, thread = self._blocked(lock.acquire, True)
+        self.assertTrue(blocked)
+        # readers queue behind a waiting writer
+        blocked, read_done, _ = self._blocked(lock.acquire)
+        self.assertTrue(blocked)
+        lock.release()
+        lock.release()
+        thread.join()
+        self.assertFalse(read_done.is_set())
+        lock.release(True)
+        self.assertTrue(read_done.wait(1))
+
+    def test_operations(self):
+        memfs = fs.open_fs('mem://')
+        memfs.setbytes('a.txt', b'a')
+        ops = PyfilesystemFuseOperations(memfs, lock_stripes=1)
+        fd = ops('open', '/a.txt', os.O_RDONLY)
+        with ops.locks.locked('test', ['/a.txt']):
+            blocked, _, _ = self._blocked(ops, 'read', '/a.txt', 1, 0, fd)
+            self.assertFalse(blocked)
+        with ops.locks.locked('test', ['/a.txt'], write=True):
+            blocked, done, thread = self._blocked(ops, 'rename', '/a.txt', '/b.txt')
+            self.assertTrue(blocked)
+        thread.join()
+        self.assertTrue(memfs.exists('b.txt'))
+        waits = ops.stats.snapshot()['rename']['lock_wait']
+        self.assertEqual(waits['waits'], 1)
+        self.assertGreater(waits['seconds'], 0)
+
+    def test_lock_paths(self):
+        ops = PyfilesystemFuseOperations(fs.open_fs('mem://'))
+        self.assertEqual(ops._lock_paths('getattr', ('/a/b',)), ({'/a/b'}, set()))
+        self.assertEqual(ops._lock_paths('read', ('/a/b', 1, 0, 0)), ({'/a/b'}, set()))
+        self.assertEqual(ops._lock_paths('write', ('/a/b', b'', 0, 0)), (set(), {'/a/b'}))
+        self.assertEqual(ops._lock_paths('mkdir', ('/a', 0o755)), (set(), {'/', '/a'}))
+        self.assertEqual(
+            ops._lock_paths('rename', ('/a/b', '/c')), (set(), {'/', '/a', '/a/b', '/c'}))
+        self.assertEqual(ops._lock_paths('rmdir', ('/',)), (set(), {'/'}))
+
+    def test_unrelated_namespace(self):
+        memfs = fs.open_fs('mem://')
+        memfs.makedirs('deep/dir')
+        memfs.setbytes('deep/dir/big', b'big')
+        ops = PyfilesystemFuseOperations(memfs, lock_stripes=1024)
+        stripes = {hash(p) % 1024 for p in ('/', '/unrelated', '/deep/dir/big')}
+        if len(stripes) < 3:
+            self.skipTest('paths hashed to the same stripe')
+        fd = ops('open', '/deep/dir/big', os.O_RDONLY)
+        shared, exclusive = ops._lock_paths('read', ('/deep/dir/big', 3, 0, fd))
+        with ops.locks.locked('read', shared, exclusive=exclusive):
+            blocked, _, _ = self._blocked(ops, 'mkdir', '/unrelated', 0o755)
+            self.assertFalse(blocked)
+        ops('release', '/deep/dir/big', fd)
+
+    def test_namespace(self):
+        memfs = fs.open_fs('mem://')
+        memfs.makedir('d')
+        ops = PyfilesystemFuseOperations(memfs)
+        moving, moved = threading.Event(), threading.Event()
+        movedir = memfs.movedir
+        def slow_movedir(*args, **kwargs):
+            moving.set()
+            moved.wait()
+            return movedir(*args, **kwargs)
+
+        with mock.patch.object(memfs, 'movedir', side_effect=slow_movedir):
+            renaming = threading.Thread(target=ops, args=('rename', '/d', '/e'))
+            renaming.daemon = True
+            renaming.start()
+            errors = []
+            def create():
+                try:
+                    ops('create', '/d/x', 0o644)
+                except OSError as err:
+                    errors.append(err.errno)
+            try:
+                self.assertTrue(moving.wait(1))
+                blocked, done, thread = self._blocked(create)
+                self.assertTrue(blocked)
+            finally:
+                moved.set()
+            renaming.join()
+            thread.join()
+        self.assertEqual(errors, [errno.ENOENT])
+        self.assertFalse(memfs.exists('e/x'))
+
+    def test_unrelated_paths(self):
+        locks = PathLockManager(stripes=1024)
+        paths = ['/file{}'.format(i) for i in range(3)]
+        stripes = {hash(p) % 1024 for p in paths}
+        if len(stripes) < len(paths):
+            self.skipTest('paths hashed to the same stripe')
+        with locks.locked('write', paths[:1], write=True):
+            blocked, _, _ = self._blocked(
+                lambda: locks.locked('write', paths[1:], write=True).__enter__())
+            self.assertFalse(blocked)
+
+    def test_disabled(self):
+        ops = PyfilesystemFuseOperations(fs.open_fs('mem://'), lock_stripes=0)
+        self.assertIsNone(ops.locks)
+        ops('getattr', '/')
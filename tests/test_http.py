@@ -39,6 +39,46 @@ class TestGuessType(unittest.TestCase):
         self.assertEqual(self.mimetype('FILE.BULLSHIT'), 'application/octet-stream')
 
 
+class TestParseRanges(unittest.TestCase):
+
+    @staticmethod
+    def parse(header, size=100):
+        return PyfilesystemServerHandler.parse_ranges(header, size)
+
+    def test_single(self):
+        self.assertEqual(self.parse('bytes=0-9'), [(0, 9)])
+        self.assertEqual(self.parse('bytes=90-'), [(90, 99)])
+        self.assertEqual(self.parse('bytes=-10'), [(90, 99)])
+        self.assertEqual(self.parse('bytes=-200'), [(0, 99)])
+        self.assertEqual(self.parse('bytes=50-500'), [(50, 99)])
+
+    def test_multiple(self):
+        self.assertEqual(self.parse('bytes=0-0, -1'), [(0, 0), (99, 99)])
+        self.assertEqual(self.parse('bytes=0-9,200-300'), [(0, 9)])
+
+    def test_merged(self):
+        self.assertEqual(self.parse('bytes=50-59,0-9'), [(0, 9), (50, 59)])
+        self.assertEqual(self.parse('bytes=0-9,5-19,20-29'), [(0, 29)])
+        self.assertEqual(self.parse('bytes=0-,0-,-10'), [(0, 99)])
+        self.assertEqual(self.parse('bytes=' + ','.join(['0-9'] * 64)), [(0, 9)])
+
+    def test_too_many(self):
+        self.assertIsNone(self.parse('bytes=' + ','.join(['0-'] * 1000)))
+
+    def test_unsatisfiable(self):
+        self.assertEqual(self.parse('bytes=100-'), [])
+        self.assertEqual(self.parse('bytes=-0'), [])
+        self.assertEqual(self.parse('bytes=-1', size=0), [])
+
+    def test_invalid(self):
+        for header in ('lines=0-9', 'bytes=', 'bytes=9-0', 'bytes=a-b', 'bytes=-', 'bytes=5'):
+            self.assertIsNone(self.parse(header), header)
+
+    def test_non_ascii_digits(self):
+        for header in ('bytes=\u00b2-3', 'bytes=0-\u0663', 'bytes=-\uff11', 'bytes=0-1-2'):
+            self.assertIsNone(self.parse(header), header)
+
+
 class TestExposeHTTP(unittest.TestCase):
 
     host = 'localhost'
@@ -145,6 +185,60 @@ class TestExposeHTTP(unittest.TestCase):
             self.assertEqual(res.headers['Content-type'], 'text/plain')
             self.assertEqual(int(res.headers['Content-Length']), len(b'Hello, World!'))
 
+    def _get(self, resource, **headers):
+        request = Request(self._url(resource))
+        for name, value in headers.items():
+            request.add_header(name.replace('_', '-'), value)
+        return closing(urlopen(request))
+
+    @retry
+    def test_range(self):
+        with self._get('root.txt') as res:
+            self.assertEqual(res.headers['Accept-Ranges'], 'bytes')
+            self.assertIsNotNone(res.headers['ETag'])
+        with self._get('root.txt', Range='bytes=7-11') as res:
+            self.assertEqual(res.code, 206)
+            self.assertEqual(res.headers['Content-Range'], 'bytes 7-11/13')
+            self.assertEqual(int(res.headers['Content-Length']), 5)
+            self.assertEqual(res.read(), b'World')
+        with self._get('root.txt', Range='bytes=-6') as res:
+            self.assertEqual(res.read(), b'World!')
+
+    @retry
+    def test_range_if_range(self):
+        with self._get('root.txt') as res:
+            etag = res.headers['ETag']
+            modified = res.headers['Last-Modified']
+        for validator in (etag, modified):
+            with self._get('root.txt', Range='bytes=0-4', If_Range=validator) as res:
+                self.assertEqual(res.code, 206)
+                self.assertEqual(res.read(), b'Hello')
+        with self._get('root.txt', Range='bytes=0-4', If_Range='"stale"') as res:
+            self.assertEqual(res.code, 200)
+            self.assertEqual(res.read(), b'Hello, World!')
+
+    @retry
+    def test_range_multipart(self):
+        with self._get('root.txt', Range='bytes=0-4,7-11') as res:
+            self.assertEqual(res.code, 206)
+            ctype = res.headers['Content-type']
+            self.assertTrue(ctype.startswith('multipart/byteranges; boundary='))
+            boundary = ctype.split('=', 1)[1].encode('utf-8')
+            body = res.read()
+            self.assertEqual(int(res.headers['Content-Length']), len(body))
+        parts = body.split(b'--' + boundary)
+        self.assertEqual(len(parts), 4)
+        self.assertIn(b'Content-Range: bytes 0-4/13\r\n\r\nHello\r\n', parts[1])
+        self.assertIn(b'Content-Range: bytes 7-11/13\r\n\r\nWorld\r\n', parts[2])
+        self.assertEqual(parts[3], b'--\r\n')
+
+    @retry
+    def test_range_not_satisfiable(self):
+        with self.assertRaises(HTTPError) as err:
+            self._get('root.txt', Range='bytes=20-').__enter__()
+        self.assertEqual(err.exception.code, 416)
+        self.assertEqual(err.exception.headers['Content-Range'], 'bytes */13')
+
     @retry
     def test_mime_type(self):
         request = Request(self._url('video.mp4'))